@@ -0,0 +1,93 @@
+"""
+--------------------------------------------------------------------------
+bench_parallel.py - parallel parse scaling benchmark
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Parallel parse benchmark. Generates a synthetic gcode file, parses it serially
+and with 1..N worker processes & reports how the parse time scales with the
+number of cores. Every parallel result is checked against the serial one.
+
+Usage: python bench_parallel.py [lines] [max workers]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plotbot"))
+
+import program
+
+
+def write_gcode(path, lines):
+    """Simple polylines with a pen lift every 50 moves"""
+    rng = random.Random(301)
+    with open(path, "w") as f:
+        f.write("G90\nG00 Z2.000\n")
+        for i in range(lines):
+            if i % 50 == 0:
+                f.write("G00 Z2.000\n")
+                f.write(f"G00 X{rng.uniform(0, 200):.3f} Y{rng.uniform(0, 200):.3f}\n")
+                f.write("G01 Z-1.000 F400\n")
+            f.write(f"G01 X{rng.uniform(0, 200):.3f} Y{rng.uniform(0, 200):.3f} (seg {i})\n")
+        f.write("G00 Z2.000\nM05\nM30\n")
+
+
+def same(a, b):
+    return all(bytes(getattr(a, name)) == bytes(getattr(b, name))
+               for name in program.ColumnarProgram.columns)
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.nc")
+        write_gcode(path, lines)
+
+        serial, serial_time = timed(program.load, path)
+        print(f"{len(serial)} commands, serial parse {serial_time:.3f} s")
+        print("workers   time [s]   speedup")
+        for workers in range(1, max_workers + 1):
+            result, elapsed = timed(program.load, path, workers=workers)
+            if not same(serial, result):
+                print(f"MISMATCH with {workers} workers")
+                sys.exit(1)
+            print(f"{workers:7d}   {elapsed:8.3f}   {serial_time / elapsed:7.2f}x")
@@ -0,0 +1,101 @@
+"""
+--------------------------------------------------------------------------
+bench_startup.py - startup benchmark
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Startup benchmark. Times, in fresh interpreters (best of a few runs, less the
+time an empty interpreter takes to start):
+
+  import <module>   for the modules a job or a tool starts with
+  get_robot()       setting up the robot & its (simulated) pins
+
+& checks that importing parse leaves the GPIO alone, so parsing & validating
+files never needs the hardware.
+
+Usage: python bench_startup.py [--repeat N] [--output FILE]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+PLOTBOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plotbot")
+
+MODULES = ("robot", "parse", "program", "cache", "estimate", "compiler", "plotbot")
+
+SETUP_ROBOT = "import gpio; gpio.use('sim'); import robot; robot.get_robot()"
+
+# Exits 1 if importing parse picked a GPIO backend (i.e. touched the pins)
+GPIO_UNTOUCHED = "import parse, gpio, sys; sys.exit(gpio._backend is not None)"
+
+
+def run(code):
+    """Seconds to run code in a new interpreter"""
+    environment = dict(os.environ, PLOTBOT_GPIO_LOG="0")
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=PLOTBOT, env=environment, check=True,
+                   stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def best_of(repeat, code):
+    return min(run(code) for _ in range(repeat))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark plotbot startup.")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--output", help="also write the results to FILE (JSON)")
+    args = arg_parser.parse_args()
+
+    # Compile everything first so the first timing isn't writing .pyc files
+    subprocess.run([sys.executable, "-m", "compileall", "-q", PLOTBOT], check=True)
+    baseline = best_of(args.repeat, "pass")
+    results = {"interpreter": baseline}
+    for module in MODULES:
+        results["import " + module] = best_of(args.repeat, f"import {module}") - baseline
+    results["get_robot()"] = best_of(args.repeat, SETUP_ROBOT) - results["import robot"] \
+        - baseline
+    results["parse leaves GPIO alone"] = \
+        subprocess.run([sys.executable, "-c", GPIO_UNTOUCHED], cwd=PLOTBOT).returncode == 0
+
+    for name, value in results.items():
+        if isinstance(value, float):
+            print(f"{name:24s} {value * 1000:8.1f} ms")
+        else:
+            print(f"{name:24s} {value}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    sys.exit(0 if results["parse leaves GPIO alone"] else 1)
@@ -0,0 +1,156 @@
+"""
+--------------------------------------------------------------------------
+gcodegen.py - synthetic gcode for benchmarks
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Synthetic gcode for benchmarks. Each shape stresses a different part of the
+pipeline:
+
+  polylines  long runs of G01 with the pen down
+  dense      many very short segments (CAM output for curves)
+  lifts      short strokes with a pen lift & travel move between each
+  arcs       G02/G03 circles & arcs (I/J and R forms)
+  comments   the above with a GRBL-Plotter style header & a comment on
+             every line, like square.nc
+  mixed      a bit of everything
+
+Files are reproducible for a given shape, size & seed.
+
+Usage: python gcodegen.py SHAPE LINES [OUTPUT] [--seed N]
+"""
+
+import argparse
+import math
+import random
+import sys
+
+SHAPES = ("polylines", "dense", "lifts", "arcs", "comments", "mixed")
+
+SIZE = 200.0  # [mm] drawing area
+PEN_UP = "G00 Z2.000"
+PEN_DOWN = "G01 Z-1.000 F400"
+
+
+def header(lines):
+    return [
+        "( Simple Shape by GRBL-Plotter 1.7.3.1 )",
+        "(<Header >)",
+        f"( G-Code lines: {lines} )",
+        "( Pen Down/Up : many times )",
+        "( Duration ca.: unknown )",
+        "(</Header >)",
+        "G54 (Setup - GCode-Header)",
+        "G90",
+        PEN_UP,
+        "M3 S20000 (StartJob)",
+    ]
+
+
+def footer():
+    return [PEN_UP, "M05(EndJob)", "M30"]
+
+
+def polyline(rng, lines, step):
+    """A random walk of lines moves, each about step mm long"""
+    x, y = rng.uniform(0, SIZE), rng.uniform(0, SIZE)
+    heading = rng.uniform(0, 2 * math.pi)
+    out = [f"G00 X{x:.3f} Y{y:.3f}", PEN_DOWN]
+    for _ in range(lines):
+        heading += rng.gauss(0, 0.3)
+        x = min(SIZE, max(0.0, x + step * math.cos(heading)))
+        y = min(SIZE, max(0.0, y + step * math.sin(heading)))
+        out.append(f"G01 X{x:.3f} Y{y:.3f}")
+    out.append(PEN_UP)
+    return out
+
+
+def circle(rng):
+    radius = rng.uniform(1, 20)
+    x, y = rng.uniform(radius, SIZE - radius), rng.uniform(radius, SIZE - radius)
+    out = [f"G00 X{x:.3f} Y{y:.3f}", PEN_DOWN]
+    if rng.random() < 0.5:
+        # Full circle, I/J form
+        out.append(f"G02 X{x:.3f} Y{y:.3f} I{radius:.3f} J0.000")
+    else:
+        # Half circle there & back, R form
+        out.append(f"G03 X{x + 2 * radius:.3f} Y{y:.3f} R{radius:.3f}")
+        out.append(f"G03 X{x:.3f} Y{y:.3f} R{radius:.3f}")
+    out.append(PEN_UP)
+    return out
+
+
+def body(shape, lines, rng):
+    """Roughly lines lines of gcode of the given shape"""
+    out = []
+    while len(out) < lines:
+        if shape == "polylines":
+            out += polyline(rng, 500, 2.0)
+        elif shape == "dense":
+            out += polyline(rng, 500, 0.05)
+        elif shape == "lifts":
+            out += polyline(rng, 3, 5.0)
+        elif shape == "arcs":
+            out += circle(rng)
+        elif shape == "mixed":
+            kind = rng.choice(("polylines", "dense", "lifts", "arcs"))
+            out += body(kind, 50, rng)
+        else:
+            raise ValueError(f"unknown shape {shape}")
+    return out[:lines] + [PEN_UP]
+
+
+def generate(shape, lines, seed=301):
+    """The lines of a synthetic gcode file"""
+    rng = random.Random(seed)
+    if shape == "comments":
+        moves = body("mixed", lines, rng)
+        moves = [f"{line} (line {i} of the figure)" for i, line in enumerate(moves)]
+    else:
+        moves = body(shape, lines, rng)
+    return header(len(moves)) + moves + footer()
+
+
+def write(path, shape, lines, seed=301):
+    with open(path, "w") as f:
+        f.write("\n".join(generate(shape, lines, seed)) + "\n")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Write a synthetic gcode file.")
+    arg_parser.add_argument("shape", choices=SHAPES)
+    arg_parser.add_argument("lines", type=int)
+    arg_parser.add_argument("output", nargs="?")
+    arg_parser.add_argument("--seed", type=int, default=301)
+    args = arg_parser.parse_args()
+    if args.output:
+        write(args.output, args.shape, args.lines, args.seed)
+    else:
+        sys.stdout.write("\n".join(generate(args.shape, args.lines, args.seed)) + "\n")
@@ -0,0 +1,208 @@
+"""
+--------------------------------------------------------------------------
+run.py - benchmark suite
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Benchmark suite. Generates synthetic gcode (see gcodegen.py) of each shape &
+times the stages of the pipeline on it:
+
+  lexer.read         the original character-at-a-time Lexer (timed on a
+                     smaller file & scaled up, it's slow)
+  mapped_lexer.read  MappedLexer
+  parser.parse       Parser on the MappedLexer tokens
+  parse.parse        the whole (uncached) parse
+  program.load       the columnar parse
+
+plus the Robot/Stepper step loop. Each timing is the best of a few runs. The
+GPIO is simulated (gpio.SimGPIO) so this runs on any Linux box.
+
+Results are written as JSON. Pass --compare with an earlier results file to
+flag anything that got slower by more than --threshold.
+
+Usage: python run.py [--lines N] [--output FILE] [--compare FILE]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import gcodegen
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plotbot"))
+
+import gpio
+
+# Simulated pins, without the write log, so the step loop measures our code
+# rather than the pins (or the log)
+os.environ.setdefault("PLOTBOT_GPIO_LOG", "0")
+gpio.use("sim")
+with contextlib.redirect_stdout(io.StringIO()):
+    import parse
+    import program
+    import robot
+
+
+def best_of(repeat, function, *args):
+    """Shortest time [s] of repeat calls (with the pipeline's prints hidden)"""
+    best = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function(*args)
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def lex(path):
+    with open(path) as f:
+        lexer = parse.Lexer(parse.Peekable(f.read()))
+    lexer.read()
+    return lexer.tokens
+
+
+def mapped_lex(path):
+    with parse.MappedLexer(path) as lexer:
+        lexer.read()
+        return lexer.tokens
+
+
+def bench_parse(path, repeat):
+    results = {"bytes": os.path.getsize(path)}
+    results["mapped_lexer.read"] = best_of(repeat, mapped_lex, path)
+    with parse.MappedLexer(path) as lexer:
+        lexer.read()
+        tokens = list(lexer.tokens)
+        results["parser.parse"] = best_of(repeat, lambda: parse.Parser(tokens).parse())
+        del tokens
+        lexer.tokens = []
+    results["parse.parse"] = best_of(repeat, parse.parse, path)
+    results["program.load"] = best_of(repeat, program.load, path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        results["commands"] = len(program.load(path))
+    return results
+
+
+def bench_steps(steps, repeat):
+    robot_ = robot.get_robot()
+    robot_.scheduler = None  # our code's speed, not the motors'
+    def run():
+        robot_.move(steps * robot.STEP_LENGTH)
+    elapsed = best_of(repeat, run)
+    return {"steps": steps, "seconds": elapsed, "steps_per_second": steps / elapsed}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new, threshold):
+    """Lines describing every timing in new that's threshold (fraction) slower
+    than in old"""
+    regressions = []
+    for shape, timings in new["parse"].items():
+        for stage, seconds in timings.items():
+            before = old.get("parse", {}).get(shape, {}).get(stage)
+            if stage in ("bytes", "commands") or not before:
+                continue
+            if seconds > before * (1 + threshold):
+                regressions.append(f"{shape} {stage}: {before:.4f} s -> {seconds:.4f} s")
+    before = old.get("steps", {}).get("steps_per_second")
+    after = new["steps"]["steps_per_second"]
+    if before and after < before / (1 + threshold):
+        regressions.append(f"step loop: {before:.0f} -> {after:.0f} steps/s")
+    return regressions
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark the plotbot pipeline.")
+    arg_parser.add_argument("--lines", type=int, default=20000,
+                            help="lines of gcode per shape")
+    arg_parser.add_argument("--legacy-lines", type=int, default=2000,
+                            help="lines per shape for the (slow) original Lexer; 0 skips it")
+    arg_parser.add_argument("--shapes", nargs="+", choices=gcodegen.SHAPES,
+                            default=list(gcodegen.SHAPES))
+    arg_parser.add_argument("--steps", type=int, default=100000,
+                            help="steps for the step loop benchmark")
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    arg_parser.add_argument("--output", default="bench_results.json")
+    arg_parser.add_argument("--compare", metavar="FILE",
+                            help="earlier results to check for regressions")
+    arg_parser.add_argument("--threshold", type=float, default=0.10,
+                            help="slowdown (fraction) that counts as a regression")
+    args = arg_parser.parse_args()
+
+    results = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "lines": args.lines,
+        "parse": {},
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        for shape in args.shapes:
+            path = os.path.join(directory, shape + ".nc")
+            gcodegen.write(path, shape, args.lines)
+            results["parse"][shape] = bench_parse(path, args.repeat)
+            if args.legacy_lines:
+                gcodegen.write(path, shape, args.legacy_lines)
+                results["parse"][shape]["lexer.read"] = \
+                    best_of(args.repeat, lex, path) * args.lines / args.legacy_lines
+            timings = results["parse"][shape]
+            print(f"{shape:10s} " + "  ".join(
+                f"{stage} {seconds:.4f}" for stage, seconds in timings.items()
+                if stage not in ("bytes", "commands")))
+    results["steps"] = bench_steps(args.steps, args.repeat)
+    print(f"step loop  {results['steps']['steps_per_second']:.0f} steps/s")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
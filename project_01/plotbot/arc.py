@@ -0,0 +1,118 @@
+"""
+--------------------------------------------------------------------------
+arc.py - arc linearization
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Arc (G02/G03) linearization. The robot can only drive straight lines, so arcs
+are broken into the fewest chords that stay within CHORD_TOLERANCE [mm] of the
+true arc.
+
+For a radius r, a chord spanning angle d strays at most r * (1 - cos(d / 2))
+from the arc, which gives the largest usable chord angle. Circle-heavy files
+reuse the same handful of radii thousands of times, so that angle is cached per
+(radius, tolerance). Each arc then splits its own sweep into the fewest equal
+chords, & the chord points are found by rotating the last one by the chord
+angle (one cos/sin per arc, not per point).
+"""
+
+import functools
+import math
+
+CHORD_TOLERANCE = 0.01  # [mm]
+
+TWO_PI = 2 * math.pi
+
+
+@functools.lru_cache(maxsize=256)
+def chord_angle(radius, tolerance):
+    """The largest angle [rad] a chord can span & stay within tolerance of an
+    arc of radius (at most half a circle)"""
+    if radius <= tolerance:
+        return math.pi
+    return 2 * math.acos(1 - tolerance / radius)
+
+
+def center_from_radius(start, end, R, clockwise):
+    """Center of an R-format arc. A negative R means the long way round."""
+    dx = end[0] - start[0]
+    dy = end[1] - start[1]
+    chord = math.hypot(dx, dy)
+    if chord == 0:
+        raise ValueError("R arc with the same start & end point")
+    # Clamp so a radius that's a hair too short (rounding) still works
+    h = math.sqrt(max(0.0, R * R - chord * chord / 4))
+    side = -1.0 if clockwise else 1.0  # minor arcs: center right of CW, left of CCW
+    if R < 0:
+        side = -side
+    return (start[0] + dx / 2 - side * h * dy / chord,
+            start[1] + dy / 2 + side * h * dx / chord)
+
+
+def linearize(start, end, center, clockwise, tolerance=None):
+    """Points (after start, ending exactly at end) of the chords that
+    approximate the arc from start to end about center. An arc that ends
+    where it starts is a full circle."""
+    if tolerance is None:
+        tolerance = CHORD_TOLERANCE
+    cx, cy = center
+    radius = math.hypot(start[0] - cx, start[1] - cy)
+    if radius == 0:
+        return [end]
+    a0 = math.atan2(start[1] - cy, start[0] - cx)
+    a1 = math.atan2(end[1] - cy, end[0] - cx)
+    sweep = (a0 - a1) if clockwise else (a1 - a0)
+    sweep %= TWO_PI
+    if sweep < 1e-12:
+        sweep = TWO_PI
+
+    # Round the radius so float noise doesn't defeat the cache
+    count = max(1, math.ceil(sweep / chord_angle(round(radius, 6), tolerance) - 1e-9))
+    step = (-sweep if clockwise else sweep) / count
+    rotation = complex(math.cos(step), math.sin(step))
+    point = complex(start[0] - cx, start[1] - cy)
+    points = []
+    for _ in range(1, count):
+        point *= rotation
+        points.append((cx + point.real, cy + point.imag))
+    points.append(end)
+    return points
+
+
+def arc_points(start, end, clockwise, I=None, J=None, R=None, tolerance=None):
+    """Chord points for a G02/G03 given its I/J (center offset from start) or R
+    words. Missing I/J count as 0."""
+    if I is None and J is None:
+        if R is None:
+            raise ValueError("arc needs I/J or R")
+        center = center_from_radius(start, end, R, clockwise)
+    else:
+        center = (start[0] + (I or 0.0), start[1] + (J or 0.0))
+    return linearize(start, end, center, clockwise, tolerance)
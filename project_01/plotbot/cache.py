@@ -0,0 +1,194 @@
+"""
+--------------------------------------------------------------------------
+cache.py - on-disk cache of parsed programs
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Compiled-program cache. Parsed programs (program.ColumnarProgram) are stored
+on disk keyed by a hash of the gcode file's contents & the parser version, so
+re-running a job we've already seen skips the Lexer/Parser entirely.
+
+Cache files are just a small header followed by each column's raw bytes. On a
+hit the file is memory-mapped & the columns are zero-copy views into it.
+
+The cache is size-bounded; least recently used entries (by mtime, which is
+bumped on every hit) are evicted first. Checkpoints of unfinished jobs are
+never evicted.
+"""
+
+from array import array
+import hashlib
+import logging
+import mmap
+import os
+import struct
+
+import arc
+import parse
+import program
+
+MAGIC = b"PBC1"
+HEADER = struct.Struct("<4sIQ")  # magic, parser version, row count
+SUFFIX = ".pbc"
+# What's kept in the cache directory under its size limit: programs,
+# incremental parse state (incremental.py) & command indexes (checkpoint.py)
+SUFFIXES = (SUFFIX, ".inc", ".idx")
+# Checkpoints of unfinished jobs (checkpoint.py) also live there, but are
+# never evicted or cleared, & nor are their indexes, so a job can always be
+# resumed. They're small & go when the job finishes.
+CHECKPOINT = ".ckpt"
+
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "plotbot")
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Typecode of each stored column, in ColumnarProgram.columns order
+TYPECODES = {name: "d" for name in program.ColumnarProgram.columns}
+TYPECODES["op"] = "B"
+
+
+def _padding(size):
+    """Bytes needed to keep the next column 8-byte aligned"""
+    return -size % 8
+
+
+class ProgramCache:
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or os.environ.get("PLOTBOT_CACHE_DIR", DEFAULT_DIR)
+        self.max_bytes = max_bytes if max_bytes is not None else int(
+            os.environ.get("PLOTBOT_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+
+    def key(self, filename):
+        """Content hash of filename + the parser version & arc tolerance"""
+        digest = hashlib.sha256(b"%d:%r:" % (parse.PARSER_VERSION, arc.CHORD_TOLERANCE))
+        with open(filename, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def load(self, filename, workers=None):
+        """Return the program for filename, from the cache if possible."""
+        path = self.path(self.key(filename))
+        try:
+            result = self.read(path)
+            os.utime(path)  # mark as recently used
+            logging.info(f"Program cache hit for {filename}")
+            return result
+        except (OSError, ValueError, struct.error) as e:
+            logging.info(f"Program cache miss for {filename} ({e})")
+
+        result = program.load(filename, workers=workers)
+        try:
+            self.write(path, result)
+            self.evict()
+        except OSError as e:
+            logging.warning(f"Could not write program cache: {e}")
+        return result
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, rows = HEADER.unpack_from(mapping)
+        if magic != MAGIC or version != parse.PARSER_VERSION:
+            raise ValueError("stale cache entry")
+
+        view = memoryview(mapping)
+        offset = HEADER.size + _padding(HEADER.size)
+        columns = []
+        for name in program.ColumnarProgram.columns:
+            typecode = TYPECODES[name]
+            size = rows * array(typecode).itemsize
+            if offset + size > len(mapping):
+                raise ValueError("truncated cache entry")
+            columns.append(view[offset:offset + size].cast(typecode))
+            offset += size + _padding(size)
+
+        result = program.ColumnarProgram(*columns)
+        result.mapping = mapping  # keep the map alive as long as the views
+        return result
+
+    def write(self, path, result):
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(HEADER.pack(MAGIC, parse.PARSER_VERSION, len(result)))
+            f.write(bytes(_padding(HEADER.size)))
+            for name in program.ColumnarProgram.columns:
+                data = bytes(getattr(result, name))
+                f.write(data)
+                f.write(bytes(_padding(len(data))))
+        os.replace(temporary, path)
+
+    def entries(self):
+        """(mtime, size, path) of every cache file that can be evicted, oldest
+        first"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        names = set(names)
+        entries = []
+        for name in names:
+            if not name.endswith(SUFFIXES):
+                continue
+            base, suffix = os.path.splitext(name)
+            if suffix == ".idx" and base + CHECKPOINT in names:
+                continue  # the job it's for isn't finished
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue  # removed (e.g. evicted by another process) since listdir
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits max_bytes."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Remove everything evict() could (so not unfinished jobs'
+        checkpoints)."""
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
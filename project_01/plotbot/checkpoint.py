@@ -0,0 +1,164 @@
+"""
+--------------------------------------------------------------------------
+checkpoint.py - resumable job checkpoints
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Resumable jobs. While a job runs, every few commands we save a checkpoint:
+how many commands are done, the robot's pose and where the program thinks the
+pen is. Alongside it, a command index maps command number -> byte offset of
+the command in the gcode file, so a resumed job can seek straight to the first
+unfinished command instead of lexing everything before it.
+
+Both files live in the program cache directory, keyed by the content hash of
+the gcode file, so an edited file never resumes from a stale checkpoint. The
+cache never evicts (or clears) an unfinished job's checkpoint or index. The
+index is append-only and is filled in as commands are executed, so building
+it costs nothing extra.
+
+A checkpoint only ever records whole commands: the pose is the one the last
+finished command left the robot in. A command that was interrupted part way
+through is run again, in full, on resume, so the robot should be put back
+where that command started (it's where it stopped, unless it was moving).
+"""
+
+from array import array
+import json
+import os
+import time
+
+import cache
+from robot import Pose
+
+INTERVAL = 50  # commands between checkpoints
+
+
+class CommandIndex:
+    """command number -> byte offset of the command in the file"""
+    def __init__(self, path):
+        self.path = path
+        self.offsets = array("Q")
+        self.flushed = 0
+        try:
+            with open(path, "rb") as f:
+                self.offsets.frombytes(f.read())
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            self.offsets = array("Q")  # torn write; start over
+            os.remove(path)
+        self.flushed = len(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, number):
+        return self.offsets[number]
+
+    def note(self, number, offset):
+        """Record where command number starts (if it's new to the index)."""
+        if number == len(self.offsets) and offset is not None:
+            self.offsets.append(offset)
+
+    def flush(self):
+        if self.flushed < len(self.offsets):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "ab") as f:
+                f.write(self.offsets[self.flushed:].tobytes())
+            self.flushed = len(self.offsets)
+
+
+class Checkpoint:
+    """Checkpoint & command index for one gcode file."""
+    def __init__(self, filename, directory=None, interval=INTERVAL):
+        program_cache = cache.ProgramCache(directory)
+        key = program_cache.key(filename)
+        self.filename = filename
+        self.path = os.path.join(program_cache.directory, key + cache.CHECKPOINT)
+        self.index = CommandIndex(os.path.join(program_cache.directory, key + ".idx"))
+        self.interval = interval
+        self.last_saved = None
+
+    def load(self):
+        """The saved state as a dict, or None if there's nothing to resume."""
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if state["command"] >= len(self.index):
+            return None  # can't seek there
+        state["offset"] = self.index[state["command"]]
+        return state
+
+    def save(self, command, pose, position):
+        """Save that the commands before number command are done, leaving the
+        robot in pose (see pose()) & the pen at position. Resuming starts with
+        command number command."""
+        self.index.flush()
+        state = {
+            "file": self.filename,
+            "command": command,
+            "pose": pose,
+            "position": list(position),
+            "time": time.time(),
+        }
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(state, f)
+        os.replace(temporary, self.path)
+        self.last_saved = command
+
+    def due(self, command):
+        return self.last_saved is None or command - self.last_saved >= self.interval
+
+    def clear(self):
+        """The job finished; nothing left to resume."""
+        self.index.flush()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def pose(robot):
+    """The robot's pose, with the exact state of robot.Pose (fixed point
+    position & target, heading & aim) so a resumed job carries on with the
+    same fraction of a step"""
+    return {"X": robot.X, "Y": robot.Y, "Z": robot.Z,
+            "orientation": robot.orientation,
+            "state": list(robot.pose.state())}
+
+
+def restore(state, robot):
+    """Put the robot back in the pose saved in state."""
+    pose = state["pose"]
+    robot.pose = Pose.from_state(pose["state"])
+    robot.Z = pose["Z"]
@@ -0,0 +1,311 @@
+"""
+--------------------------------------------------------------------------
+compiler.py - ahead-of-time step plans
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Ahead-of-time step plans. Running a program normally means Python works out
+every step as it goes (Command.execute -> Robot.move -> Stepper.step). The
+compiler does all of that up front, possibly on a faster machine, & writes
+the result as a flat stream of step events: the pin mask of both steppers
+after the event & the delay [ns] since the previous one, on the same
+trapezoidal profiles the Scheduler uses. Running a plan is then just reading
+the (memory-mapped) file & writing masks to the pins on time.
+
+A plan file is a header followed by two columns, like the program cache:
+
+  header   magic, event count, stepper width, start & end state of each
+           stepper, start & end pose (robot.Pose.state(): fixed point
+           position & target, orientation [deg] & aim)
+  delays   uint32 per event
+  masks    uint8 per event (left stepper in the low bits, right above it)
+
+A plan starts from the robot's pose when it was compiled (normally at rest
+at the origin) & only covers XY motion; the pen (zmove) isn't driven yet.
+Delays longer than one event can hold (very slow feedrates, long dwells) are
+split up with idle events that leave the pins as they are.
+
+Usage: python compiler.py GCODE PLAN      compile
+       python compiler.py --run PLAN      run on the robot
+"""
+
+from array import array
+import logging
+import mmap
+import struct
+import time
+
+import gpio
+import parse
+import robot
+import scheduler
+
+MAGIC = b"PBS3"
+# magic, count, width, 4 phases, start & end pose (robot.Pose.state())
+HEADER = struct.Struct("<4sQ5I4q3d4q3d")
+MAX_DELAY = 0xFFFFFFFF  # [ns] longest delay one event can hold
+
+
+class Plan:
+    """Step events being compiled, plus where the steppers & heading end up"""
+    def __init__(self, left_phase, right_phase, pose, states=None, width=4):
+        if states is None:
+            states = robot.load_config()["stepper_states"]
+        self.states = states
+        self.width = width
+        masks = [sum(1 << i for i, value in enumerate(state) if value) for state in states]
+        # Combined mask of every (left phase, right phase)
+        self.combined = [[left | right << width for right in masks] for left in masks]
+        self.start_phases = (left_phase, right_phase)
+        self.start_pose = pose.copy()
+        self.left_phase = left_phase
+        self.right_phase = right_phase
+        self.pose = pose.copy()
+        self.masks = array("B")
+        self.delays = array("I")
+        self.pending = 0  # [ns] delay to add to the next event
+
+    def mask(self):
+        return self.combined[self.left_phase][self.right_phase]
+
+    def wait(self, ns):
+        self.pending += ns
+
+    def drive(self, left_steps, right_steps, rate=None, acceleration=scheduler.ACCELERATION):
+        """Add the events of robot._drive(left_steps, right_steps, rate)"""
+        ticks = max(abs(left_steps), abs(right_steps))
+        if ticks == 0:
+            return
+        if rate is None:
+            rate = scheduler.MAX_RATE
+        else:
+            rate = min(rate, scheduler.MAX_RATE)
+        times = list(scheduler.profile(ticks, rate, acceleration))
+        delays = [b - a for a, b in zip([0] + times[:-1], times)]
+        delays[0] += self.pending
+        self.pending = 0
+
+        n = len(self.states)
+        left_direction = 1 if left_steps >= 0 else -1
+        right_direction = 1 if right_steps >= 0 else -1
+        left_count = abs(left_steps)
+        right_count = abs(right_steps)
+        if left_count == right_count:
+            # Both wheels step on every tick: the phases are just arithmetic
+            left = [(self.left_phase + left_direction * k) % n for k in range(1, ticks + 1)]
+            right = [(self.right_phase + right_direction * k) % n for k in range(1, ticks + 1)]
+        else:
+            # Same Bresenham as Robot._drive
+            left, right = [], []
+            left_error = right_error = ticks // 2
+            left_phase, right_phase = self.left_phase, self.right_phase
+            for _ in range(ticks):
+                left_error += left_count
+                if left_error >= ticks:
+                    left_error -= ticks
+                    left_phase = (left_phase + left_direction) % n
+                right_error += right_count
+                if right_error >= ticks:
+                    right_error -= ticks
+                    right_phase = (right_phase + right_direction) % n
+                left.append(left_phase)
+                right.append(right_phase)
+        combined = self.combined
+        masks = [combined[l][r] for l, r in zip(left, right)]
+        if max(delays) > MAX_DELAY:
+            self._add_long(delays, masks)
+        else:
+            self.delays.extend(delays)
+            self.masks.extend(masks)
+        self.left_phase = left[-1]
+        self.right_phase = right[-1]
+
+    def _add_long(self, delays, masks):
+        """Add events, splitting delays too long for one event into idle
+        events that keep the pins as they were"""
+        mask = self.mask()
+        for delay, next_mask in zip(delays, masks):
+            while delay > MAX_DELAY:
+                self.delays.append(MAX_DELAY)
+                self.masks.append(mask)
+                delay -= MAX_DELAY
+            self.delays.append(delay)
+            self.masks.append(next_mask)
+            mask = next_mask
+
+    def reorient(self, absolute_angle, tolerance=0.0):
+        """Add the events of robot.reorient(absolute_angle, tolerance)"""
+        steps = self.pose.turn(absolute_angle, tolerance)
+        self.drive(-steps, steps)
+
+    def move(self, distance, feedrate=None):
+        """Add the events of robot.move(distance, feedrate)"""
+        steps = self.pose.advance(distance)
+        rate = None if feedrate is None else feedrate / 60 / robot.STEP_LENGTH
+        self.drive(steps, steps, rate)
+
+    def add(self, command):
+        """Add the events of executing command"""
+        if isinstance(command, parse.Move):
+            if command.distance:
+                self.reorient(command.absolute_angle, command.turn_tolerance)
+                self.move(command.distance, command.feedrate)
+        elif isinstance(command, parse.ControlledArcMove):
+            for absolute_angle, distance in command.chords:
+                self.reorient(absolute_angle)
+                self.move(distance, command.feedrate)
+        elif isinstance(command, parse.Dwell):
+            self.wait(int(command.P * 1e9))
+
+    def apply(self, robot_):
+        """Put robot_'s steppers & pose where the plan leaves them (for when
+        the events were run somewhere that didn't update robot_). robot_
+        should be where the plan started."""
+        for stepper, phase in ((robot_.left_stepper, self.left_phase),
+                               (robot_.right_stepper, self.right_phase)):
+            stepper.lead_pin = phase
+            stepper.mask = stepper.masks[phase]
+        robot_.pose = self.pose.copy()
+
+    def finish(self):
+        """Flush any trailing wait as events that don't change the pins."""
+        while self.pending:
+            delay = min(self.pending, MAX_DELAY)
+            self.delays.append(delay)
+            self.masks.append(self.mask())
+            self.pending -= delay
+
+    def write(self, path):
+        self.finish()
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(self.masks), self.width, *self.start_phases,
+                                self.left_phase, self.right_phase,
+                                *self.start_pose.state(), *self.pose.state()))
+            f.write(self.delays.tobytes())
+            f.write(self.masks.tobytes())
+
+
+def compile_program(program, left_phase=None, right_phase=None, pose=None):
+    """Compile a program (list of commands or ColumnarProgram) into a Plan,
+    starting from the robot's current steppers & pose unless given. If the
+    robot hasn't been set up (compiling on another machine), this starts from
+    a new one on simulated GPIO, so no pins are touched."""
+    if robot.is_set_up():
+        robot_ = robot.get_robot()
+    else:
+        robot_ = robot.build_robot(gpio_=gpio.SimGPIO(record=False))
+    plan = Plan(robot_.left_stepper.lead_pin if left_phase is None else left_phase,
+                robot_.right_stepper.lead_pin if right_phase is None else right_phase,
+                robot_.pose if pose is None else pose, robot_.left_stepper.states,
+                robot_.left_stepper.width)
+    for command in program:
+        plan.add(command)
+    return plan
+
+
+def run(path, robot_=None, timed=True):
+    """Run a plan file on the robot. timed=False writes the events as fast as
+    possible (dry runs)."""
+    if robot_ is None:
+        robot_ = robot.get_robot()
+    left = robot_.left_stepper
+    right = robot_.right_stepper
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+            fields = HEADER.unpack_from(mapping)
+            magic, count, width, left_start, right_start, left_end, right_end = fields[:7]
+            start, end = fields[7:14], robot.Pose.from_state(fields[14:])
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a step plan")
+            if width != left.width:
+                raise ValueError(f"plan is for {width}-pin steppers")
+            if (left.lead_pin, right.lead_pin) != (left_start, right_start):
+                raise ValueError("the steppers aren't in the state the plan starts from")
+            if robot_.pose.state() != start:
+                raise ValueError("the robot isn't where the plan starts from")
+            view = memoryview(mapping)
+            delays = view[HEADER.size:HEADER.size + 4 * count].cast("I")
+            masks = view[HEADER.size + 4 * count:HEADER.size + 5 * count]
+            try:
+                slips = _run_events(left, right, delays, masks, width, timed)
+                if slips:
+                    logging.warning(f"Step plan fell behind & slipped {slips} times")
+            finally:
+                delays.release()
+                masks.release()
+                view.release()
+    left.lead_pin = left_end
+    right.lead_pin = right_end
+    robot_.pose = end
+    return count
+
+
+def _run_events(left, right, delays, masks, width, timed, max_lag=scheduler.MAX_LAG_NS):
+    """Write the events, each at its deadline. Like the Scheduler, falling
+    more than max_lag [ns] behind slips the rest of the deadlines rather than
+    catching up in a burst. Returns how many times that happened."""
+    left_write = left.write_mask
+    right_write = right.write_mask
+    low = (1 << width) - 1
+    monotonic_ns = time.monotonic_ns
+    wait_until = scheduler.wait_until
+    deadline = monotonic_ns()
+    slips = 0
+    for delay, mask in zip(delays, masks):
+        if timed:
+            deadline += delay
+            now = monotonic_ns()
+            if now < deadline:
+                wait_until(deadline)
+            elif now - deadline > max_lag:
+                deadline = now
+                slips += 1
+        left_write(mask & low)
+        right_write(mask >> width)
+    return slips
+
+
+if __name__ == "__main__":
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Compile or run a step plan.")
+    arg_parser.add_argument("files", nargs="+", help="GCODE PLAN, or PLAN with --run")
+    arg_parser.add_argument("--run", action="store_true")
+    args = arg_parser.parse_args()
+
+    if args.run:
+        print(f"Ran {run(args.files[0])} step events.")
+    else:
+        import cache
+
+        start = time.perf_counter()
+        plan = compile_program(cache.ProgramCache().load(args.files[0]))
+        plan.write(args.files[1])
+        print(f"{len(plan.masks)} step events in {time.perf_counter() - start:.2f} s")
@@ -0,0 +1,99 @@
+"""
+--------------------------------------------------------------------------
+conftest.py - pytest setup for the plotbot tests
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Shared setup for the tests (test_*.py, run with pytest from this directory).
+Everything runs on simulated GPIO, so no hardware is needed; the backend is
+picked here, before any test module can set up the robot's pins.
+"""
+
+import math
+
+import pytest
+
+import gpio
+
+gpio.use("sim")
+
+
+@pytest.fixture
+def sim():
+    """The simulated GPIO, logging writes, with an empty log"""
+    backend = gpio.backend()
+    backend.record = True
+    backend.clear_log()
+    return backend
+
+
+@pytest.fixture
+def gcode(tmp_path):
+    """Write lines to a gcode file in tmp_path; returns its path"""
+    def write(lines, name="job.nc"):
+        path = tmp_path / name
+        path.write_text("\n".join(lines) + "\n")
+        return str(path)
+    return write
+
+
+def polygons(figures=60, sides=7):
+    """Gcode lines of pen-down polygons & arcs, with pen lifts & the odd dwell"""
+    lines = ["G90"]
+    for figure in range(figures):
+        cx, cy = 25.0 * (figure % 8), 30.0 * (figure // 8)
+        radius = 4.0 + figure % 5
+        corners = [(cx + radius * math.cos(2 * math.pi * k / sides),
+                    cy + radius * math.sin(2 * math.pi * k / sides))
+                   for k in range(sides + 1)]
+        lines.append("G00 Z2.000")
+        lines.append(f"G00 X{corners[0][0]:.3f} Y{corners[0][1]:.3f}")
+        lines.append("G01 Z-1.000 F400")
+        lines.extend(f"G01 X{x:.3f} Y{y:.3f}" for x, y in corners[1:])
+        # Half way round the polygon's circle & back
+        direction = "G02" if figure % 2 else "G03"
+        lines.append(f"{direction} X{2 * cx - corners[0][0]:.3f} Y{cy:.3f} "
+                     f"I{cx - corners[0][0]:.3f} J0")
+        lines.append(f"{direction} X{corners[0][0]:.3f} Y{cy:.3f} R{radius:.3f}")
+        if figure % 10 == 0:
+            lines.append("G04 P0.01")
+    lines.append("G00 Z2.000")
+    return lines
+
+
+@pytest.fixture
+def job(gcode):
+    """A gcode file of polygons() in tmp_path; returns its path"""
+    return gcode(polygons())
+
+
+def columns(prog):
+    """A ColumnarProgram's columns, as bytes, to compare programs exactly"""
+    return {name: getattr(prog, name).tobytes() for name in prog.columns}
@@ -0,0 +1,213 @@
+"""
+--------------------------------------------------------------------------
+estimate.py - job duration estimates
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Job duration estimates. The duration in a CAM header (like the GRBL-Plotter one
+in square.nc) assumes a machine that moves at the feedrate; ours spends its
+time turning in place & stepping at whatever rate the steppers manage. This
+works out, from the program alone (no GPIO):
+
+  - the steps each wheel makes driving & turning
+  - the total angle turned & the number of pen lifts
+  - an estimated run time, with every drive & turn on a trapezoid profile
+    (accelerate at ACCELERATION up to STEP_RATE, cruise, decelerate) plus a
+    fixed time per pen move & any dwells
+
+Everything is computed column-wise over a ColumnarProgram, so big (cached)
+programs estimate quickly.
+
+Usage: python estimate.py GCODE [--step-rate R] [--acceleration A] [--json]
+"""
+
+from collections import Counter
+from itertools import accumulate, chain, compress, islice, repeat
+import json
+import math
+from operator import sub
+
+import planner
+import program
+import robot
+import scheduler
+
+STEP_RATE = scheduler.MAX_RATE          # [steps/s] top speed
+ACCELERATION = scheduler.ACCELERATION   # [steps/s^2]
+PEN_TIME = 0.3                          # [s] to raise or lower the pen
+PEN_Z = 0.0                             # Z below this is pen down
+
+
+class Model:
+    """The robot's timing parameters. The step length & wheel base default to
+    the robot's config (robot.load_config()), so estimates match the robot the
+    job will run on."""
+    def __init__(self, step_length=None, step_rate=STEP_RATE,
+                 acceleration=ACCELERATION, wheel_base=None, pen_time=PEN_TIME,
+                 pen_z=PEN_Z):
+        if step_length is None or wheel_base is None:
+            config = robot.load_config()
+            if step_length is None:
+                step_length = config["step_length"]
+            if wheel_base is None:
+                wheel_base = config["wheel_base"]
+        self.step_length = step_length
+        self.step_rate = step_rate
+        self.acceleration = acceleration
+        self.wheel_base = wheel_base
+        self.pen_time = pen_time
+        self.pen_z = pen_z
+
+    @property
+    def turn_steps_per_degree(self):
+        """Turning in place, each wheel drives an arc of half the wheel base"""
+        return math.pi * self.wheel_base / 360.0 / self.step_length
+
+    def profile_time(self, steps):
+        """Seconds to make steps steps from a standstill to a standstill"""
+        v = self.step_rate
+        a = self.acceleration
+        if steps * a >= v * v:
+            return steps / v + v / a  # reaches full speed
+        return 2 * math.sqrt(steps / a)  # triangle profile
+
+    def total_time(self, step_counts):
+        """sum(map(profile_time, step_counts)), but worked out once per distinct
+        step count (drawings repeat the same few segment lengths & turns)"""
+        profile_time = self.profile_time
+        return sum(profile_time(steps) * n for steps, n in Counter(step_counts).items())
+
+
+class EstimateReport:
+    def __init__(self, commands, drive_steps, turn_steps, turned, turns, pen_lifts,
+                 pen_moves, dwell, seconds):
+        self.commands = commands
+        self.drive_steps = drive_steps
+        self.turn_steps = turn_steps
+        self.turned = turned        # [deg]
+        self.turns = turns
+        self.pen_lifts = pen_lifts
+        self.pen_moves = pen_moves
+        self.dwell = dwell          # [s]
+        self.seconds = seconds
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def __str__(self):
+        minutes, seconds = divmod(self.seconds, 60)
+        return (f"{self.commands} commands: {self.drive_steps + self.turn_steps} steps "
+                f"({self.drive_steps} driving, {self.turn_steps} turning), "
+                f"{self.turns} turns totalling {self.turned:.0f} deg, "
+                f"{self.pen_lifts} pen lifts. "
+                f"Estimated time {int(minutes)} min {seconds:.1f} s")
+
+
+def estimate(prog, model=None):
+    """Estimate a ColumnarProgram. Returns an EstimateReport."""
+    if model is None:
+        model = Model()
+
+    # Driving: every move with an XY component. Like robot.move, each move
+    # makes the whole steps that get closest to where the program has got to,
+    # carrying the fraction onwards. (map & friends keep the per-row work in C.)
+    scale = 1.0 / model.step_length
+    distances = map(abs, compress(prog.distance, prog.distance))
+    if scale != 1.0:
+        distances = map(scale.__mul__, distances)
+    reached = list(map(round, accumulate(distances, initial=0.0)))
+    # Only the number of moves of each length matters from here on
+    drive = Counter(map(sub, islice(reached, 1, None), reached))
+
+    # Turning: heading changes between those moves (the robot starts at 0)
+    headings = list(compress(prog.heading, prog.distance))
+    if prog.turn_tolerance:
+        # Some turns are skipped, which changes the ones after them
+        angles = planner.turn_angles(headings, prog.turn_tolerance)
+    else:
+        # remainder() wraps each change of heading into [-180, 180]
+        turns = map(math.remainder, map(sub, headings, chain([0.0], headings)),
+                    repeat(360.0))
+        angles = list(map(abs, turns))
+    per_degree = model.turn_steps_per_degree
+    turn = Counter(map(round, map(per_degree.__mul__, angles)))
+
+    # Pen: every Z move costs pen_time; lifts are the ones that leave the paper
+    pen_z = model.pen_z
+    pen = list(compress(zip(prog.Z, prog.dZ), prog.dZ))
+    pen_moves = len(pen)
+    pen_lifts = sum(1 for z, dz in pen if dz > 0 and z >= pen_z and z - dz < pen_z)
+
+    # Dwells are rare, so find them in the opcodes first
+    ops = bytes(prog.op)
+    dwell = 0.0
+    i = ops.find(program.DWELL)
+    while i >= 0:
+        if prog.P[i] == prog.P[i]:  # not NaN
+            dwell += prog.P[i]
+        i = ops.find(program.DWELL, i + 1)
+
+    return EstimateReport(
+        commands=len(prog),
+        drive_steps=reached[-1],
+        turn_steps=sum(steps * n for steps, n in turn.items()),
+        turned=sum(angles),
+        turns=len(angles) - angles.count(0.0),
+        pen_lifts=pen_lifts,
+        pen_moves=pen_moves,
+        dwell=dwell,
+        seconds=(model.total_time(drive) + model.total_time(turn)
+                 + pen_moves * model.pen_time + dwell),
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    import cache
+
+    arg_parser = argparse.ArgumentParser(description="Estimate how long a job takes.")
+    arg_parser.add_argument("program_file")
+    arg_parser.add_argument("--step-rate", type=float, default=STEP_RATE)
+    arg_parser.add_argument("--acceleration", type=float, default=ACCELERATION)
+    arg_parser.add_argument("--json", action="store_true")
+    args = arg_parser.parse_args()
+
+    start = time.perf_counter()
+    prog = cache.ProgramCache().load(args.program_file)
+    loaded = time.perf_counter()
+    report = estimate(prog, Model(step_rate=args.step_rate, acceleration=args.acceleration))
+    done = time.perf_counter()
+    if args.json:
+        print(json.dumps(report.as_dict()))
+    else:
+        print(report)
+        print(f"(load {loaded - start:.3f} s, estimate {done - loaded:.3f} s)")
@@ -0,0 +1,229 @@
+"""
+--------------------------------------------------------------------------
+executor.py - separate step executor process
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+A separate process that does nothing but drive the steppers, so parsing,
+planning, logging, GC & anything else in the main interpreter can't disturb
+step timing (and a slow step can't hold up planning).
+
+The main process compiles commands into step events (compiler.Plan) & pushes
+them into a ring buffer in shared memory; the executor process takes them off
+& writes each mask to the pins at its deadline. There's one writer & one
+reader, each owning one index, so the ring needs no locks. The executor can
+optionally be pinned to a CPU, given real-time priority (needs root) & run
+with the garbage collector off.
+
+Counters, readable from either side while running:
+  underruns  times the executor ran out of events mid-job (planning too slow)
+  overruns   times the planner found the ring full & had to wait (normal for
+             a long job: the planner is ahead)
+  late       events written after their deadline
+  slips      times the executor fell more than scheduler.MAX_LAG_NS behind &
+             moved the remaining deadlines back rather than catching up in a
+             burst of steps
+"""
+
+import gc
+import logging
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+
+import scheduler
+
+CAPACITY = 1 << 16  # events (~5 bytes each)
+BATCH = 256         # events the executor takes before publishing its index
+POLL = 0.0005       # [s] sleep while waiting for the other side
+
+# Header fields (uint32 each). HEAD is only written by the planner & TAIL only
+# by the executor; both count up & wrap at 2^32.
+HEAD, TAIL, STATE, UNDERRUNS, OVERRUNS, LATE, SLIPS = range(7)
+HEADER_FIELDS = 7
+RUNNING, DONE, STOP = 0, 1, 2
+
+
+class Ring:
+    """Single-producer, single-consumer ring of (delay [ns], mask) events in
+    shared memory"""
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        size = 4 * HEADER_FIELDS + 4 * capacity + capacity
+        self.memory = shared_memory.SharedMemory(create=True, size=size)
+        view = self.memory.buf
+        self.header = view[:4 * HEADER_FIELDS].cast("I")
+        self.delays = view[4 * HEADER_FIELDS:4 * HEADER_FIELDS + 4 * capacity].cast("I")
+        self.masks = view[4 * HEADER_FIELDS + 4 * capacity:size]
+        for field in range(HEADER_FIELDS):
+            self.header[field] = 0
+
+    def free(self):
+        return self.capacity - ((self.header[HEAD] - self.header[TAIL]) & 0xFFFFFFFF)
+
+    def push(self, delays, masks):
+        """Add as many events as fit; returns how many were added."""
+        count = min(len(masks), self.free())
+        head = self.header[HEAD]
+        start = head % self.capacity
+        first = min(count, self.capacity - start)
+        self.delays[start:start + first] = delays[:first]
+        self.masks[start:start + first] = masks[:first]
+        if count > first:
+            self.delays[:count - first] = delays[first:count]
+            self.masks[:count - first] = masks[first:count]
+        # Publish only once the events are in place
+        self.header[HEAD] = (head + count) & 0xFFFFFFFF
+        return count
+
+    def close(self):
+        self.header.release()
+        self.delays.release()
+        self.masks.release()
+        self.memory.close()
+        self.memory.unlink()
+
+
+def _realtime(cpu, priority):
+    """Make the calling process as undisturbed as the OS allows."""
+    gc.disable()
+    if cpu is not None:
+        try:
+            os.sched_setaffinity(0, {cpu})
+        except (AttributeError, OSError) as e:
+            logging.warning(f"Executor: can't pin to CPU {cpu}: {e}")
+    if priority is not None:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        except (AttributeError, OSError) as e:
+            logging.warning(f"Executor: can't get real-time priority: {e}")
+
+
+def _execute(ring, left, right, timed, cpu, priority):
+    """Executor process: write events off the ring until the planner is done."""
+    _realtime(cpu, priority)
+    header = ring.header
+    delays = ring.delays
+    masks = ring.masks
+    capacity = ring.capacity
+    width = left.width
+    low = (1 << width) - 1
+    left_write = left.write_mask
+    right_write = right.write_mask
+    monotonic_ns = time.monotonic_ns
+    wait_until = scheduler.wait_until
+    deadline = None  # None: not running; the next event starts the clock
+    tail = header[TAIL]
+    while header[STATE] != STOP:
+        available = (header[HEAD] - tail) & 0xFFFFFFFF
+        if not available:
+            if header[STATE] == DONE:
+                break
+            if deadline is not None:
+                header[UNDERRUNS] += 1
+                deadline = None  # restart timing when events come, don't burst
+            time.sleep(POLL)
+            continue
+        if deadline is None:
+            deadline = monotonic_ns()
+        for _ in range(min(available, BATCH)):
+            slot = tail % capacity
+            mask = masks[slot]
+            if timed:
+                deadline += delays[slot]
+                now = monotonic_ns()
+                if now < deadline:
+                    wait_until(deadline)
+                elif now - deadline > scheduler.SPIN_NS:
+                    header[LATE] += 1
+                    if now - deadline > scheduler.MAX_LAG_NS:
+                        deadline = now
+                        header[SLIPS] += 1
+            left_write(mask & low)
+            right_write(mask >> width)
+            tail = (tail + 1) & 0xFFFFFFFF
+        header[TAIL] = tail
+
+
+class Executor:
+    """Runs step events on the robot from another process. Use as a context
+    manager; feed() it compiled plans as they're made."""
+    def __init__(self, robot_, timed=True, cpu=None, priority=None, capacity=CAPACITY):
+        self.robot = robot_
+        self.ring = Ring(capacity)
+        # Forked, so the child gets the steppers (& their pins) as they are
+        context = multiprocessing.get_context("fork")
+        self.process = context.Process(
+            target=_execute, name="step-executor", daemon=True,
+            args=(self.ring, robot_.left_stepper, robot_.right_stepper, timed, cpu, priority))
+
+    def __enter__(self):
+        self.process.start()
+        return self
+
+    def feed(self, plan):
+        """Move the events compiled so far in plan into the ring, waiting for
+        room as needed."""
+        delays = memoryview(plan.delays)
+        masks = memoryview(plan.masks)
+        header = self.ring.header
+        waited = False
+        while len(masks):
+            if not self.process.is_alive():
+                raise RuntimeError("step executor process died")
+            count = self.ring.push(delays, masks)
+            delays = delays[count:]
+            masks = masks[count:]
+            if len(masks):
+                if not waited:
+                    header[OVERRUNS] += 1
+                    waited = True
+                time.sleep(POLL)
+        del delays, masks
+        del plan.delays[:]
+        del plan.masks[:]
+
+    def counters(self):
+        header = self.ring.header
+        return {"underruns": header[UNDERRUNS], "overruns": header[OVERRUNS],
+                "late": header[LATE], "slips": header[SLIPS]}
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.ring.header[STATE] = DONE if exc_type is None else STOP
+        self.process.join()
+        self.stats = self.counters()
+        self.ring.close()
+        return False
+
+    def __str__(self):
+        counters = self.counters() if self.process.is_alive() else self.stats
+        return (f"{counters['underruns']} underruns, {counters['overruns']} overruns, "
+                f"{counters['late']} late events, {counters['slips']} slips")
@@ -0,0 +1,366 @@
+"""
+--------------------------------------------------------------------------
+gpio.py - GPIO backends
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Pluggable GPIO backends. Everything that touches pins goes through the object
+returned by backend(), which has the same interface as Adafruit_BBIO.GPIO:
+
+  bbio  the real pins (Adafruit_BBIO.GPIO), on the PocketBeagle
+  sim   SimGPIO: no hardware. Pin writes go into a compact log & inputs can be
+        scripted, so jobs can be dry-run (at full speed) on any Linux box
+  bank  BankGPIO: writes whole banks through the memory-mapped registers
+        (/dev/mem, or the file named by PLOTBOT_GPIO_MEM as a stand-in)
+
+The backend is picked by the PLOTBOT_GPIO environment variable or use(). With
+neither, it's bbio; if Adafruit_BBIO isn't installed that's an error rather
+than a silent switch to sim, so a job meant for the plotter never "runs"
+without it. Ask for sim explicitly (PLOTBOT_GPIO=sim, or plotbot --dry-run).
+PLOTBOT_GPIO_LOG=0 stops sim from logging every write (it still counts them).
+"""
+
+from array import array
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+
+BACKENDS = ("bbio", "sim", "bank")
+
+HIGH = 1
+LOW = 0
+
+
+class SimGPIO:
+    """Simulated GPIO with the Adafruit_BBIO.GPIO interface.
+
+    Every output() is appended to the log: the pin (as a small number, see
+    pin_ids) & the value, in two arrays, so millions of writes cost a few MB &
+    no objects. Pass timestamps=True to also log monotonic_ns() of each write
+    (slower). record=False keeps only the current levels & write counts.
+
+    Inputs read whatever set_input() last set, or follow a script of timed
+    changes (script_input()). Edge detection callbacks run on changes made with
+    set_input()."""
+    IN = "in"
+    OUT = "out"
+    HIGH = HIGH
+    LOW = LOW
+    PUD_OFF = 0
+    PUD_DOWN = 1
+    PUD_UP = 2
+    RISING = 1
+    FALLING = 2
+    BOTH = 3
+
+    def __init__(self, record=True, timestamps=False):
+        self.record = record
+        self.timestamps = timestamps
+        self.pin_ids = {}      # pin name -> number used in the log
+        self.pins = []         # number -> pin name
+        self.directions = []   # number -> IN/OUT
+        self.levels = []       # number -> current value
+        self.log_pins = array("H")
+        self.log_values = array("B")
+        self.log_times = array("Q")
+        self.writes = 0
+        self.scripts = {}      # pin number -> (times, values) of scripted input
+        self.callbacks = {}    # pin number -> (edge, [callbacks])
+
+    def _id(self, pin):
+        number = self.pin_ids.get(pin)
+        if number is None:
+            number = self.pin_ids[pin] = len(self.pins)
+            self.pins.append(pin)
+            self.directions.append(self.IN)
+            self.levels.append(LOW)
+        return number
+
+    # -- Adafruit_BBIO.GPIO interface --
+
+    def setup(self, pin, direction, pull_up_down=PUD_OFF, initial=None, delay=0):
+        number = self._id(pin)
+        self.directions[number] = direction
+        if direction == self.IN:
+            self.levels[number] = HIGH if pull_up_down == self.PUD_UP else LOW
+        elif initial is not None:
+            self.levels[number] = initial
+
+    def output(self, pin, value):
+        number = self.pin_ids.get(pin)
+        if number is None:
+            raise RuntimeError(f"GPIO {pin} was not set up")
+        self.levels[number] = value
+        self.writes += 1
+        if self.record:
+            self.log_pins.append(number)
+            self.log_values.append(value)
+            if self.timestamps:
+                self.log_times.append(time.monotonic_ns())
+
+    def input(self, pin):
+        number = self.pin_ids.get(pin)
+        if number is None:
+            raise RuntimeError(f"GPIO {pin} was not set up")
+        script = self.scripts.get(number)
+        if script is not None:
+            times, values = script
+            i = bisect.bisect_right(times, time.monotonic())
+            if i:
+                return values[i - 1]
+        return self.levels[number]
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=0):
+        self.callbacks[self._id(pin)] = (edge, [callback] if callback else [])
+
+    def add_event_callback(self, pin, callback, bouncetime=0):
+        self.callbacks[self._id(pin)][1].append(callback)
+
+    def remove_event_detect(self, pin):
+        self.callbacks.pop(self._id(pin), None)
+
+    def cleanup(self, pin=None):
+        pass
+
+    # -- Simulation --
+
+    def set_input(self, pin, value):
+        """Drive an input pin to value (like the button or switch on it would)
+        & run any edge callbacks."""
+        number = self._id(pin)
+        self.scripts.pop(number, None)
+        previous = self.levels[number]
+        self.levels[number] = value
+        edge, callbacks = self.callbacks.get(number, (None, ()))
+        if value != previous and edge is not None:
+            rising = value == HIGH
+            if edge == self.BOTH or (edge == self.RISING) == rising:
+                for callback in callbacks:
+                    callback(pin)
+
+    def script_input(self, pin, changes):
+        """Have an input pin follow changes: (seconds from now, value) pairs,
+        in order. Before the first change it keeps its current level."""
+        number = self._id(pin)
+        now = time.monotonic()
+        self.scripts[number] = ([now + delay for delay, value in changes],
+                                [value for delay, value in changes])
+
+    def level(self, pin):
+        return self.levels[self.pin_ids[pin]]
+
+    def writes_to(self, pin):
+        """The values written to pin, in order"""
+        number = self.pin_ids[pin]
+        return [value for p, value in zip(self.log_pins, self.log_values) if p == number]
+
+    def clear_log(self):
+        del self.log_pins[:]
+        del self.log_values[:]
+        del self.log_times[:]
+        self.writes = 0
+
+    def summary(self):
+        return f"{self.writes} simulated pin writes to {len(self.pins)} pins"
+
+
+# AM335x GPIO registers: each of the 4 banks is a 4 KB block at these physical
+# addresses, with one bit per pin in each register
+BANK_BASES = (0x44E07000, 0x4804C000, 0x481AC000, 0x481AE000)
+BANK_SIZE = 0x1000
+OE = 0x134            # output enable (0 = output)
+DATAIN = 0x138
+DATAOUT = 0x13C
+CLEARDATAOUT = 0x190  # writing 1s clears those pins...
+SETDATAOUT = 0x194    # ...& sets them, without touching the others
+
+# PocketBeagle header pin -> (bank, bit)
+PIN_MAP = {
+    "P1_29": (3, 21),
+    "P1_30": (1, 11),
+    "P1_31": (3, 18),
+    "P1_32": (1, 10),
+    "P1_33": (3, 15),
+    "P1_34": (0, 26),
+    "P1_35": (2, 24),
+    "P1_36": (3, 14),
+    "P2_2": (1, 27),
+}
+
+REGISTER = struct.Struct("<I")
+
+
+class BankGPIO:
+    """GPIO through the memory-mapped bank registers, so any number of pins in
+    a bank change with one write to SETDATAOUT & one to CLEARDATAOUT.
+
+    On the PocketBeagle path is /dev/mem (needs root; pins must already be
+    muxed as GPIO, e.g. by config.sh). Anywhere else path can be a plain file
+    standing in for the registers: the banks are then laid out one after the
+    other & the set/clear writes are applied to DATAOUT in the file like the
+    hardware would, so the pin levels can be checked.
+
+    Besides the Adafruit_BBIO.GPIO interface it has bank_writes() &
+    write_banks(), which Stepper uses for its precomputed transitions."""
+    IN = "in"
+    OUT = "out"
+    HIGH = HIGH
+    LOW = LOW
+    PUD_OFF = 0
+    PUD_DOWN = 1
+    PUD_UP = 2
+
+    def __init__(self, path="/dev/mem"):
+        self.path = path
+        self.hardware = path == "/dev/mem"
+        bases = BANK_BASES if self.hardware else [i * BANK_SIZE for i in range(len(BANK_BASES))]
+        flags = os.O_RDWR | os.O_SYNC if self.hardware else os.O_RDWR | os.O_CREAT
+        self.fd = os.open(path, flags, 0o644)
+        if not self.hardware and os.fstat(self.fd).st_size < len(bases) * BANK_SIZE:
+            os.ftruncate(self.fd, len(bases) * BANK_SIZE)
+        self.banks = [mmap.mmap(self.fd, BANK_SIZE, offset=base) for base in bases]
+
+    def _register(self, bank, offset):
+        return REGISTER.unpack_from(self.banks[bank], offset)[0]
+
+    def _set_register(self, bank, offset, value):
+        REGISTER.pack_into(self.banks[bank], offset, value)
+
+    def _pin(self, pin):
+        try:
+            return PIN_MAP[pin]
+        except KeyError:
+            raise ValueError(f"GPIO {pin} isn't in gpio.PIN_MAP") from None
+
+    def bank_writes(self, changes):
+        """The register writes for changes ((pin, value) pairs): a tuple of
+        (bank, set bits, clear bits), one per bank touched"""
+        writes = {}
+        for pin, value in changes:
+            bank, bit = self._pin(pin)
+            set_bits, clear_bits = writes.get(bank, (0, 0))
+            if value:
+                set_bits |= 1 << bit
+            else:
+                clear_bits |= 1 << bit
+            writes[bank] = (set_bits, clear_bits)
+        return tuple((bank, set_bits, clear_bits)
+                     for bank, (set_bits, clear_bits) in sorted(writes.items()))
+
+    def write_banks(self, writes):
+        """Apply writes from bank_writes()"""
+        pack_into = REGISTER.pack_into
+        for bank, set_bits, clear_bits in writes:
+            registers = self.banks[bank]
+            if set_bits:
+                pack_into(registers, SETDATAOUT, set_bits)
+            if clear_bits:
+                pack_into(registers, CLEARDATAOUT, clear_bits)
+            if not self.hardware:
+                out = REGISTER.unpack_from(registers, DATAOUT)[0]
+                pack_into(registers, DATAOUT, (out | set_bits) & ~clear_bits)
+
+    # -- Adafruit_BBIO.GPIO interface --
+
+    def setup(self, pin, direction, pull_up_down=PUD_OFF, initial=None, delay=0):
+        bank, bit = self._pin(pin)
+        enable = self._register(bank, OE)
+        if direction == self.OUT:
+            enable &= ~(1 << bit)
+        else:
+            enable |= 1 << bit
+        self._set_register(bank, OE, enable)
+        if direction == self.OUT and initial is not None:
+            self.output(pin, initial)
+
+    def output(self, pin, value):
+        self.write_banks(self.bank_writes(((pin, value),)))
+
+    def input(self, pin):
+        bank, bit = self._pin(pin)
+        register = DATAIN if self.hardware else DATAOUT
+        return HIGH if self._register(bank, register) >> bit & 1 else LOW
+
+    def level(self, pin):
+        """The level the pin is being driven to"""
+        bank, bit = self._pin(pin)
+        return HIGH if self._register(bank, DATAOUT) >> bit & 1 else LOW
+
+    def cleanup(self, pin=None):
+        if pin is None and self.banks:
+            for registers in self.banks:
+                registers.close()
+            self.banks = []
+            os.close(self.fd)
+
+
+_backend = None
+_lock = threading.Lock()
+
+
+def _create(name):
+    if name == "bbio":
+        import Adafruit_BBIO.GPIO as GPIO
+        return GPIO
+    if name == "sim":
+        return SimGPIO(record=os.environ.get("PLOTBOT_GPIO_LOG", "1") != "0")
+    if name == "bank":
+        return BankGPIO(os.environ.get("PLOTBOT_GPIO_MEM", "/dev/mem"))
+    raise ValueError(f"Unknown GPIO backend {name!r} (expected one of {BACKENDS})")
+
+
+def use(name):
+    """Pick the backend (before anything sets up pins). Returns it."""
+    global _backend
+    with _lock:
+        _backend = _create(name)
+    return _backend
+
+
+def backend():
+    """The GPIO backend in use (picked on first call)"""
+    global _backend
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                name = os.environ.get("PLOTBOT_GPIO")
+                if name:
+                    _backend = _create(name)
+                else:
+                    try:
+                        _backend = _create("bbio")
+                    except ImportError as error:
+                        raise ImportError(
+                            "Adafruit_BBIO isn't installed; set PLOTBOT_GPIO=sim (or use "
+                            "plotbot --dry-run) to run on simulated GPIO") from error
+    return _backend
@@ -0,0 +1,214 @@
+"""
+--------------------------------------------------------------------------
+incremental.py - incremental re-parsing of edited files
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Incremental re-parsing for files that are edited & re-run during design
+iteration.
+
+The file is cut into content-defined chunks: a chunk boundary goes before any
+line that starts with a G/M word and whose CRC happens to have its low bits
+clear, so boundaries depend only on nearby content & an edit only changes the
+chunk(s) it touches. Each chunk is keyed by a hash of its bytes.
+
+Parsing a chunk (ProgramBuilder) doesn't depend on anything outside it, so
+parsed chunks are reused whenever their hash is unchanged. Resolving a chunk
+depends on where the pen is when it starts, so resolved chunks are reused
+when both their hash and that incoming state are unchanged; a chunk
+downstream of an edit that moved the pen is re-resolved from its (still
+cached) parsed form.
+
+The chunks of the last parse of each file are kept in the cache directory
+between runs.
+"""
+
+from array import array
+import hashlib
+import logging
+import os
+import pickle
+import zlib
+
+import arc
+import cache
+import parse
+import program
+
+BOUNDARY_MASK = 0x3F  # ~1 in 64 command lines starts a chunk...
+MIN_LINES = 32        # ...but chunks are at least this long
+MAX_LINES = 2048      # ...and at most about this long
+BLOCK = 1 << 20       # bytes of the file split into lines at a time
+STATE_VERSION = 1     # of the saved chunks; bump when their classes change
+
+
+def split(buffer):
+    """(start, end) byte ranges of the content-defined chunks of buffer"""
+    crc32 = zlib.crc32
+    size = len(buffer)
+    bounds = [0]
+    lines = 0
+    # A block of whole lines at a time, so a mapped file is never copied
+    # into memory all at once
+    start = 0
+    while start < size:
+        end = min(start + BLOCK, size)
+        if end < size:
+            newline = buffer.rfind(b"\n", start, end)
+            if newline < 0:
+                newline = buffer.find(b"\n", end)
+            end = size if newline < 0 else newline + 1
+        block = buffer[start:end].split(b"\n")
+        if end < size:
+            block.pop()  # (empty; the block ends with a newline)
+        position = start
+        for line in block:
+            if lines >= MIN_LINES and line[:1] in (b"G", b"M") \
+                    and (lines >= MAX_LINES or not crc32(line) & BOUNDARY_MASK):
+                bounds.append(position)
+                lines = 0
+            lines += 1
+            position += len(line) + 1
+        start = end
+    if bounds[-1] != size:
+        bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def concatenate(parts):
+    """Join resolved ColumnarPrograms end to end."""
+    columns = {}
+    for name in program.ColumnarProgram.columns:
+        column = array("B" if name == "op" else "d")
+        for part in parts:
+            column.extend(getattr(part, name))
+        columns[name] = column
+    return program.ColumnarProgram(**columns)
+
+
+class IncrementalParser:
+    def __init__(self, filename, directory=None):
+        self.filename = filename
+        self.cache = program_cache = cache.ProgramCache(directory)
+        # Keyed by the file's path (it's the same design being edited) & by
+        # anything that changes what a chunk parses/resolves to
+        key = hashlib.sha256(("%s:%d:%r" % (os.path.abspath(filename),
+                                            parse.PARSER_VERSION,
+                                            arc.CHORD_TOLERANCE)).encode()).hexdigest()
+        self.path = os.path.join(program_cache.directory, key + ".inc")
+        self.parsed = {}    # chunk hash -> ProgramBuilder
+        self.resolved = {}  # (chunk hash, incoming state) -> ColumnarProgram
+        self.stats = {}
+        try:
+            with open(self.path, "rb") as f:
+                version, parsed, resolved = pickle.load(f)
+            if version == STATE_VERSION:
+                self.parsed, self.resolved = parsed, resolved
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            # Anything unpickling can raise (e.g. AttributeError from a class
+            # that's since changed): it's only a cache, so parse from scratch
+            logging.info(f"Discarding incremental parse state {self.path} ({e!r})")
+
+    def parse(self):
+        """Parse the file, reusing whatever chunks haven't changed. Returns a
+        ColumnarProgram identical to program.load()."""
+        parsed = {}
+        resolved = {}
+        parts = []
+        state = (0.0, 0.0, 0.0, 0.0, None)  # X, Y, Z, heading, feedrate
+        reparsed = reresolved = 0
+
+        with parse.MappedLexer(self.filename) as lexer:
+            chunks = split(lexer.buffer)
+            for start, end in chunks:
+                digest = hashlib.sha1(lexer.buffer[start:end]).digest()
+                builder = parsed.get(digest, self.parsed.get(digest))
+                if builder is None:
+                    lexer.tokens = []
+                    lexer.read(start, end)
+                    builder = program.parse_tokens(lexer.tokens)
+                    reparsed += 1
+                parsed[digest] = builder
+
+                key = (digest, state)
+                part = resolved.get(key, self.resolved.get(key))
+                if part is None:
+                    part = builder.resolve(state[:3], state[3], feedrate=state[4])
+                    reresolved += 1
+                resolved[key] = part
+                parts.append(part)
+                if len(part):
+                    # (None rather than NaN for no feedrate, as NaN != NaN
+                    # would never match a key)
+                    feedrate = part.F[-1]
+                    state = part.end + (part.heading[-1], feedrate if feedrate == feedrate else None)
+            lexer.tokens = []
+
+        # Only keep what this version of the file uses
+        self.parsed = parsed
+        self.resolved = resolved
+        self.stats = {"chunks": len(chunks), "reparsed": reparsed,
+                      "reresolved": reresolved}
+        logging.info(f"Incremental parse of {self.filename}: {self.stats}")
+        return concatenate(parts)
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temporary = self.path + ".tmp"
+            with open(temporary, "wb") as f:
+                pickle.dump((STATE_VERSION, self.parsed, self.resolved), f,
+                            pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self.path)
+            self.cache.evict()  # (the state counts towards the cache's size limit)
+        except OSError as e:
+            logging.warning(f"Could not save incremental parse state: {e}")
+
+
+def load(filename, directory=None):
+    """Incrementally parse filename & remember the chunks for next time."""
+    parser = IncrementalParser(filename, directory)
+    result = parser.parse()
+    parser.save()
+    return result
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    parser = IncrementalParser(sys.argv[1])
+    start = time.perf_counter()
+    result = parser.parse()
+    elapsed = time.perf_counter() - start
+    parser.save()
+    print(f"{len(result)} commands in {elapsed * 1000:.1f} ms, {parser.stats}")
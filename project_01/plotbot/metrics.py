@@ -0,0 +1,279 @@
+"""
+--------------------------------------------------------------------------
+metrics.py - pipeline profiling & metrics
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Per-stage profiling for the plot pipeline: timers (with latency histograms),
+counters & gauges around lexing, parsing, command execution, the robot's
+motions and stepping.
+
+Nothing is measured until instrument() is called. It wraps the interesting
+methods in place, so when metrics are off the pipeline runs the original,
+unwrapped code at no cost. A few spots that aren't a single method call (like
+the parse-ahead queue depth) check the module-level enabled flag first.
+
+Results are a plain dict (snapshot()) that can be dumped as JSON at the end of
+a run (dump()) or periodically while it runs (start_periodic_dump()).
+"""
+
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+enabled = False
+
+
+class Histogram:
+    """Durations in power-of-two nanosecond buckets"""
+    def __init__(self):
+        self.buckets = [0] * 64
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def add(self, ns):
+        self.buckets[ns.bit_length()] += 1
+        self.count += 1
+        self.total += ns
+        if self.min is None or ns < self.min:
+            self.min = ns
+        if ns > self.max:
+            self.max = ns
+
+    def percentile(self, fraction):
+        """Upper bound [ns] of the bucket the given fraction falls in"""
+        target = fraction * self.count
+        seen = 0
+        for bits, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= target:
+                return (1 << bits) - 1
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "total_s": self.total / 1e9,
+            "mean_us": self.total / self.count / 1e3,
+            "min_us": self.min / 1e3,
+            "max_us": self.max / 1e3,
+            "p50_us": self.percentile(0.5) / 1e3,
+            "p90_us": self.percentile(0.9) / 1e3,
+            "p99_us": self.percentile(0.99) / 1e3,
+            "histogram_ns": {f"<{1 << bits}": count
+                             for bits, count in enumerate(self.buckets) if count},
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    # Everything that reads or writes the measurements holds the lock, as
+    # the parse-ahead thread, the main thread & start_periodic_dump()'s thread
+    # can all be at it at once
+
+    def reset(self):
+        with self.lock:
+            self.started = time.monotonic()
+            self.timers = {}
+            self.counters = {}
+            self.gauges = {}
+
+    def time(self, name, ns):
+        with self.lock:
+            histogram = self.timers.get(name)
+            if histogram is None:
+                histogram = self.timers[name] = Histogram()
+            histogram.add(ns)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        with self.lock:
+            last, peak = self.gauges.get(name, (value, value))
+            self.gauges[name] = (value, max(peak, value))
+
+    def snapshot(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            result = {
+                "elapsed_s": elapsed,
+                "timers": {name: histogram.summary()
+                           for name, histogram in sorted(self.timers.items())},
+                "counters": dict(sorted(self.counters.items())),
+                "gauges": {name: {"last": last, "max": peak}
+                           for name, (last, peak) in sorted(self.gauges.items())},
+            }
+            # Steps per second while the motors are actually being driven
+            steps = self.counters.get("steps", 0)
+            driving = sum(self.timers[name].total for name in ("robot.move", "robot.reorient")
+                          if name in self.timers) / 1e9
+        if steps and driving:
+            result["steps_per_second"] = steps / driving
+        return result
+
+    def dump(self, path):
+        temporary = path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(temporary, path)
+
+
+registry = Metrics()
+
+
+def timed(name):
+    """Decorator: time every call under name"""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                registry.time(name, time.perf_counter_ns() - start)
+        wrapper.__wrapped_by_metrics__ = True
+        return wrapper
+    return decorate
+
+
+def _timed_execute(function):
+    """Like timed(), but named after the command's class so every command type
+    gets its own histogram"""
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter_ns()
+        try:
+            return function(self, *args, **kwargs)
+        finally:
+            registry.time("execute." + type(self).__name__, time.perf_counter_ns() - start)
+    wrapper.__wrapped_by_metrics__ = True
+    return wrapper
+
+
+def _timed_iterator(name):
+    """Like timed(), but for generator functions: times every item the
+    generator produces (the work between two next() calls) rather than the call
+    that merely creates the generator"""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            iterator = function(*args, **kwargs)
+            while True:
+                start = time.perf_counter_ns()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                registry.time(name, time.perf_counter_ns() - start)
+                yield item
+        wrapper.__wrapped_by_metrics__ = True
+        return wrapper
+    return decorate
+
+
+def _counted_step(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter_ns()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            registry.time("stepper.step", time.perf_counter_ns() - start)
+            registry.count("steps")
+    wrapper.__wrapped_by_metrics__ = True
+    return wrapper
+
+
+def _wrap(owner, attribute, wrapper):
+    function = owner.__dict__.get(attribute)
+    if function is None or getattr(function, "__wrapped_by_metrics__", False):
+        return
+    setattr(owner, attribute, wrapper(function))
+
+
+def instrument():
+    """Turn metrics on: wrap the pipeline's methods with timers/counters."""
+    global enabled
+    if enabled:
+        return
+    import parse
+    import program
+    import robot
+
+    _wrap(parse.Lexer, "read", timed("lexer.read"))
+    _wrap(parse.MappedLexer, "read", timed("lexer.read"))
+    _wrap(parse.Parser, "parse", timed("parser.parse"))
+    # stream() lexes & parses lazily, one command at a time; parse_token's time
+    # includes pulling that command's tokens from iter_tokens
+    _wrap(parse.MappedLexer, "iter_tokens", _timed_iterator("lexer.iter_tokens"))
+    _wrap(parse.Parser, "parse_token", timed("parser.parse_token"))
+    _wrap(program.ProgramBuilder, "resolve", timed("program.resolve"))
+    program.parse_tokens = timed("program.parse_tokens")(program.parse_tokens)
+
+    commands = [parse.Command]
+    while commands:
+        command = commands.pop()
+        _wrap(command, "execute", _timed_execute)
+        commands.extend(command.__subclasses__())
+
+    for motion in ("reorient", "move", "zmove"):
+        _wrap(robot.Robot, motion, timed("robot." + motion))
+    _wrap(robot.Stepper, "step", _counted_step)
+
+    registry.reset()
+    enabled = True
+
+
+def start_periodic_dump(path, interval=5.0):
+    """Dump metrics to path every interval seconds from a daemon thread."""
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                registry.dump(path)
+            except Exception:
+                # Keep dumping; the next one may work (e.g. a full disk)
+                logging.exception(f"Could not dump metrics to {path}")
+
+    threading.Thread(target=run, name="metrics-dump", daemon=True).start()
+    return stop
@@ -35,8 +35,18 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 import sys
 import logging
 import math
+import mmap
+import queue
+import re
+import threading
 
-from robot import robot
+import arc
+import metrics
+from robot import current_position, get_robot
+
+# Bump whenever a change to the lexer/parser changes what a file parses to, so
+# stale entries in the program cache are ignored
+PARSER_VERSION = 4
 
 class Peekable:
     def __init__(self, input):
@@ -50,7 +60,6 @@ class Peekable:
         if self._index < len(self._input):
             character = self._input[self._index]
             self._index += 1
-            print(character, end="")
             return character
         else:
             raise StopIteration
@@ -61,6 +70,26 @@ class Peekable:
             return character
         else:
             return None
+
+class PeekableIterator:
+    """Peekable over any iterator (e.g. MappedLexer.iter_tokens()), so tokens
+    can be consumed as they are produced instead of from a finished list."""
+    def __init__(self, input):
+        self._input = iter(input)
+        self._next = next(self._input, None)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self._next is None:
+            raise StopIteration
+        item = self._next
+        self._next = next(self._input, None)
+        return item
+
+    def peek(self):
+        return self._next
         
 class Token:
     def __init__(self, type, value):
@@ -70,6 +99,28 @@ class Token:
     def __str__(self):
         return f"({self.type}, {self.value})"
 
+    @property
+    def number(self):
+        return float(self.value)
+
+class BufferToken(Token):
+    """Token that is just a view (offset & length) into the mapped gcode file.
+    The value is only decoded when the parser asks for it, and numbers are only
+    converted when something actually needs them."""
+    def __init__(self, type, buffer, offset, length):
+        self.type = type
+        self.buffer = buffer
+        self.offset = offset
+        self.length = length
+
+    @property
+    def value(self):
+        return self.buffer[self.offset:self.offset + self.length].decode("ascii")
+
+    @property
+    def number(self):
+        return float(self.buffer[self.offset:self.offset + self.length])
+
 class ParseError(Exception):
     """Error while parsing the gcode file."""
     def __init__(self, message) -> None:
@@ -122,6 +173,62 @@ class Lexer:
                 print("Tokenizing finished")
                 break
 
+# One alternative per token class. Whitespace & comments match without a group,
+# so match.lastgroup tells the scanner what it found without any extra lookups.
+# An unterminated comment runs to the end of the file, same as Lexer.
+SCANNER = re.compile(rb"""
+      [ \t\r\n]+
+    | \( [^)]* (?: \) | \Z )
+    | (?P<word> [A-Za-z] [-.0-9]* )
+    | (?P<bad> . )
+""", re.VERBOSE | re.DOTALL)
+
+class MappedLexer:
+    """Single-pass lexer over a memory-mapped gcode file.
+
+    Produces the same token stream as Lexer, but tokens are BufferTokens that
+    point into the mapped file rather than copies. Use as a context manager (or
+    call close()) so the mapping is released once parsing is done."""
+    def __init__(self, filename):
+        self.file = open(filename, "rb")
+        try:
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped
+            self.buffer = b""
+        self.tokens = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self.file.close()
+
+    def iter_tokens(self, start=0, end=None):
+        """Yield the tokens of the file, or just of buffer[start:end] (which
+        should begin & end on a line boundary), as they are scanned."""
+        buffer = self.buffer
+        if end is None:
+            end = len(buffer)
+        for match in SCANNER.finditer(buffer, start, end):
+            kind = match.lastgroup
+            if kind is None:
+                continue
+            start, end = match.span()
+            if kind == "word":
+                yield BufferToken(chr(buffer[start]), buffer, start + 1, end - start - 1)
+            else:
+                raise ParseError("Unexpected character " + chr(buffer[start]))
+
+    def read(self, start=0, end=None):
+        self.tokens.extend(self.iter_tokens(start, end))
+        logging.info("Tokenizing finished")
+
 class Command:
     def __init__(self, args):
         self.args = args
@@ -138,90 +245,155 @@ class Command:
 
 
 class Move(Command):
-    """Encompasses G0 (Rapid move) & G1 (Linear move) commands"""
-    def __init__(self, args) -> None:
+    """Encompasses G0 (Rapid move) & G1 (Linear move) commands
+
+    origin is the (X, Y, Z) the move starts from. The Parser tracks this as it
+    goes; if not given, the robot's current position is used. feedrate [mm/min]
+    is the modal F in effect (None if the file never set one).
+
+    absolute_angle is the heading [deg] the robot faces for the move. A
+    negative distance drives it backwards (see planner.py), & turns of up to
+    turn_tolerance [deg] are skipped."""
+    feedrate = None
+    turn_tolerance = 0.0
+
+    def __init__(self, args, origin=None) -> None:
         super().__init__(args)
-        if "X" in self.args and "Y" in self.args:
-            self.dX = float(self.args["X"]) - robot.X
-            self.dY = float(self.args["Y"]) - robot.Y
-            try:
-                self.absolute_angle = math.degrees(math.atan(self.dY / self.dX))
-            except ZeroDivisionError:
-                self.absolute_angle = 0 if self.dY > 0 else -180 # yowza
-            self.distance = math.sqrt(self.dX ** 2 + self.dY ** 2)
-            self.dZ = 0
-
-        elif "Z" in self.args:
-            self.dZ = float(self.args["Z"]) - robot.Z
-            self.absolute_angle = 0
-            self.distance = 0
-        
-        # Future: add arc moves
+        if origin is None:
+            origin = current_position()
+        X, Y, Z = origin
+        self.dX = self.dY = self.dZ = 0
+        self.absolute_angle = 0
+        self.distance = 0
+        if "X" in self.args or "Y" in self.args:
+            self.dX = float(self.args.get("X", X)) - X
+            self.dY = float(self.args.get("Y", Y)) - Y
+            self.distance = math.hypot(self.dX, self.dY)
+            if self.distance:
+                self.absolute_angle = math.degrees(math.atan2(self.dY, self.dX))
+        if "Z" in self.args:
+            self.dZ = float(self.args["Z"]) - Z
+        self.target = (X + self.dX, Y + self.dY, Z + self.dZ)
+
+    @classmethod
+    def planned(cls, args, dX, dY, dZ, absolute_angle, distance):
+        """Build a Move whose geometry has already been worked out elsewhere
+        (e.g. program.ColumnarProgram) instead of against the robot."""
+        move = cls.__new__(cls)
+        Command.__init__(move, args)
+        move.dX = dX
+        move.dY = dY
+        move.dZ = dZ
+        move.absolute_angle = absolute_angle
+        move.distance = distance
+        return move
     
     def execute(self) -> None:
         """Reorient & move the robot."""
-        robot.reorient(self.absolute_angle)
-        robot.move(self.distance)
+        robot = get_robot()
+        if self.distance:
+            robot.reorient(self.absolute_angle, self.turn_tolerance)
+            robot.move(self.distance, self.feedrate)
         robot.zmove(self.dZ)
 
 
-# class ControlledArcMove(Command):
-#     def __init__(self, X: float, Y: float, I: float, J: float) -> None:
-#         self.X = X
-#         self.Y = Y
-#         self.I = I
-#         self.J = J
+class ControlledArcMove(Command):
+    """Encompasses G2 (clockwise) & G3 (counterclockwise) arc moves. The arc is
+    linearized (see arc.py) into chords, each of which is a reorient & move.
 
-#         self.dX = self.args["X"] - robot.X
-#         self.dY = self.args["Y"]- robot.Y
-#         self.absolute_angle = math.degrees(math.atan(self.dY / self.dX))
+    The center comes from I/J (offset from the start point) or R."""
+    clockwise = True
+    feedrate = None
 
-#     def execute(self) -> None:
-#         """Reorient & arcmove the robot."""
-#         robot.reorient(self.absolute_angle)
+    def __init__(self, args, origin=None) -> None:
+        super().__init__(args)
+        if origin is None:
+            origin = current_position()
+        X, Y, Z = origin
+        end = (float(self.args.get("X", X)), float(self.args.get("Y", Y)))
+        words = {word: float(self.args[word]) for word in ("I", "J", "R") if word in self.args}
+        try:
+            points = arc.arc_points((X, Y), end, self.clockwise, **words)
+        except ValueError as e:
+            raise ParseError(f"Bad arc {self.args}: {e}")
+
+        self.chords = []
+        last = (X, Y)
+        for point in points:
+            dX = point[0] - last[0]
+            dY = point[1] - last[1]
+            self.chords.append((math.degrees(math.atan2(dY, dX)), math.hypot(dX, dY)))
+            last = point
+        self.dZ = float(self.args["Z"]) - Z if "Z" in self.args else 0
+        self.target = (end[0], end[1], Z + self.dZ)
+
+    def execute(self) -> None:
+        """Reorient & move along each chord of the arc."""
+        robot = get_robot()
+        for absolute_angle, distance in self.chords:
+            robot.reorient(absolute_angle)
+            robot.move(distance, self.feedrate)
+        robot.zmove(self.dZ)
+
+class CounterclockwiseArcMove(ControlledArcMove):
+    clockwise = False
         
 
 class Dwell(Command):
-    def __init__(self, P: int) -> None:
-        self.P = P
+    """G04: pause for P seconds (0 if not given)"""
+    def __init__(self, args) -> None:
+        super().__init__(args)
+        P = float(args.get("P", 0.0))
+        self.P = P if P == P else 0.0  # (a ColumnarProgram has NaN for no P)
 
     def execute(self):
-        robot.dwell(self.P)
+        get_robot().dwell(self.P)
 
 class Bell(Command):
     def __init__(self, P: float) -> None:
         self.P = P
 
     def execute(self):
-        robot.bell(self.P)
+        get_robot().bell(self.P)
 
 class Ignore(Command):
     """Rationale here is that some (many) commands can be ignored for MVP but
     might someday be useful to handle - better to acknowledge them than squash them"""
     pass
 
+COMMANDS = {
+    "G00": Move,
+    "G01": Move,
+    "G02": ControlledArcMove,
+    "G03": CounterclockwiseArcMove,
+    "G04": Dwell,
+    "G53": Ignore, # CNC plane select (irrelevant)
+    "G54": Ignore, # CNC plane select (irrelevant)
+    "G55": Ignore, # CNC plane select (irrelevant)
+    "G56": Ignore, # CNC plane select (irrelevant)
+    "G57": Ignore, # CNC plane select (irrelevant)
+    "G58": Ignore, # CNC plane select (irrelevant)
+    "G59": Ignore, # CNC plane select (irrelevant)
+    "G90": Ignore, # Absolute positioning. Relative positioning not supported.
+    "M3": Ignore,
+    "M05": Ignore,
+    "M30": Ignore
+}
+
 class Parser:
-    def __init__(self, tokens):
-        self.tokens = Peekable(tokens)
-        self.commands = {
-            "G00": Move,
-            "G01": Move,
-            "G02": Move, # Future ControlledArcMove
-            "G03": Move, # Future ContorlledArcMove
-            "G04": Dwell,
-            "G53": Ignore, # CNC plane select (irrelevant)
-            "G54": Ignore, # CNC plane select (irrelevant)
-            "G55": Ignore, # CNC plane select (irrelevant)
-            "G56": Ignore, # CNC plane select (irrelevant)
-            "G57": Ignore, # CNC plane select (irrelevant)
-            "G58": Ignore, # CNC plane select (irrelevant)
-            "G59": Ignore, # CNC plane select (irrelevant)
-            "G90": Ignore, # Absolute positioning. Relative positioning not supported.
-            "M3": Ignore,
-            "M05": Ignore,
-            "M30": Ignore
-        }
+    def __init__(self, tokens, position=None):
+        """tokens can be a list or any iterator of tokens. position is where
+        the pen starts (defaults to the robot's position)."""
+        if isinstance(tokens, list):
+            self.tokens = Peekable(tokens)
+        else:
+            self.tokens = PeekableIterator(tokens)
+        self.commands = COMMANDS
         self.program = []
+        # Modal position the next Move starts from
+        self.position = tuple(position) if position is not None else current_position()
+        # Modal feedrate (F) [mm/min]
+        self.feedrate = None
 
     def is_command(self, token) -> bool:
         if token == None:
@@ -232,32 +404,116 @@ class Parser:
         command_name = token.type + token.value
         try:
             command = self.commands[command_name]
-            arguments = {}
-            while True:
-                if self.is_command(self.tokens.peek()):
-                    return command(arguments)
-                else: # next token is an argument to command
-                    arg_token = self.tokens.next()
-                    arguments[arg_token.type] = arg_token.value
         except KeyError:
             raise ParseError(f"Command {command_name} is invalid or not supported.")
+        arguments = {}
+        while True:
+            next = self.tokens.peek()
+            if next is None or self.is_command(next):
+                break
+            else: # next token is an argument to command
+                arg_token = self.tokens.next()
+                arguments[arg_token.type] = arg_token.value
+        if "F" in arguments:
+            feedrate = float(arguments["F"])
+            if not feedrate > 0:
+                raise ParseError(f"Feedrate F{arguments['F']} must be positive.")
+            self.feedrate = feedrate
+        if issubclass(command, (Move, ControlledArcMove)):
+            move = command(arguments, self.position)
+            self.position = move.target
+            move.feedrate = self.feedrate
+            return move
+        return command(arguments)
     
     def parse_token(self):
         token = self.tokens.next()
         if self.is_command(token):
-            self.program.append(self.parse_command(token))
+            command = self.parse_command(token)
+            if isinstance(token, BufferToken):
+                # Where the command starts in the file (see checkpoint.py)
+                command.offset = token.offset - 1
+            return command
         else:
             raise ParseError(f"Unexpected token {str(token)}")
+
+    def iter_commands(self):
+        """Yield commands one at a time as they are parsed."""
+        while self.tokens.peek() is not None:
+            yield self.parse_token()
         
     def parse(self):
-        while True:
+        self.program.extend(self.iter_commands())
+        print("parse finished")
+        return self.program
+
+def stream(filename, maxsize=64, start=0, position=None):
+    """Parse filename on a background thread, yielding commands as the caller
+    is ready for them. start (a byte offset of a command) & position (where
+    the pen is at that point) let a job pick up partway through the file.
+
+    At most maxsize parsed commands are buffered, so memory use doesn't depend
+    on the size of the file, and the first command is available as soon as it
+    has been parsed. A ParseError is raised when iteration reaches the point in
+    the file where it happened, not before."""
+    commands = queue.Queue(maxsize)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
             try:
-                self.parse_token()
-            except StopIteration:
-                print("parse finished")
-                return self.program
+                commands.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def produce():
+        try:
+            with MappedLexer(filename) as lexer:
+                parser = Parser(lexer.iter_tokens(start), position)
+                for command in parser.iter_commands():
+                    put(command)
+                    if stop.is_set():
+                        return
+        except Exception as error:
+            put(error)
+            return
+        put(done)
+
+    producer = threading.Thread(target=produce, name="parse-ahead", daemon=True)
+    producer.start()
+    try:
+        while True:
+            if metrics.enabled:
+                metrics.registry.gauge("stream.queue_depth", commands.qsize())
+            item = commands.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
             
-def parse(filename):
+def parse(filename, mapped=True, cache=None, workers=None):
+    """Parse a gcode file into a program (list of commands).
+
+    By default the file is tokenized with MappedLexer; pass mapped=False to use
+    the original character-at-a-time Lexer. If a cache.ProgramCache is given,
+    the program comes from (and is saved to) the cache as a ColumnarProgram.
+    workers > 1 parses the file in parallel chunks (also a ColumnarProgram)."""
+    if cache is not None:
+        return cache.load(filename, workers=workers)
+    if workers is not None:
+        import program  # program imports this module
+        return program.load(filename, workers=workers)
+
+    if mapped:
+        with MappedLexer(filename) as lexer:
+            lexer.read()
+            parser = Parser(lexer.tokens)
+            return parser.parse()
 
     with open(filename, "r") as f:
         gcode = "".join(f.readlines())
@@ -0,0 +1,194 @@
+"""
+--------------------------------------------------------------------------
+planner.py - look-ahead heading planner
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Look-ahead heading planner. Our robot turns in place before every move, &
+turning is most of a job's time. But a line can be drawn driving either way
+along it: facing its end (forward) or its start (backing up). This pass
+looks at the whole run of moves & picks, for each one, the way to drive it
+that turns least overall (a shortest path over the forward/reverse choice of
+every move, so one awkward turn can be traded for several smaller ones).
+
+Turns of up to a tolerance [deg] can also be skipped: the robot drives on
+along its current heading, so each such move lands up to distance *
+sin(tolerance) off the line (the robot still tracks where it should be along
+the line, see robot.Pose).
+
+Run it after the other passes (simplify.py, travel.py); it keeps every row &
+position, changing only the heading the robot faces & the sign of distance
+(negative = backwards).
+
+Usage: python planner.py GCODE [--tolerance DEG] [--no-reverse]
+"""
+
+from array import array
+
+import program
+
+TOLERANCE = 0.0  # [deg] turns this small are skipped
+EPSILON = 1e-9   # [deg] only reverse a move when it saves more than this
+
+
+def turn(a, b):
+    """Smallest rotation [deg] from heading a to heading b"""
+    return abs((b - a + 180.0) % 360.0 - 180.0)
+
+
+def turn_angles(headings, tolerance=0.0, facing=0.0):
+    """The turn [deg] the robot makes to face each of headings in turn,
+    starting from facing; turns of up to tolerance are skipped (0)."""
+    angles = []
+    for heading in headings:
+        angle = turn(facing, heading)
+        if angle <= tolerance:
+            angle = 0.0
+        else:
+            facing = heading
+        angles.append(angle)
+    return angles
+
+
+class PlanReport:
+    def __init__(self, turned_before, turned_after, turns_before, turns_after, reversed_moves):
+        self.turned_before = turned_before  # [deg]
+        self.turned_after = turned_after    # [deg]
+        self.turns_before = turns_before
+        self.turns_after = turns_after
+        self.reversed_moves = reversed_moves
+
+    @property
+    def saved(self):
+        """Degrees of turning saved"""
+        return self.turned_before - self.turned_after
+
+    def __str__(self):
+        return (f"Heading plan: turning {self.turned_before:.0f} -> {self.turned_after:.0f} deg "
+                f"({self.saved:.0f} deg saved), turns {self.turns_before} -> "
+                f"{self.turns_after}, {self.reversed_moves} moves driven backwards")
+
+
+def plan(prog, tolerance=TOLERANCE, reverse=True, heading=0.0):
+    """Plan the headings of a ColumnarProgram for a robot starting to face
+    heading [deg]. Returns (ColumnarProgram, PlanReport)."""
+    distance = prog.distance
+    moves = [i for i in range(len(prog)) if distance[i]]
+    headings = [prog.heading[i] for i in moves]
+
+    # Shortest path over (move, forward/backward). Driving two moves the same
+    # way turns by the angle between them, d; driving them opposite ways turns
+    # by 180 - d. cost_forward & cost_backward are the least turning to have
+    # driven the moves so far with the last one forward/backward, &
+    # switched[k] records whether that path drove move k - 1 the other way
+    # (bit 0 for forward, bit 1 for backward).
+    backwards = bytearray(len(moves))
+    if moves and reverse:
+        angles = [turn(a, b) for a, b in zip([heading] + headings[:-1], headings)]
+        if tolerance:
+            same = [0.0 if d <= tolerance else d for d in angles]
+            other = [0.0 if 180.0 - d <= tolerance else 180.0 - d for d in angles]
+        else:
+            same = angles
+            other = [180.0 - d for d in angles]
+        # (The robot starts facing heading, as if it had driven forward)
+        cost_forward = same[0]
+        cost_backward = other[0]
+        switched = bytearray(len(moves))
+        for k in range(1, len(moves)):
+            s = same[k]
+            o = other[k]
+            forward = cost_forward + s
+            crossed = cost_backward + o
+            backward = cost_backward + s
+            uncrossed = cost_forward + o
+            if crossed < forward - EPSILON:
+                forward = crossed
+                switched[k] = 1
+            if uncrossed < backward - EPSILON:
+                backward = uncrossed
+                switched[k] |= 2
+            cost_forward = forward
+            cost_backward = backward
+
+        # Follow the choices back from the cheapest end
+        b = 1 if cost_backward < cost_forward - EPSILON else 0
+        for k in range(len(moves) - 1, -1, -1):
+            backwards[k] = b
+            if switched[k] >> b & 1:
+                b ^= 1
+
+    # New heading & distance columns; rows that don't move in XY keep the last
+    # heading so they never ask the robot to turn
+    new_heading = array("d")
+    new_distance = array("d", distance)
+    facings = []
+    k = 0
+    facing = heading
+    for i in range(len(prog)):
+        if distance[i]:
+            facing = headings[k]
+            if backwards[k]:
+                facing = (facing + 360.0) % 360.0 - 180.0  # the other way, in [-180, 180)
+                new_distance[i] = -distance[i]
+            facings.append(facing)
+            k += 1
+        new_heading.append(facing)
+
+    planned = program.ColumnarProgram(prog.op, prog.X, prog.Y, prog.Z, prog.dX, prog.dY,
+                                      prog.dZ, new_heading, new_distance, prog.P, prog.F)
+    planned.turn_tolerance = tolerance
+
+    before = turn_angles(headings, 0.0, heading)
+    after = turn_angles(facings, tolerance, heading)
+    report = PlanReport(sum(before), sum(after), len(before) - before.count(0.0),
+                        len(after) - after.count(0.0), sum(backwards))
+    return planned, report
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    import cache
+
+    arg_parser = argparse.ArgumentParser(description="Plan headings to minimize turning.")
+    arg_parser.add_argument("program_file")
+    arg_parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                            help="skip turns of up to this many degrees")
+    arg_parser.add_argument("--no-reverse", action="store_true",
+                            help="always drive forwards")
+    args = arg_parser.parse_args()
+
+    prog = cache.ProgramCache().load(args.program_file)
+    start = time.perf_counter()
+    planned, report = plan(prog, args.tolerance, reverse=not args.no_reverse)
+    print(report)
+    print(f"({len(prog)} rows in {time.perf_counter() - start:.2f} s)")
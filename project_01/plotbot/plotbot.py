@@ -35,21 +35,296 @@ PlotBot
 
 Run this file with the gcode as a single command-line argument. If no gcode is
 provided, the software will not run.
+
+Options:
+  --no-cache      Parse the file from scratch instead of using the program cache
+  --clear-cache   Empty the program cache (with no gcode, just clears & exits)
+  --stream        Parse ahead on a background thread while executing, instead
+                  of parsing the whole file first (not with the optimization
+                  options below)
+  --incremental   Only re-parse the parts of the file that changed since the
+                  last run (for files being edited)
+  --simplify TOLERANCE
+                  Merge collinear moves, drop moves that go nowhere & simplify
+                  polylines to within TOLERANCE mm (0 = exact merges only)
+  --optimize-travel
+                  Reorder strokes to cut down pen-up travel & turning
+  --plan-turns TOLERANCE
+                  Drive moves forwards or backwards, whichever turns least over
+                  the whole job, & skip turns of up to TOLERANCE deg (see
+                  planner.py)
+  --chord-tolerance MM
+                  Break arcs (G02/G03) into chords that stay within MM of the
+                  true arc (default arc.CHORD_TOLERANCE)
+  --checkpoint    Save progress every few commands so the job can be resumed
+                  (runs the job streamed, so not with the optimization options)
+  --resume        Continue an interrupted --checkpoint job where it left off
+  --metrics FILE  Time each stage of the pipeline & write the results to FILE
+                  (JSON) when the job ends
+  --metrics-interval SECONDS
+                  Also rewrite the --metrics file every SECONDS while running
+  --trace FILE    Record the time of every step into FILE for jitter analysis
+                  (see steptrace.py)
+  --dry-run       Run the job on simulated GPIO (no hardware needed) & as fast
+                  as possible instead of at the steppers' speed
+  --estimate      Don't run the job, just estimate how long it would take (see
+                  estimate.py for the timing model)
+  --compile PLAN  Don't run the job, compile it to a step plan file (see
+                  compiler.py) that can be run later with --plan
+  --plan          The file given is a compiled step plan; run it
+  --executor      Drive the steppers from a separate process fed through shared
+                  memory (see executor.py), so planning can't disturb timing
+  --executor-cpu N, --executor-priority P
+                  Pin the executor to CPU N / run it at real-time priority P
+  --serve         Run as a job server (see server.py) instead: take jobs over a
+                  Unix socket & run them one after another, planning the next
+                  ones while the current one plots (with --dry-run/--executor)
+  --submit        Queue the gcode on the running server instead of running it
+                  (with --priority N & the optimization options)
+  --status        Show the server's jobs
 """
 
 
+import argparse
 import threading
 import logging
+import os
 import sys
 
+import arc
+import cache
+import checkpoint
+import compiler
+import estimate
+import executor
+import gpio
+import server
+import incremental
+import metrics
 import parse
-from robot import robot
+import planner
+import program as columnar
+import simplify
+import steptrace
+import travel
+from robot import get_robot
 
 if __name__ == "__main__":
-    program_file = sys.argv[1]
-    program = parse.parse(program_file)
-    for command in program:
-        print(f"Executing {str(command)}... ", end="")
-        command.execute()
-        print("Done.")
-    print("Program execution complete.")
\ No newline at end of file
+    arg_parser = argparse.ArgumentParser(description="Plot a gcode file.")
+    arg_parser.add_argument("program_file", nargs="?")
+    arg_parser.add_argument("--no-cache", action="store_true",
+                            help="parse from scratch, bypassing the program cache")
+    arg_parser.add_argument("--clear-cache", action="store_true",
+                            help="empty the program cache")
+    arg_parser.add_argument("--stream", action="store_true",
+                            help="parse ahead while executing")
+    arg_parser.add_argument("--incremental", action="store_true",
+                            help="only re-parse what changed since the last run")
+    arg_parser.add_argument("--simplify", type=float, metavar="TOLERANCE",
+                            help="simplify paths to within TOLERANCE mm")
+    arg_parser.add_argument("--optimize-travel", action="store_true",
+                            help="reorder strokes to minimize pen-up travel")
+    arg_parser.add_argument("--plan-turns", type=float, metavar="TOLERANCE",
+                            help="plan headings to minimize turning")
+    arg_parser.add_argument("--chord-tolerance", type=float, metavar="MM",
+                            help="how far arc chords may stray from the arc "
+                                 f"(default {arc.CHORD_TOLERANCE} mm)")
+    arg_parser.add_argument("--checkpoint", action="store_true",
+                            help="save progress so the job can be resumed")
+    arg_parser.add_argument("--resume", action="store_true",
+                            help="continue an interrupted job")
+    arg_parser.add_argument("--metrics", metavar="FILE",
+                            help="write pipeline timings & counters to FILE")
+    arg_parser.add_argument("--metrics-interval", type=float, metavar="SECONDS",
+                            help="rewrite the metrics file every SECONDS")
+    arg_parser.add_argument("--trace", metavar="FILE",
+                            help="record step timings to FILE")
+    arg_parser.add_argument("--dry-run", action="store_true",
+                            help="use simulated GPIO instead of the real pins")
+    arg_parser.add_argument("--estimate", action="store_true",
+                            help="estimate the job's duration instead of running it")
+    arg_parser.add_argument("--compile", metavar="PLAN",
+                            help="compile the job to a step plan instead of running it")
+    arg_parser.add_argument("--plan", action="store_true",
+                            help="run a compiled step plan")
+    arg_parser.add_argument("--executor", action="store_true",
+                            help="drive the steppers from a separate process")
+    arg_parser.add_argument("--executor-cpu", type=int, metavar="N",
+                            help="pin the executor process to CPU N")
+    arg_parser.add_argument("--executor-priority", type=int, metavar="P",
+                            help="real-time (SCHED_FIFO) priority for the executor")
+    arg_parser.add_argument("--serve", action="store_true",
+                            help="run as a job server")
+    arg_parser.add_argument("--submit", action="store_true",
+                            help="queue the file on the job server")
+    arg_parser.add_argument("--priority", type=int, default=0,
+                            help="job priority for --submit (higher runs first)")
+    arg_parser.add_argument("--status", action="store_true",
+                            help="show the job server's jobs")
+    args = arg_parser.parse_args()
+    if args.executor and (args.checkpoint or args.resume):
+        arg_parser.error("--executor can't be used with --checkpoint/--resume")
+    # Checkpointed, streamed & --plan jobs run the file as written
+    if (args.simplify is not None or args.optimize_travel or args.plan_turns is not None) \
+            and (args.stream or args.checkpoint or args.resume or args.plan):
+        arg_parser.error("--simplify/--optimize-travel/--plan-turns can't be used with "
+                         "--stream/--checkpoint/--resume/--plan")
+
+    if args.chord_tolerance is not None:
+        if args.chord_tolerance <= 0:
+            arg_parser.error("--chord-tolerance must be positive")
+        if args.submit:
+            arg_parser.error("--chord-tolerance can't be used with --submit "
+                             "(the server uses its own)")
+        # Part of the program cache's & incremental parses' keys, so programs
+        # linearized with another tolerance aren't reused
+        arc.CHORD_TOLERANCE = args.chord_tolerance
+
+    if args.status:
+        print(server.format_status(server.request({"op": "status"})["jobs"]))
+        sys.exit()
+    if args.submit:
+        if args.program_file is None:
+            arg_parser.error("--submit needs a gcode file")
+        reply = server.request({"op": "submit", "path": os.path.abspath(args.program_file),
+                                "priority": args.priority, "simplify": args.simplify,
+                                "optimize_travel": args.optimize_travel,
+                                "plan_turns": args.plan_turns})
+        print(f"Queued as job {reply['job']}." if reply["ok"] else reply["error"])
+        sys.exit()
+
+    program_cache = cache.ProgramCache()
+    if args.clear_cache:
+        program_cache.clear()
+        print("Program cache cleared.")
+    if args.program_file is None and not args.serve:
+        sys.exit()
+
+    if args.dry_run or args.estimate or args.compile:
+        gpio.use("sim")
+    robot = get_robot()
+    if args.dry_run:
+        robot.scheduler = None  # no motors to keep in time with; go flat out
+
+    if args.serve:
+        server.Server(executor=args.executor).run()
+        sys.exit()
+
+    if args.metrics:
+        metrics.instrument()
+        if args.metrics_interval:
+            metrics.start_periodic_dump(args.metrics, args.metrics_interval)
+    tracer = None
+    if args.trace:
+        tracer = steptrace.Tracer()
+        tracer.install()
+
+    if args.plan:
+        events = compiler.run(args.program_file, timed=robot.scheduler is not None)
+        print(f"Step plan complete ({events} step events).")
+        sys.exit()
+
+    # Checkpointed jobs are numbered by the commands in the file as written,
+    # so they run streamed & without the optimization passes
+    checkpointer = None
+    first = 0
+    position = (robot.X, robot.Y, robot.Z)
+    if args.checkpoint or args.resume:
+        checkpointer = checkpoint.Checkpoint(args.program_file)
+        state = checkpointer.load() if args.resume else None
+        if state is not None:
+            checkpoint.restore(state, robot)
+            first = state["command"]
+            position = tuple(state["position"])
+            print(f"Resuming at command {first}.")
+            program = parse.stream(args.program_file, start=state["offset"],
+                                   position=position)
+        else:
+            if args.resume:
+                print("Nothing to resume, starting from the beginning.")
+            program = parse.stream(args.program_file)
+    elif args.stream:
+        program = parse.stream(args.program_file)
+    elif args.incremental:
+        program = incremental.load(args.program_file)
+    else:
+        program = parse.parse(args.program_file,
+                              cache=None if args.no_cache else program_cache)
+
+    # Optimization passes work on the columnar form of the program
+    if args.simplify is not None or args.optimize_travel or args.plan_turns is not None:
+        if not isinstance(program, columnar.ColumnarProgram):
+            program = columnar.load(args.program_file)
+        if args.simplify is not None:
+            program, report = simplify.simplify(program, args.simplify)
+            print(report)
+        if args.optimize_travel:
+            program, report = travel.optimize(program)
+            print(report)
+        if args.plan_turns is not None:
+            program, report = planner.plan(program, args.plan_turns)
+            print(report)
+
+    if args.estimate:
+        if not isinstance(program, columnar.ColumnarProgram):
+            program = program_cache.load(args.program_file)
+        print(estimate.estimate(program))
+        sys.exit()
+
+    if args.compile:
+        plan = compiler.compile_program(program)
+        plan.write(args.compile)
+        print(f"Compiled {len(plan.masks)} step events to {args.compile}.")
+        sys.exit()
+
+    if args.executor:
+        # Compile each command to step events as we go & let the executor
+        # process run them
+        plan = compiler.Plan(robot.left_stepper.lead_pin, robot.right_stepper.lead_pin,
+                             robot.pose)
+        with executor.Executor(robot, timed=robot.scheduler is not None,
+                               cpu=args.executor_cpu,
+                               priority=args.executor_priority) as step_executor:
+            for command in program:
+                plan.add(command)
+                step_executor.feed(plan)
+            plan.finish()
+            step_executor.feed(plan)
+        plan.apply(robot)
+        print("Program execution complete.")
+        print(f"Executor: {step_executor}")
+        sys.exit()
+
+    completed = first
+    pose = checkpoint.pose(robot)
+    try:
+        for number, command in enumerate(program, first):
+            if checkpointer is not None:
+                checkpointer.index.note(number, getattr(command, "offset", None))
+                if checkpointer.due(number):
+                    checkpointer.save(number, pose, position)
+            if tracer is not None:
+                tracer.mark(number)
+            print(f"Executing {str(command)}... ", end="")
+            command.execute()
+            print("Done.")
+            completed = number + 1
+            pose = checkpoint.pose(robot)
+            position = getattr(command, "target", position)
+    except BaseException:
+        # Interrupted (Ctrl-C, error...): save where the last whole command
+        # left off
+        if checkpointer is not None and completed < len(checkpointer.index):
+            checkpointer.save(completed, pose, position)
+            print(f"\nStopped after command {completed - 1}; use --resume to continue.")
+        raise
+    finally:
+        if args.metrics:
+            metrics.registry.dump(args.metrics)
+        if tracer is not None:
+            tracer.dump(args.trace)
+    if checkpointer is not None:
+        checkpointer.clear()
+    print("Program execution complete.")
+    if isinstance(gpio.backend(), gpio.SimGPIO):
+        print(gpio.backend().summary())
\ No newline at end of file
@@ -0,0 +1,352 @@
+"""
+--------------------------------------------------------------------------
+program.py - columnar program representation
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Instead of one Command object (with a dict of strings) per line, a program is
+kept as parallel typed arrays: opcode, absolute X/Y/Z, dX/dY/dZ, heading,
+distance & feedrate. Parsing only records what each line says
+(ProgramBuilder); the modal position & feedrate are tracked & all of the move
+geometry is computed afterwards in one pass over the arrays
+(ProgramBuilder.resolve). Arcs are linearized into G01
+chords while resolving, so a resolved program only holds straight moves.
+
+Only the standard library array module is used so this still runs on a stock
+PocketBeagle image.
+"""
+
+from array import array
+import concurrent.futures
+import math
+import operator
+
+import arc
+import parse
+
+NAN = float("nan")
+
+# Opcodes are indices into the parser's command table
+OPCODES = tuple(parse.COMMANDS)
+OPCODE = {name: index for index, name in enumerate(OPCODES)}
+MOVES = frozenset(OPCODE[name] for name in ("G00", "G01", "G02", "G03"))
+ARCS = {OPCODE["G02"]: True, OPCODE["G03"]: False}  # opcode -> clockwise
+LINEAR = OPCODE["G01"]
+DWELL = OPCODE["G04"]
+
+
+class ProgramBuilder:
+    """Rows as they appear in the file: opcode plus whichever axes the line
+    actually gave (NaN otherwise). Nothing here depends on where the robot is,
+    so builders can be filled independently and joined before resolving."""
+    def __init__(self):
+        self.op = array("B")
+        self.X = array("d")
+        self.Y = array("d")
+        self.Z = array("d")
+        self.P = array("d")
+        self.F = array("d")
+        self.I = array("d")
+        self.J = array("d")
+        self.R = array("d")
+
+    def __len__(self):
+        return len(self.op)
+
+    def add(self, op, X=NAN, Y=NAN, Z=NAN, P=NAN, F=NAN, I=NAN, J=NAN, R=NAN):
+        self.op.append(op)
+        self.X.append(X)
+        self.Y.append(Y)
+        self.Z.append(Z)
+        self.P.append(P)
+        self.F.append(F)
+        self.I.append(I)
+        self.J.append(J)
+        self.R.append(R)
+
+    def extend(self, other):
+        self.op.extend(other.op)
+        self.X.extend(other.X)
+        self.Y.extend(other.Y)
+        self.Z.extend(other.Z)
+        self.P.extend(other.P)
+        self.F.extend(other.F)
+        self.I.extend(other.I)
+        self.J.extend(other.J)
+        self.R.extend(other.R)
+
+    def resolve(self, start=(0.0, 0.0, 0.0), heading=0.0, tolerance=None, feedrate=None):
+        """Track the modal position from start (& the modal feedrate [mm/min]
+        from feedrate, None if none has been set) and compute the geometry of
+        every row. Arcs become one G01 row per chord (within tolerance, see
+        arc.py). Returns a ColumnarProgram."""
+        x, y, z = start
+        f = NAN if feedrate is None else feedrate
+        ops = array("B")
+        xs = array("d")
+        ys = array("d")
+        zs = array("d")
+        ps = array("d")
+        fs = array("d")
+        for op, X, Y, Z, P, F, I, J, R in zip(self.op, self.X, self.Y, self.Z, self.P,
+                                              self.F, self.I, self.J, self.R):
+            if F == F:
+                f = F
+            if op in ARCS and (I == I or J == J or R == R):
+                end = (X if X == X else x, Y if Y == Y else y)
+                end_z = Z if Z == Z else z
+                try:
+                    points = arc.arc_points((x, y), end, ARCS[op],
+                                            I if I == I else None,
+                                            J if J == J else None,
+                                            R if R == R else None, tolerance)
+                except ValueError as e:
+                    raise parse.ParseError(f"Bad arc {OPCODES[op]}: {e}")
+                # Any Z change is spread along the chords (helical move)
+                for k, point in enumerate(points, 1):
+                    ops.append(LINEAR)
+                    xs.append(point[0])
+                    ys.append(point[1])
+                    zs.append(z + (end_z - z) * k / len(points))
+                    ps.append(P)
+                    fs.append(f)
+                x, y, z = end[0], end[1], end_z
+                continue
+            if op in MOVES:
+                # NaN != NaN, so these only pick up axes the line gave
+                if X == X:
+                    x = X
+                if Y == Y:
+                    y = Y
+                if Z == Z:
+                    z = Z
+            ops.append(op)
+            xs.append(x)
+            ys.append(y)
+            zs.append(z)
+            ps.append(P)
+            fs.append(f)
+
+        sub = operator.sub
+        dx = array("d", map(sub, xs, _shifted(xs, start[0])))
+        dy = array("d", map(sub, ys, _shifted(ys, start[1])))
+        dz = array("d", map(sub, zs, _shifted(zs, start[2])))
+        distance = array("d", map(math.hypot, dx, dy))
+
+        # Rows without XY motion (pen moves, dwells...) keep the last heading so
+        # they never ask the robot to turn
+        headings = array("d")
+        for ddx, ddy, d in zip(dx, dy, distance):
+            if d:
+                heading = math.degrees(math.atan2(ddy, ddx))
+            headings.append(heading)
+
+        return ColumnarProgram(ops, xs, ys, zs, dx, dy, dz, headings, distance, ps, fs)
+
+
+def _shifted(column, first):
+    """column delayed by one row, starting with first"""
+    shifted = array("d", [first])
+    shifted.extend(column[:-1])
+    return shifted
+
+
+class ColumnarProgram:
+    """A parsed & resolved program stored as parallel arrays.
+
+    Iterating yields ordinary commands (built on demand) so plotbot.py can run
+    it exactly like the list returned by parse.parse().
+
+    heading is the way the robot faces for each row & distance is negative for
+    rows it drives backwards (see planner.py); turn_tolerance [deg] is how
+    small a turn the robot skips. F is the modal feedrate [mm/min] of each
+    row (NaN until the program sets one)."""
+    columns = ("op", "X", "Y", "Z", "dX", "dY", "dZ", "heading", "distance", "P", "F")
+    turn_tolerance = 0.0
+
+    def __init__(self, op, X, Y, Z, dX, dY, dZ, heading, distance, P, F):
+        self.op = op
+        self.X = X
+        self.Y = Y
+        self.Z = Z
+        self.dX = dX
+        self.dY = dY
+        self.dZ = dZ
+        self.heading = heading
+        self.distance = distance
+        self.P = P
+        self.F = F
+
+    def __len__(self):
+        return len(self.op)
+
+    def __getitem__(self, index):
+        op = self.op[index]
+        name = OPCODES[op]
+        if op in MOVES:
+            args = {"X": self.X[index], "Y": self.Y[index], "Z": self.Z[index]}
+            move = parse.Move.planned(args, self.dX[index], self.dY[index],
+                                      self.dZ[index], self.heading[index],
+                                      self.distance[index])
+            if self.turn_tolerance:
+                move.turn_tolerance = self.turn_tolerance
+            feedrate = self.F[index]
+            if feedrate == feedrate:
+                move.feedrate = feedrate
+            return move
+        elif op == DWELL:
+            return parse.Dwell({"P": self.P[index]})
+        else:
+            return parse.COMMANDS[name]({})
+
+    def __iter__(self):
+        for index in range(len(self.op)):
+            yield self[index]
+
+    @property
+    def end(self):
+        """(X, Y, Z) after the last row"""
+        if not len(self.op):
+            return (0.0, 0.0, 0.0)
+        return (self.X[-1], self.Y[-1], self.Z[-1])
+
+    def nbytes(self):
+        return sum(len(column) * column.itemsize
+                   for column in (getattr(self, name) for name in self.columns))
+
+
+def parse_tokens(tokens, builder=None):
+    """Fill a ProgramBuilder from a token list (as produced by Lexer or
+    MappedLexer). Only X/Y/Z/P/F/I/J/R are ever converted to numbers."""
+    if builder is None:
+        builder = ProgramBuilder()
+    add = builder.add
+    count = len(tokens)
+    i = 0
+    while i < count:
+        token = tokens[i]
+        if token.type not in ("G", "M"):
+            raise parse.ParseError(f"Unexpected token {str(token)}")
+        name = token.type + token.value
+        try:
+            op = OPCODE[name]
+        except KeyError:
+            raise parse.ParseError(f"Command {name} is invalid or not supported.")
+        i += 1
+        X = Y = Z = P = F = I = J = R = NAN
+        while i < count and tokens[i].type not in ("G", "M"):
+            arg = tokens[i]
+            if arg.type == "X":
+                X = arg.number
+            elif arg.type == "Y":
+                Y = arg.number
+            elif arg.type == "Z":
+                Z = arg.number
+            elif arg.type == "P":
+                P = arg.number
+            elif arg.type == "F":
+                F = arg.number
+                if not F > 0:
+                    raise parse.ParseError(f"Feedrate F{arg.value} must be positive.")
+            elif arg.type == "I":
+                I = arg.number
+            elif arg.type == "J":
+                J = arg.number
+            elif arg.type == "R":
+                R = arg.number
+            i += 1
+        add(op, X, Y, Z, P, F, I, J, R)
+    return builder
+
+
+def split_chunks(buffer, count):
+    """Split buffer into about count (start, end) ranges. Every range starts at
+    the beginning of a line that starts with a G/M word, so no command (or its
+    arguments) ever straddles two chunks."""
+    size = len(buffer)
+    bounds = [0]
+    for i in range(1, count):
+        position = max(size * i // count, bounds[-1])
+        while True:
+            newline = buffer.find(b"\n", position)
+            if newline < 0:
+                position = size
+                break
+            position = newline + 1
+            line = buffer[position:position + 80].lstrip(b" \t\r")
+            if line[:1] in (b"G", b"M"):
+                break
+        if position < size:
+            bounds.append(position)
+    bounds.append(size)
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)
+            if bounds[i] < bounds[i + 1]]
+
+
+def parse_chunk(filename, start=0, end=None):
+    """Lex & parse one chunk of filename into a ProgramBuilder. Runs in the
+    worker processes of a parallel load()."""
+    with parse.MappedLexer(filename) as lexer:
+        lexer.read(start, end)
+        return parse_tokens(lexer.tokens)
+
+
+def load(filename, workers=None):
+    """Parse a gcode file straight into a ColumnarProgram.
+
+    With workers > 1 the file is split at line boundaries & the chunks are
+    lexed/parsed in a process pool. Chunks only hold what their lines say, so
+    stitching them is just joining the builders; the modal state that crosses
+    chunk boundaries (the current position) is tracked when the joined
+    builder is resolved, exactly as for a serial parse."""
+    if workers is None or workers <= 1:
+        return parse_chunk(filename).resolve()
+
+    with parse.MappedLexer(filename) as lexer:
+        chunks = split_chunks(lexer.buffer, workers * 4)
+    if len(chunks) <= 1:
+        return parse_chunk(filename).resolve()
+
+    builder = ProgramBuilder()
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(parse_chunk, filename, start, end)
+                   for start, end in chunks]
+        for future in futures:
+            builder.extend(future.result())
+    return builder.resolve()
+
+
+if __name__ == "__main__":
+    import sys
+
+    program = load(sys.argv[1] if len(sys.argv) > 1 else "square.nc")
+    print(f"{len(program)} commands, {program.nbytes()} bytes")
+    for command in program:
+        print(command)
@@ -30,89 +30,384 @@ CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
 OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
 OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 --------------------------------------------------------------------------
-"""
 
-import Adafruit_BBIO.GPIO as GPIO
+Nothing touches the GPIO until the robot is first asked for (get_robot()), so
+modules that only parse or plan can import this freely. The pins, stepper
+sequence & dimensions come from the config file (CONFIG_FILE, or the file
+named by $PLOTBOT_CONFIG); anything it leaves out keeps the default below.
+"""
 
-import time
+import json
+import logging
 import math
+import os
+import threading
+import time
+
+import gpio
+import scheduler
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "robot_config.json")
 
 STEP_LENGTH = 1 # Empirical value that must be set once we get the actual length of a step on the robot
+WHEEL_BASE = 100 # [mm] between the wheels; the pen is halfway between them
+
+stepper_states = [
+            [1, 0, 0, 0],
+            [1, 1, 0, 0],
+            [0, 1, 0, 1],
+            [0, 1, 1, 0],
+            [0, 0, 1, 0],
+            [0, 0, 1, 1],
+            [0, 0, 0, 1],
+            [1, 0, 0, 1]
+        ]
+
+DEFAULT_CONFIG = {
+    "left_pins": ["P1_29", "P1_31", "P1_33", "P1_35"],
+    "right_pins": ["P1_30", "P1_32", "P1_34", "P1_36"],
+    "stepper_states": stepper_states,
+    "step_length": STEP_LENGTH,
+    "wheel_base": WHEEL_BASE,
+}
+
+# Positions are kept in steps, as fixed point integers with FRACTION_BITS bits
+# of fraction, so moves add up exactly
+FRACTION_BITS = 24
+ONE = 1 << FRACTION_BITS
+
+
+def calibrate(step_length=None, wheel_base=None):
+    """Set the robot's dimensions & work out the conversions between them & steps
+    (once, rather than on every move)."""
+    global STEP_LENGTH, WHEEL_BASE, STEPS_PER_MM, TURN_STEPS_PER_DEG, DEG_PER_TURN_STEP
+    if step_length is not None:
+        STEP_LENGTH = step_length
+    if wheel_base is not None:
+        WHEEL_BASE = wheel_base
+    STEPS_PER_MM = ONE / STEP_LENGTH  # fixed point steps per mm
+    TURN_STEPS_PER_DEG = math.radians(1) * WHEEL_BASE / 2 / STEP_LENGTH
+    DEG_PER_TURN_STEP = 1 / TURN_STEPS_PER_DEG
+
+
+calibrate()
+
+
+def to_steps(distance):
+    """distance [mm] in fixed point steps"""
+    return round(distance * STEPS_PER_MM)
+
+
+def turn_steps(angle):
+    """Steps each wheel makes (in opposite directions) to turn angle [deg] in
+    place"""
+    return round(abs(angle) * TURN_STEPS_PER_DEG)
+
+
+def turn_angle(steps):
+    """Angle [deg] turned by each wheel making steps steps in opposite
+    directions"""
+    return steps * DEG_PER_TURN_STEP
+
+
+class Pose:
+    """Where the robot is & which way it faces, as far as whole steps can take
+    it, along with where the program has sent it (the target). Moves drive
+    the whole steps that get closest to the target, so the fraction of a step
+    a move can't make is carried on to the next one instead of being lost, &
+    a shape that closes in the program closes on paper."""
+    def __init__(self, X=0, Y=0, orientation=0):
+        self.X = X
+        self.Y = Y
+        self.orientation = orientation
+
+    # Position [mm]; setting it sets the target too
+    @property
+    def X(self):
+        return self.x * STEP_LENGTH / ONE
+
+    @X.setter
+    def X(self, value):
+        self.x = self.target_x = to_steps(value)
+
+    @property
+    def Y(self):
+        return self.y * STEP_LENGTH / ONE
+
+    @Y.setter
+    def Y(self, value):
+        self.y = self.target_y = to_steps(value)
+
+    @property
+    def orientation(self):
+        """Right-handed orientation [deg]"""
+        return self._orientation
+
+    @orientation.setter
+    def orientation(self, value):
+        # The heading only changes on turns, so work out its unit vector
+        # (fixed point) here rather than on every move
+        self._orientation = value
+        radians = math.radians(value)
+        self._cos = round(math.cos(radians) * ONE)
+        self._sin = round(math.sin(radians) * ONE)
+        self.aim(value)
+
+    def aim(self, angle):
+        """Send later moves towards angle [deg] (the turn to it may be off by
+        a fraction of a step)"""
+        radians = math.radians(angle)
+        self._aim_x = math.cos(radians) * STEPS_PER_MM
+        self._aim_y = math.sin(radians) * STEPS_PER_MM
+
+    def turn(self, absolute_angle, tolerance=0.0):
+        """Turn, the shortest way, to face absolute_angle [deg], unless that's
+        a turn of tolerance [deg] or less (the target still follows
+        absolute_angle). Returns the steps the right wheel makes forward (the
+        left makes as many back); negative for clockwise turns."""
+        delta = (absolute_angle - self._orientation + 180) % 360 - 180
+        steps = 0 if abs(delta) <= tolerance else turn_steps(delta)
+        if delta < 0:
+            steps = -steps
+        if steps:
+            # Keep the angle actually turned (whole steps), so rounding doesn't
+            # pile up over thousands of turns
+            self.orientation = (self._orientation + turn_angle(steps)) % 360
+        self.aim(absolute_angle)
+        return steps
+
+    def advance(self, distance):
+        """Move the target distance [mm] along the aimed heading. Returns the
+        whole steps to drive (negative = backwards) to get closest to it."""
+        self.target_x += round(distance * self._aim_x)
+        self.target_y += round(distance * self._aim_y)
+        # How far the target is ahead, in steps with 2 * FRACTION_BITS of
+        # fraction, rounded to whole steps
+        ahead = (self.target_x - self.x) * self._cos + (self.target_y - self.y) * self._sin
+        steps = (ahead + (ONE * ONE >> 1)) >> 2 * FRACTION_BITS
+        self.x += steps * self._cos
+        self.y += steps * self._sin
+        return steps
+
+    def copy(self):
+        pose = Pose.__new__(Pose)
+        pose.__dict__.update(self.__dict__)
+        return pose
+
+    def state(self):
+        """Everything the pose is (fixed point position & target, orientation,
+        aim), as numbers to save; Pose.from_state() gives it back exactly"""
+        return (self.x, self.y, self.target_x, self.target_y, self._orientation,
+                self._aim_x, self._aim_y)
+
+    @classmethod
+    def from_state(cls, state):
+        x, y, target_x, target_y, orientation, aim_x, aim_y = state
+        pose = cls(orientation=orientation)
+        pose.x, pose.y, pose.target_x, pose.target_y = x, y, target_x, target_y
+        pose._aim_x, pose._aim_y = aim_x, aim_y
+        return pose
+
 
 class Stepper:
-    def __init__(self, pins, states):
-        # TODO: Figure out what type pin numbers will be/how to access
+    def __init__(self, pins, states, gpio_=None):
         self.pins = pins
         self.states = states
+        self.gpio = GPIO = gpio.backend() if gpio_ is None else gpio_
 
-        # The current stepper state; "lead pin" is the first one energized on a step
-        self.lead_pin = 0
+        # The current stepper state (index into states); "lead pin" is the
+        # first one energized on a step. Starts on the last state, so the
+        # first step forward goes to state 0.
+        self.lead_pin = len(states) - 1
 
         # Setup GPIO pins for output & set low
         for pin in self.pins:
-            print(f"GPIO setup {pin}")
+            logging.debug(f"GPIO setup {pin}")
             GPIO.setup(pin, GPIO.OUT)
             GPIO.output(pin, GPIO.LOW)
 
+        # Each state as a bitmask of its pins (bit i = pins[i]), the mask the
+        # pins are at now, & for every (from mask, to mask) pair the writes
+        # that get from one to the other, so a step only touches the pins that
+        # change. Backends that can write a whole bank at once get their own
+        # form of those writes.
+        self.width = len(pins)
+        self.masks = [sum(1 << i for i, value in enumerate(state) if value)
+                      for state in states]
+        self.mask = 0
+        self.write_banks = getattr(GPIO, "write_banks", None)
+        bank_writes = getattr(GPIO, "bank_writes", None)
+        self.transitions = []
+        for before in range(1 << self.width):
+            for after in range(1 << self.width):
+                changes = tuple((pin, GPIO.HIGH if after >> i & 1 else GPIO.LOW)
+                                for i, pin in enumerate(pins) if (before ^ after) >> i & 1)
+                self.transitions.append(bank_writes(changes) if bank_writes else changes)
+
+    def write_mask(self, mask):
+        """Set the pins to mask (bit i = pins[i]), writing only the ones that
+        change."""
+        changes = self.transitions[self.mask << self.width | mask]
+        if self.write_banks is not None:
+            self.write_banks(changes)
+        else:
+            output = self.gpio.output
+            for pin, value in changes:
+                output(pin, value)
+        self.mask = mask
+
     def write_pins(self, values):
         """Write values to pins.
         
-        If values is the wrong length, a ValueError should be thrown
-        automatically. This method makes the step() method on subclasses much
-        more concise."""
-        for i in range(len(self.pins)):
-            pin = self.pins[i]
-            print("GPIO output")
-            GPIO.output(pin, GPIO.HIGH if values[i] else GPIO.LOW)
-
-    def step(self):
-        """Perform one step."""
-        self.write_pins(self.states[self.lead_pin])
-        # Increment lead pin so the next run steps to the next state. If we've
-        # hit the end of states, go back to state 0.
-        if self.lead_pin < len(self.states) - 1:
-            self.lead_pin += 1
-        else:
-            self.lead_pin = 0
+        If values is the wrong length, a ValueError is raised."""
+        if len(values) != self.width:
+            raise ValueError(f"{len(values)} values for {self.width} pins")
+        self.write_mask(sum(1 << i for i, value in enumerate(values) if value))
+
+    def step(self, direction=1):
+        """Perform one step: forward through states (direction 1) or back
+        (direction -1), wrapping around at either end."""
+        self.lead_pin = (self.lead_pin + direction) % len(self.states)
+        self.write_mask(self.masks[self.lead_pin])
         
 
 class Robot:
     """Robot contains all of the atomic implementations of robot actions that
     compose the commands defined in main."""
     def __init__(self, left_stepper, right_stepper):
-        self.X = 0
-        self.Y = 0
+        self.pose = Pose()
         self.Z = 0
-        self.orientation = 0 # Right-handed orientation [deg]
         self.left_stepper = left_stepper
         self.right_stepper = right_stepper
+        # Times the steps of each move; None steps as fast as possible (dry
+        # runs & benchmarks)
+        self.scheduler = scheduler.Scheduler()
 
-    def reorient(self, absolute_angle):
-        pass
+    # The pose [mm & deg], for everything that doesn't need steps
+    X = property(lambda self: self.pose.X, lambda self, value: setattr(self.pose, "X", value))
+    Y = property(lambda self: self.pose.Y, lambda self, value: setattr(self.pose, "Y", value))
+    orientation = property(lambda self: self.pose.orientation,
+                           lambda self, value: setattr(self.pose, "orientation", value))
 
-    def move(self, distance):
-        step_count = math.floor(distance / STEP_LENGTH)
-        for i in range(1, step_count):
-            self.left_stepper.step()
-            self.right_stepper.step()
+    def reorient(self, absolute_angle, tolerance=0.0):
+        """Turn in place, the shortest way, to face absolute_angle [deg]
+        (unless that's within tolerance [deg] of the current heading)."""
+        # Counterclockwise (positive) turns drive the left wheel back & the
+        # right one forward
+        steps = self.pose.turn(absolute_angle, tolerance)
+        self._drive(-steps, steps)
+
+    def _drive(self, left_steps, right_steps, rate=None):
+        """Step the wheels left_steps & right_steps (negative = backwards) in
+        one interleaved pass: the wheel with more steps steps on every tick &
+        the other is spread evenly among them (Bresenham). Ticks are timed by
+        the scheduler, at up to rate [steps/s]."""
+        left_direction = 1 if left_steps >= 0 else -1
+        right_direction = 1 if right_steps >= 0 else -1
+        left_count = abs(left_steps)
+        right_count = abs(right_steps)
+        ticks = max(left_count, right_count)
+        if ticks == 0:
+            return
+        left_step = self.left_stepper.step
+        right_step = self.right_stepper.step
+
+        if left_count == right_count:
+            def tick():
+                left_step(left_direction)
+                right_step(right_direction)
+        else:
+            left_error = right_error = ticks // 2
+
+            def tick():
+                nonlocal left_error, right_error
+                left_error += left_count
+                if left_error >= ticks:
+                    left_error -= ticks
+                    left_step(left_direction)
+                right_error += right_count
+                if right_error >= ticks:
+                    right_error -= ticks
+                    right_step(right_direction)
+
+        if self.scheduler is None:
+            for i in range(ticks):
+                tick()
+        else:
+            self.scheduler.run(ticks, tick, rate)
+
+    def move(self, distance, feedrate=None):
+        """Drive distance [mm] forward (backward if negative). feedrate
+        [mm/min] (gcode F) caps the speed of this move."""
+        steps = self.pose.advance(distance)
+        rate = None if feedrate is None else feedrate / 60 / STEP_LENGTH
+        self._drive(steps, steps, rate)
+
+    def dwell(self, seconds):
+        """Wait seconds (at once on dry runs, where nothing is timed)"""
+        if self.scheduler is not None and seconds > 0:
+            time.sleep(seconds)
 
     def zmove(self, distance) -> None:
         """Move the pen (Z)"""
         pass
 
 
-stepper_states = [
-            [1, 0, 0, 0],
-            [1, 1, 0, 0],
-            [0, 1, 0, 1],
-            [0, 1, 1, 0],
-            [0, 0, 1, 0],
-            [0, 0, 1, 1],
-            [0, 0, 0, 1],
-            [1, 0, 0, 1]
-        ]
 
-# TODO: Replace with config file params?
-left_stepper = Stepper(["P1_29", "P1_31", "P1_33", "P1_35"], stepper_states)
-right_stepper = Stepper(["P1_30", "P1_32", "P1_34", "P1_36"], stepper_states)
-robot = Robot(left_stepper, right_stepper)
\ No newline at end of file
+def load_config(path=None):
+    """The robot's config: DEFAULT_CONFIG updated from the config file (path,
+    $PLOTBOT_CONFIG or CONFIG_FILE; a missing file leaves the defaults).
+
+    If the file has a setting we don't know, a ValueError is raised."""
+    if path is None:
+        path = os.environ.get("PLOTBOT_CONFIG", CONFIG_FILE)
+    config = dict(DEFAULT_CONFIG)
+    try:
+        with open(path) as f:
+            settings = json.load(f)
+    except FileNotFoundError:
+        return config
+    unknown = set(settings) - set(config)
+    if unknown:
+        raise ValueError(f"{path}: unknown settings {', '.join(sorted(unknown))}")
+    config.update(settings)
+    return config
+
+
+_robot = None
+_lock = threading.Lock()
+
+
+def get_robot(config=None):
+    """The robot, set up (pins & all) on the first call from config (see
+    load_config())"""
+    global _robot
+    if _robot is None:
+        with _lock:
+            if _robot is None:
+                _robot = build_robot(config)
+    return _robot
+
+
+def build_robot(config=None, gpio_=None):
+    """A new robot set up from config (see load_config()) on gpio_ (the GPIO
+    backend by default). get_robot() is the one that draws; this is for
+    working out what it would do, e.g. on a simulated backend."""
+    if config is None:
+        config = load_config()
+    calibrate(config["step_length"], config["wheel_base"])
+    return Robot(Stepper(config["left_pins"], config["stepper_states"], gpio_),
+                 Stepper(config["right_pins"], config["stepper_states"], gpio_))
+
+
+def is_set_up():
+    """Has get_robot() set the robot up yet?"""
+    return _robot is not None
+
+
+def current_position():
+    """The robot's (X, Y, Z), without setting it up if nothing has yet (it
+    starts at the origin)"""
+    if _robot is None:
+        return (0, 0, 0)
+    return (_robot.X, _robot.Y, _robot.Z)
@@ -0,0 +1,130 @@
+"""
+--------------------------------------------------------------------------
+scheduler.py - step timing
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Step timing. Steppers fired back to back either stall or need crude sleeps, &
+sleeps drift. The Scheduler instead gives every step of a move an absolute
+deadline on time.monotonic_ns(), from a trapezoidal speed profile: accelerate
+at ACCELERATION up to the move's top rate, cruise, then decelerate to a stop,
+so long moves reach full speed without losing steps.
+
+Waiting is hybrid: sleep until SPIN_NS before the deadline, then spin, which
+is far more precise than sleep() alone. Since deadlines are absolute, a late
+step doesn't push the rest of the move back; if the schedule falls more than
+MAX_LAG_NS behind (e.g. the process was descheduled) it slips the remaining
+deadlines instead of firing a burst of catch-up steps the motors couldn't
+follow.
+"""
+
+import math
+import time
+
+MAX_RATE = 400.0        # [steps/s]
+ACCELERATION = 800.0    # [steps/s^2]
+SPIN_NS = 200_000       # spin for the last 0.2 ms before a deadline
+MAX_LAG_NS = 5_000_000  # slip the schedule when 5 ms behind
+
+
+def profile(steps, rate=MAX_RATE, acceleration=ACCELERATION):
+    """Yield the time [ns] of each of steps steps on a trapezoidal profile from
+    & to a standstill, counted from the start of the move. Step k (from 1) is
+    made when the wheel has covered k steps, so even the first one comes
+    sqrt(2 / acceleration) in, never straight after the previous move's
+    last."""
+    if rate <= 0:
+        raise ValueError(f"step rate must be positive, not {rate}")
+    if steps <= 0:
+        return
+    # Short moves never reach rate
+    peak = min(rate, math.sqrt(acceleration * steps))
+    ramp = peak * peak / (2 * acceleration)  # [steps] to get up to (or down from) peak
+    ramp_time = peak / acceleration
+    total = steps / peak + ramp_time
+    for k in range(1, steps + 1):
+        if k <= ramp:
+            t = math.sqrt(2 * k / acceleration)
+        elif k < steps - ramp:
+            t = ramp_time + (k - ramp) / peak
+        else:
+            t = total - math.sqrt(2 * (steps - k) / acceleration)
+        yield int(t * 1e9)
+
+
+def wait_until(deadline, spin=SPIN_NS):
+    """Return at (just after) monotonic_ns() deadline."""
+    remaining = deadline - time.monotonic_ns()
+    if remaining > spin:
+        time.sleep((remaining - spin) / 1e9)
+    while time.monotonic_ns() < deadline:
+        pass
+
+
+class Scheduler:
+    """Runs the steps of a move against deadlines. Keeps count of late steps
+    (after their deadline by more than spin), the worst lateness [ns] & how many
+    times the schedule had to slip."""
+    def __init__(self, rate=MAX_RATE, acceleration=ACCELERATION, spin=SPIN_NS,
+                 max_lag=MAX_LAG_NS):
+        self.rate = rate
+        self.acceleration = acceleration
+        self.spin = spin
+        self.max_lag = max_lag
+        self.late = 0
+        self.worst = 0
+        self.slips = 0
+
+    def run(self, steps, step, rate=None):
+        """Call step() steps times on a trapezoidal profile. rate [steps/s]
+        lowers the top speed for this move (e.g. from a feedrate)."""
+        rate = self.rate if rate is None else min(rate, self.rate)
+        monotonic_ns = time.monotonic_ns
+        spin = self.spin
+        start = monotonic_ns()
+        for offset in profile(steps, rate, self.acceleration):
+            deadline = start + offset
+            now = monotonic_ns()
+            if now < deadline:
+                wait_until(deadline, spin)
+            else:
+                lateness = now - deadline
+                if lateness > spin:
+                    self.late += 1
+                    if lateness > self.worst:
+                        self.worst = lateness
+                    if lateness > self.max_lag:
+                        start += lateness
+                        self.slips += 1
+            step()
+
+    def __str__(self):
+        return (f"{self.late} late steps (worst {self.worst / 1e6:.2f} ms), "
+                f"{self.slips} schedule slips")
@@ -0,0 +1,466 @@
+"""
+--------------------------------------------------------------------------
+server.py - plot job server
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Plot job server. Runs as a daemon (plotbot.py --serve) that takes jobs over a
+local Unix socket & runs them one after another, highest priority first (then
+in the order they came). While one job is plotting, a planner thread parses
+(through the program cache), optimizes & estimates the ones queued behind it,
+so the robot goes straight from one job to the next.
+
+Requests & replies are JSON, one object per line:
+
+  {"op": "submit", "path": FILE, "priority": N, "simplify": TOLERANCE,
+   "optimize_travel": BOOL, "plan_turns": TOLERANCE}
+                                       -> {"ok": true, "job": ID}
+  {"op": "status"}                     -> {"ok": true, "jobs": [...]}
+  {"op": "status", "job": ID}          -> {"ok": true, "job": {...}}
+  {"op": "cancel", "job": ID}          -> {"ok": true} (a running job stops
+                                          after the command it's on)
+  {"op": "shutdown"}                   -> {"ok": true} (after the current job)
+
+Failures reply {"ok": false, "error": MESSAGE}. Programs are parsed from the
+origin, so the robot drives back there (pen as it is) before each job. Only
+the last KEEP_FINISHED finished jobs are remembered.
+
+The socket is only for the user running the server: it's made in a directory
+only they can get into ($XDG_RUNTIME_DIR, or /tmp/plotbot-UID) & is itself
+read/write for them alone.
+
+Usage: python server.py [--socket PATH] [--executor]   run the server
+       python server.py --submit FILE [--priority N]   queue a job
+       python server.py --status                       show the queue
+"""
+
+import errno
+import heapq
+import itertools
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import threading
+import time
+
+import cache
+import estimate
+import parse
+import planner
+import simplify
+import travel
+
+SOCKET = os.environ.get("PLOTBOT_SOCKET") or os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR") or f"/tmp/plotbot-{os.getuid()}", "plotbot.sock")
+KEEP_FINISHED = 100  # finished jobs kept for status requests
+
+# Job states
+QUEUED = "queued"        # waiting to be planned
+PLANNING = "planning"
+READY = "ready"          # planned, waiting for the robot
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class Job:
+    def __init__(self, number, path, priority=0, simplify=None, optimize_travel=False,
+                 plan_turns=None):
+        self.id = number
+        self.path = path
+        self.priority = priority
+        self.simplify = simplify
+        self.optimize_travel = optimize_travel
+        self.plan_turns = plan_turns
+        self.state = QUEUED
+        self.program = None
+        self.estimate = None  # [s]
+        self.turning_saved = None  # [deg] by planner.py
+        self.commands = 0
+        self.completed = 0
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def plan(self):
+        """Parse & optimize the program (run by the planner thread). Returns
+        it; JobQueue.planned() attaches it to the job, unless the job was
+        cancelled meanwhile."""
+        program = cache.ProgramCache().load(self.path)
+        if self.simplify is not None:
+            program, report = simplify.simplify(program, self.simplify)
+            logging.info(f"Job {self.id}: {report}")
+        if self.optimize_travel:
+            program, report = travel.optimize(program)
+            logging.info(f"Job {self.id}: {report}")
+        if self.plan_turns is not None:
+            program, report = planner.plan(program, self.plan_turns)
+            logging.info(f"Job {self.id}: {report}")
+            self.turning_saved = report.saved
+        self.estimate = estimate.estimate(program).seconds
+        self.commands = len(program)
+        return program
+
+    def status(self):
+        return {"id": self.id, "path": self.path, "priority": self.priority,
+                "state": self.state, "commands": self.commands,
+                "completed": self.completed, "estimate": self.estimate,
+                "turning_saved": self.turning_saved,
+                "error": self.error, "submitted": self.submitted,
+                "started": self.started, "finished": self.finished}
+
+    def __str__(self):
+        return f"Job {self.id} ({self.path}): {self.state}, {self.completed}/{self.commands}"
+
+
+class JobQueue:
+    """Jobs in priority order, shared by the socket handlers, the planner &
+    the runner"""
+    def __init__(self):
+        self.heap = []  # (-priority, number, job)
+        self.jobs = {}  # every job, by id
+        self.numbers = itertools.count(1)
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def submit(self, path, **options):
+        with self.condition:
+            job = Job(next(self.numbers), path, **options)
+            self.jobs[job.id] = job
+            heapq.heappush(self.heap, (-job.priority, job.id, job))
+            self.condition.notify_all()
+            return job
+
+    def cancel(self, number):
+        with self.condition:
+            job = self.jobs[number]
+            if job.state in (DONE, FAILED):
+                raise ValueError(f"job {number} is {job.state}")
+            if job.state != RUNNING:
+                # (a running job is finished when it stops)
+                job.program = None
+                job.finished = time.time()
+            job.state = CANCELLED
+            self._prune()
+            self.condition.notify_all()
+
+    def _prune(self):
+        """Forget all but the last KEEP_FINISHED finished jobs (with the
+        lock)"""
+        finished = [job for job in self.jobs.values() if job.finished is not None]
+        for job in finished[:max(len(finished) - KEEP_FINISHED, 0)]:
+            del self.jobs[job.id]
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def _first(self, states):
+        """The first job in priority order in one of states (with the lock)"""
+        # Cancelled & finished jobs are dropped as they reach the top
+        while self.heap and self.heap[0][2].state in (CANCELLED, RUNNING, DONE, FAILED):
+            heapq.heappop(self.heap)
+        for _, _, job in sorted(self.heap):
+            if job.state in states:
+                return job
+        return None
+
+    def next_to_plan(self):
+        """Wait for a job that needs planning & mark it planning; None once
+        closed."""
+        with self.condition:
+            while not self.closed:
+                job = self._first((QUEUED,))
+                if job is not None:
+                    job.state = PLANNING
+                    return job
+                self.condition.wait()
+            return None
+
+    def planned(self, job, program=None, error=None):
+        """The planner is done with job: it's ready to run program, or
+        planning failed with error. A job cancelled meanwhile stays
+        cancelled & the program is dropped."""
+        with self.condition:
+            if job.state == PLANNING:
+                if error is None:
+                    job.program = program
+                    job.state = READY
+                else:
+                    job.state = FAILED
+                    job.error = error
+                    job.finished = time.time()
+                    self._prune()
+            self.condition.notify_all()
+
+    def next_to_run(self):
+        """Wait for the first planned job & mark it running; None once closed.
+        (A job still being planned waits its turn behind planned ones.)"""
+        with self.condition:
+            while not self.closed:
+                job = self._first((READY,))
+                if job is not None:
+                    job.state = RUNNING
+                    job.started = time.time()
+                    return job
+                self.condition.wait()
+            return None
+
+    def finished(self, job, error=None):
+        with self.condition:
+            if error is not None:
+                job.state = FAILED
+                job.error = error
+            elif job.state == RUNNING:
+                job.state = DONE
+            job.finished = time.time()
+            job.program = None  # free it; the status stays
+            self._prune()
+            self.condition.notify_all()
+
+    def status(self):
+        with self.condition:
+            return [job.status() for job in self.jobs.values()]
+
+
+def plan_jobs(queue):
+    """Planner thread: plan queued jobs, highest priority first."""
+    while True:
+        job = queue.next_to_plan()
+        if job is None:
+            return
+        try:
+            program = job.plan()
+        except Exception as e:
+            logging.exception(f"Job {job.id}: planning failed")
+            queue.planned(job, error=f"{type(e).__name__}: {e}")
+        else:
+            queue.planned(job, program)
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                reply = self.server.respond(json.loads(line))
+            except Exception as e:
+                reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+
+def _remove_stale_socket(path):
+    """Remove the socket at path if it was left by a server that didn't shut
+    down cleanly. If a server still answers on it (or it isn't a socket), an
+    OSError is raised instead."""
+    if not stat.S_ISSOCK(os.stat(path).st_mode):
+        raise OSError(errno.EEXIST, "not a socket", path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.remove(path)
+            return
+    raise OSError(errno.EADDRINUSE, "a plot server is already running", path)
+
+
+def _socket_directory(path):
+    """Make the socket's directory, only for us, if it doesn't exist. One that
+    does must be ours (or the system's, like /tmp): anyone else could
+    swap the socket for their own."""
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    status = os.lstat(path)
+    if not stat.S_ISDIR(status.st_mode) or status.st_uid not in (os.getuid(), 0):
+        raise PermissionError(errno.EACCES, "the socket's directory isn't ours", path)
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Takes requests on the socket & runs the queued jobs on the robot.
+    executor=True drives the steppers from a separate process (see
+    executor.py), so the planner can't disturb step timing."""
+    daemon_threads = True
+
+    def __init__(self, path=SOCKET, executor=False):
+        _socket_directory(os.path.dirname(os.path.abspath(path)))
+        if os.path.exists(path):
+            _remove_stale_socket(path)
+        super().__init__(path, Handler)
+        self.path = path
+        self.executor = executor
+        self.queue = JobQueue()
+
+    def server_bind(self):
+        # Made read/write for the owner only (with no window where it's
+        # anything else)
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+        os.chmod(self.server_address, 0o600)
+
+    def respond(self, request):
+        op = request.get("op")
+        if op == "submit":
+            job = self.queue.submit(
+                os.path.abspath(request["path"]), priority=request.get("priority", 0),
+                simplify=request.get("simplify"),
+                optimize_travel=request.get("optimize_travel", False),
+                plan_turns=request.get("plan_turns"))
+            return {"ok": True, "job": job.id}
+        if op == "status":
+            if "job" in request:
+                return {"ok": True, "job": self.queue.jobs[request["job"]].status()}
+            return {"ok": True, "jobs": self.queue.status()}
+        if op == "cancel":
+            self.queue.cancel(request["job"])
+            return {"ok": True}
+        if op == "shutdown":
+            self.queue.close()
+            return {"ok": True}
+        raise ValueError(f"unknown op {op!r}")
+
+    def run(self):
+        """Serve & run jobs until shut down."""
+        threading.Thread(target=self.serve_forever, name="server", daemon=True).start()
+        threading.Thread(target=plan_jobs, args=(self.queue,), name="planner",
+                         daemon=True).start()
+        print(f"Plot server listening on {self.path}")
+        try:
+            while True:
+                job = self.queue.next_to_run()
+                if job is None:
+                    break
+                print(f"{job.path}: starting job {job.id}")
+                try:
+                    self.run_job(job)
+                except Exception as e:
+                    logging.exception(f"Job {job.id}: failed")
+                    self.queue.finished(job, f"{type(e).__name__}: {e}")
+                else:
+                    self.queue.finished(job)
+                print(job)
+        finally:
+            self.shutdown()
+            self.server_close()
+            os.remove(self.path)
+
+    def run_job(self, job):
+        from robot import get_robot
+
+        robot = get_robot()
+        program = job.program
+        if (robot.X, robot.Y) != (0, 0):
+            # Back to where the program was parsed from
+            program = itertools.chain(
+                [parse.Move({"X": 0, "Y": 0}, origin=(robot.X, robot.Y, robot.Z))], program)
+            job.completed = -1  # (the move back isn't part of the job)
+        if self.executor:
+            self._run_executor(robot, job, program)
+            return
+        for command in program:
+            if job.state == CANCELLED:
+                break
+            command.execute()
+            job.completed += 1
+
+    def _run_executor(self, robot, job, program):
+        import compiler
+        import executor
+
+        plan = compiler.Plan(robot.left_stepper.lead_pin, robot.right_stepper.lead_pin,
+                             robot.pose)
+        with executor.Executor(robot, timed=robot.scheduler is not None) as step_executor:
+            for command in program:
+                if job.state == CANCELLED:
+                    break
+                plan.add(command)
+                step_executor.feed(plan)
+                job.completed += 1
+            plan.finish()
+            step_executor.feed(plan)
+        plan.apply(robot)
+        logging.info(f"Job {job.id}: executor {step_executor}")
+
+
+def request(message, path=SOCKET):
+    """Send message (a dict) to the server at path. Returns its reply."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        connection.sendall(json.dumps(message).encode() + b"\n")
+        with connection.makefile("rb") as replies:
+            return json.loads(replies.readline())
+
+
+def format_status(jobs):
+    lines = []
+    for job in jobs:
+        line = f"{job['id']:4d}  {job['state']:9s} p{job['priority']:<3d} " \
+               f"{job['completed']}/{job['commands']}  {job['path']}"
+        if job["error"]:
+            line += f"  ({job['error']})"
+        lines.append(line)
+    return "\n".join(lines) or "No jobs."
+
+
+if __name__ == "__main__":
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Plot job server & client.")
+    arg_parser.add_argument("--socket", default=SOCKET)
+    arg_parser.add_argument("--executor", action="store_true",
+                            help="drive the steppers from a separate process")
+    arg_parser.add_argument("--submit", metavar="FILE", help="queue FILE on the server")
+    arg_parser.add_argument("--priority", type=int, default=0)
+    arg_parser.add_argument("--status", action="store_true", help="show the server's jobs")
+    arg_parser.add_argument("--cancel", type=int, metavar="ID")
+    arg_parser.add_argument("--shutdown", action="store_true",
+                            help="stop the server once the current job is done")
+    args = arg_parser.parse_args()
+
+    if args.submit:
+        print(request({"op": "submit", "path": os.path.abspath(args.submit),
+                       "priority": args.priority}, args.socket))
+    elif args.status:
+        print(format_status(request({"op": "status"}, args.socket)["jobs"]))
+    elif args.cancel is not None:
+        print(request({"op": "cancel", "job": args.cancel}, args.socket))
+    elif args.shutdown:
+        print(request({"op": "shutdown"}, args.socket))
+    else:
+        Server(args.socket, executor=args.executor).run()
@@ -0,0 +1,195 @@
+"""
+--------------------------------------------------------------------------
+simplify.py - path simplification pass
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Path simplification. CAM tools like to emit curves as thousands of tiny,
+nearly collinear G01 moves, and every Move costs the robot a stop & a
+reorient. This pass works on a ColumnarProgram and:
+
+  - drops moves that don't go anywhere (zero length, Z unchanged)
+  - collapses runs of Z-only moves that stay on the same side of the paper
+  - simplifies polylines (runs of XY moves with the same opcode & Z) with
+    Douglas-Peucker. With a tolerance of 0 this only merges moves that are
+    exactly collinear; a larger tolerance also removes points that are at most
+    that far [mm] from the simplified path.
+"""
+
+import math
+
+import program
+
+# Points closer than this [mm] to a segment count as on it, so float noise in
+# the file doesn't stop exact merges
+EPSILON = 1e-9
+
+
+def segment_distance(point, a, b):
+    """Distance from point to the segment a-b (not the infinite line, so a
+    path that doubles back on itself is never 'simplified' away)."""
+    dx = b[0] - a[0]
+    dy = b[1] - a[1]
+    length2 = dx * dx + dy * dy
+    if length2 == 0:
+        return math.hypot(point[0] - a[0], point[1] - a[1])
+    t = ((point[0] - a[0]) * dx + (point[1] - a[1]) * dy) / length2
+    t = min(1.0, max(0.0, t))
+    return math.hypot(point[0] - (a[0] + t * dx), point[1] - (a[1] + t * dy))
+
+
+def douglas_peucker(points, tolerance):
+    """Indices of the points to keep & the largest distance of a dropped point
+    from the simplified path."""
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    deviation = 0.0
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        farthest = None
+        farthest_distance = -1.0
+        for i in range(first + 1, last):
+            d = segment_distance(points[i], points[first], points[last])
+            if d > farthest_distance:
+                farthest, farthest_distance = i, d
+        if farthest is None:
+            continue
+        if farthest_distance > tolerance + EPSILON:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+        else:
+            deviation = max(deviation, farthest_distance)
+    return [i for i in range(len(points)) if keep[i]], deviation
+
+
+def count_turns(prog):
+    """Number of moves that need the robot to reorient first"""
+    turns = 0
+    heading = 0.0
+    for i in range(len(prog)):
+        if prog.distance[i]:
+            if abs((prog.heading[i] - heading + 180.0) % 360.0 - 180.0) > EPSILON:
+                turns += 1
+            heading = prog.heading[i]
+    return turns
+
+
+class SimplifyReport:
+    def __init__(self, before, after, deviation):
+        self.commands_before = len(before)
+        self.commands_after = len(after)
+        self.turns_before = count_turns(before)
+        self.turns_after = count_turns(after)
+        self.deviation = deviation
+
+    def __str__(self):
+        return (f"Commands {self.commands_before} -> {self.commands_after}, "
+                f"reorientations {self.turns_before} -> {self.turns_after}, "
+                f"max deviation {self.deviation:.4f} mm")
+
+
+def _same_feedrate(a, b):
+    return a == b or (a != a and b != b)  # (NaN: no feedrate set)
+
+
+def simplify(prog, tolerance=0.0, pen_z=0.0):
+    """Simplify a ColumnarProgram. Returns (new program, SimplifyReport)."""
+    builder = program.ProgramBuilder()
+    deviation = 0.0
+
+    run = []           # rows of the current polyline
+    run_start = None   # (X, Y) the polyline starts from
+    pending_z = None   # a Z-only move that might be superseded by the next one
+
+    def flush_run():
+        nonlocal deviation, run, run_start
+        if run:
+            points = [run_start] + [(row[1], row[2]) for row in run]
+            kept, run_deviation = douglas_peucker(points, tolerance)
+            deviation = max(deviation, run_deviation)
+            for i in kept[1:]:
+                builder.add(*run[i - 1])
+        run = []
+        run_start = None
+
+    def flush_z():
+        nonlocal pending_z
+        if pending_z is not None:
+            builder.add(*pending_z)
+            pending_z = None
+
+    x, y, z = 0.0, 0.0, 0.0
+    for i in range(len(prog)):
+        op = prog.op[i]
+        row = (op, prog.X[i], prog.Y[i], prog.Z[i], prog.P[i], prog.F[i])
+        moves_xy = prog.distance[i] != 0
+        moves_z = prog.dZ[i] != 0
+
+        if op not in program.MOVES:
+            flush_run()
+            flush_z()
+            builder.add(*row)
+        elif not moves_xy and not moves_z:
+            pass  # goes nowhere
+        elif not moves_xy:
+            flush_run()
+            # A Z move that stays on the same side of the paper as a pending
+            # one makes the pending one pointless
+            if pending_z is not None and (pending_z[3] < pen_z) != (row[3] < pen_z):
+                flush_z()
+            pending_z = row
+        elif moves_z:
+            flush_run()
+            flush_z()
+            builder.add(*row)
+        else:
+            flush_z()
+            if run and (run[0][0] != op or run[0][3] != row[3]
+                        or not _same_feedrate(run[0][5], row[5])):
+                flush_run()
+            if not run:
+                run_start = (x, y)
+            run.append(row)
+        x, y, z = row[1], row[2], row[3]
+    flush_run()
+    flush_z()
+
+    simplified = builder.resolve()
+    return simplified, SimplifyReport(prog, simplified, deviation)
+
+
+if __name__ == "__main__":
+    import sys
+
+    prog = program.load(sys.argv[1] if len(sys.argv) > 1 else "square.nc")
+    tolerance = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    print(simplify(prog, tolerance)[1])
@@ -0,0 +1,209 @@
+"""
+--------------------------------------------------------------------------
+steptrace.py - step timing traces
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Step timing traces, for seeing how evenly the steps of a move are spaced (and
+how much Python, GC & logging get in the way).
+
+While installed, every Stepper.write_mask call records a monotonic nanosecond
+timestamp, the pin mask written & which stepper it was into a preallocated
+ring buffer, so tracing doesn't allocate anything per step. plotbot also drops
+a marker at the start of every command. When the ring is full the oldest
+records are overwritten.
+
+dump() writes the records, oldest first, as a small header followed by
+fixed-size little-endian records, so a trace can be memory-mapped & read
+without parsing. Run this file to analyze one:
+
+    python steptrace.py TRACE_FILE [--top N]
+
+which reports the inter-step interval distribution of each stepper & the worst
+stalls, along with the command each happened in.
+"""
+
+import argparse
+import mmap
+import struct
+import time
+
+# time [ns], value (pin mask, or command number for a marker), source (stepper
+# id, or MARKER)
+RECORD = struct.Struct("<QII")
+HEADER = struct.Struct("<4sIQQ")  # magic, record size, record count, dropped
+MAGIC = b"PBT1"
+MARKER = 0xFFFFFFFF
+
+CAPACITY = 1 << 20  # records (16 MB)
+
+
+class Tracer:
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * RECORD.size)
+        self.count = 0  # records written in total, including overwritten ones
+        self.steppers = {}  # id(stepper) -> stepper number
+        self._original = None
+
+    def record(self, value, source):
+        RECORD.pack_into(self.buffer, (self.count % self.capacity) * RECORD.size,
+                         time.monotonic_ns(), value, source)
+        self.count += 1
+
+    def mark(self, command):
+        """Note that command number command starts now."""
+        self.record(command, MARKER)
+
+    def install(self):
+        """Start tracing every Stepper.write_mask call."""
+        import robot
+
+        if self._original is not None:
+            return
+        original = self._original = robot.Stepper.write_mask
+        steppers = self.steppers
+        record = self.record
+
+        def write_mask(self, mask):
+            source = steppers.get(id(self))
+            if source is None:
+                source = steppers.setdefault(id(self), len(steppers))
+            record(mask, source)
+            original(self, mask)
+        robot.Stepper.write_mask = write_mask
+
+    def uninstall(self):
+        import robot
+
+        if self._original is not None:
+            robot.Stepper.write_mask = self._original
+            self._original = None
+
+    def dump(self, path):
+        """Write the records (oldest first) to path."""
+        kept = min(self.count, self.capacity)
+        view = memoryview(self.buffer)
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, RECORD.size, kept, self.count - kept))
+            if self.count <= self.capacity:
+                f.write(view[:kept * RECORD.size])
+            else:
+                split = (self.count % self.capacity) * RECORD.size
+                f.write(view[split:])
+                f.write(view[:split])
+
+
+def load(path):
+    """(records, dropped) of a dumped trace; records are (time, value, source)
+    tuples read straight from the mapped file."""
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+            magic, size, count, dropped = HEADER.unpack_from(mapping)
+            if magic != MAGIC or size != RECORD.size:
+                raise ValueError(f"{path} is not a step trace")
+            end = HEADER.size + count * RECORD.size
+            records = list(RECORD.iter_unpack(mapping[HEADER.size:end]))
+    return records, dropped
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def analyze(records, top=10):
+    """Interval statistics per stepper & the top worst stalls. A stall is the
+    gap between two steps of a stepper; it's attributed to the command running
+    at the time, & flagged if a command boundary falls inside it."""
+    command = None
+    last = {}  # stepper -> (time, command) of its last step
+    intervals = {}
+    stalls = []
+    boundaries = 0
+    for t, value, source in records:
+        if source == MARKER:
+            command = value
+            boundaries += 1
+            continue
+        if source in last:
+            previous, previous_command = last[source]
+            gap = t - previous
+            intervals.setdefault(source, []).append(gap)
+            stalls.append((gap, source, previous_command, command))
+        last[source] = (t, command)
+
+    report = {"commands": boundaries, "steppers": {}}
+    for source, gaps in sorted(intervals.items()):
+        ordered = sorted(gaps)
+        mean = sum(ordered) / len(ordered)
+        variance = sum((gap - mean) ** 2 for gap in ordered) / len(ordered)
+        report["steppers"][source] = {
+            "steps": len(ordered) + 1,
+            "mean_us": mean / 1e3,
+            "stdev_us": variance ** 0.5 / 1e3,
+            "min_us": ordered[0] / 1e3,
+            "p50_us": percentile(ordered, 0.5) / 1e3,
+            "p90_us": percentile(ordered, 0.9) / 1e3,
+            "p99_us": percentile(ordered, 0.99) / 1e3,
+            "max_us": ordered[-1] / 1e3,
+        }
+    stalls.sort(key=lambda stall: stall[0], reverse=True)
+    report["stalls"] = [{"gap_us": gap / 1e3, "stepper": source, "command": after,
+                         "at_command_boundary": before != after}
+                        for gap, source, before, after in stalls[:top]]
+    return report
+
+
+def format_report(report, dropped=0):
+    lines = []
+    if dropped:
+        lines.append(f"({dropped} oldest records were overwritten)")
+    lines.append(f"{report['commands']} commands")
+    for source, stats in report["steppers"].items():
+        lines.append(f"Stepper {source}: {stats['steps']} steps, interval "
+                     f"mean {stats['mean_us']:.1f} us, stdev {stats['stdev_us']:.1f}, "
+                     f"p50 {stats['p50_us']:.1f}, p90 {stats['p90_us']:.1f}, "
+                     f"p99 {stats['p99_us']:.1f}, max {stats['max_us']:.1f}")
+    lines.append("Worst stalls:")
+    for stall in report["stalls"]:
+        where = " (command boundary)" if stall["at_command_boundary"] else ""
+        lines.append(f"  {stall['gap_us']:10.1f} us  stepper {stall['stepper']}  "
+                     f"command {stall['command']}{where}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Analyze a step timing trace.")
+    arg_parser.add_argument("trace_file")
+    arg_parser.add_argument("--top", type=int, default=10,
+                            help="how many of the worst stalls to list")
+    args = arg_parser.parse_args()
+    records, dropped = load(args.trace_file)
+    print(format_report(analyze(records, args.top), dropped))
@@ -0,0 +1,95 @@
+"""
+--------------------------------------------------------------------------
+test_arc.py - checks of arc linearization
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Checks of arc (G02/G03) linearization.
+"""
+
+import math
+
+import pytest
+
+import arc
+import parse
+import program
+
+
+def within_tolerance(points, start, center, radius, tolerance):
+    """Every chord's middle is within tolerance of the arc"""
+    for a, b in zip([start] + points, points):
+        middle = ((a[0] + b[0]) / 2, (a[1] + b[1]) / 2)
+        if radius - math.hypot(middle[0] - center[0], middle[1] - center[1]) > tolerance + 1e-9:
+            return False
+    return True
+
+
+@pytest.mark.parametrize("clockwise", [True, False])
+def test_quarter_circle(clockwise):
+    start, end = (10.0, 0.0), (0.0, 10.0)
+    if clockwise:
+        start, end = end, start
+    points = arc.arc_points(start, end, clockwise, I=-start[0], J=-start[1], tolerance=0.01)
+    assert points[-1] == end
+    assert within_tolerance(points, start, (0, 0), 10, 0.01)
+    # The fewest chords that stay within tolerance
+    assert len(points) == math.ceil(math.pi / 2 / arc.chord_angle(10.0, 0.01))
+    # Going the asked-for way round: every point in the first quadrant
+    assert all(x >= -1e-9 and y >= -1e-9 for x, y in points)
+
+
+def test_full_circle():
+    points = arc.arc_points((5.0, 0.0), (5.0, 0.0), False, I=-5, J=0, tolerance=0.01)
+    assert points[-1] == (5.0, 0.0)
+    assert min(y for _, y in points) < -4.9 and max(y for _, y in points) > 4.9
+
+
+@pytest.mark.parametrize("R, center", [(10, (10, 0)), (-10, (0, 10))])
+def test_radius_format(R, center):
+    # The short way round for R > 0, the long way for R < 0
+    start, end = (0.0, 0.0), (10.0, 10.0)
+    assert arc.center_from_radius(start, end, R, True) == pytest.approx(center)
+    with pytest.raises(ValueError):
+        arc.arc_points(start, start, True, R=10)
+
+
+def test_bad_arc_is_a_parse_error(gcode):
+    with pytest.raises(parse.ParseError):
+        # R arcs need somewhere to go
+        program.load(gcode(["G02 X0 Y0 R5"]))
+
+
+def test_chord_angle_is_cached():
+    arc.chord_angle.cache_clear()
+    for _ in range(100):
+        arc.arc_points((3.0, 0.0), (-3.0, 0.0), True, I=-3, J=0)
+    info = arc.chord_angle.cache_info()
+    assert (info.misses, info.hits) == (1, 99)
@@ -0,0 +1,128 @@
+"""
+--------------------------------------------------------------------------
+test_cache.py - checks of the program cache
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Checks of the compiled-program cache.
+"""
+
+import os
+
+import cache
+import checkpoint
+import program
+from conftest import columns
+
+
+def test_cached_program_matches_parse(job, tmp_path):
+    serial = columns(program.load(job))
+    programs = cache.ProgramCache(str(tmp_path / "cache"))
+    assert columns(programs.load(job)) == serial  # parsed & saved
+    assert len(programs.entries()) == 1
+    assert columns(programs.load(job)) == serial  # from the cache
+
+
+def test_hit_skips_the_parser(job, tmp_path, monkeypatch):
+    programs = cache.ProgramCache(str(tmp_path / "cache"))
+    programs.load(job)
+
+    def parse(*args, **kwargs):
+        raise AssertionError("parsed a cached program")
+    monkeypatch.setattr(program, "load", parse)
+    assert len(programs.load(job)) > 0
+
+
+def test_edited_file_is_parsed_again(job, tmp_path):
+    programs = cache.ProgramCache(str(tmp_path / "cache"))
+    programs.load(job)
+    with open(job, "a") as f:
+        f.write("G01 X1.000 Y2.000\n")
+    assert columns(programs.load(job)) == columns(program.load(job))
+    assert len(programs.entries()) == 2
+
+
+def test_stale_entry_is_replaced(job, tmp_path):
+    programs = cache.ProgramCache(str(tmp_path / "cache"))
+    programs.load(job)
+    path = programs.path(programs.key(job))
+    with open(path, "r+b") as f:
+        f.write(b"JUNK")
+    assert columns(programs.load(job)) == columns(program.load(job))
+    with open(path, "rb") as f:
+        assert f.read(4) == cache.MAGIC
+
+
+def test_least_recently_used_is_evicted(gcode, tmp_path):
+    first = gcode(["G01 X1 Y1"] * 100, "first.nc")
+    second = gcode(["G01 X2 Y2"] * 100, "second.nc")
+    programs = cache.ProgramCache(str(tmp_path / "cache"))
+    programs.load(first)
+    size = programs.entries()[0][1]
+    programs.max_bytes = size
+    old = programs.path(programs.key(first))
+    os.utime(old, (0, 0))
+    programs.load(second)
+    assert [path for _, _, path in programs.entries()] == [programs.path(programs.key(second))]
+
+
+def test_unfinished_jobs_checkpoints_are_kept(job, gcode, tmp_path):
+    directory = str(tmp_path / "cache")
+    saved = checkpoint.Checkpoint(job, directory)
+    for number in range(3):
+        saved.index.note(number, number * 10)
+    saved.save(2, {}, (0, 0, 0))
+
+    # A program bigger than the whole cache evicts everything else...
+    programs = cache.ProgramCache(directory, max_bytes=1)
+    programs.load(gcode(["G01 X1 Y1"] * 1000, "big.nc"))
+    programs.clear()
+    # ...but not the checkpoint or its index
+    assert checkpoint.Checkpoint(job, directory).load()["command"] == 2
+
+    # Once the job's done, its index can go
+    saved.clear()
+    assert [os.path.basename(path) for _, _, path in programs.entries()] == \
+        [os.path.basename(saved.index.path)]
+    programs.evict()
+    assert os.listdir(directory) == []
+
+
+def test_entries_skips_files_removed_while_listing(job, tmp_path, monkeypatch):
+    programs = cache.ProgramCache(str(tmp_path / "cache"))
+    programs.load(job)
+    stat = os.stat
+
+    def removed(path, *args, **kwargs):
+        if path.endswith(cache.SUFFIX):
+            raise FileNotFoundError(path)
+        return stat(path, *args, **kwargs)
+    monkeypatch.setattr(os, "stat", removed)
+    assert programs.entries() == []
@@ -0,0 +1,115 @@
+"""
+--------------------------------------------------------------------------
+test_checkpoint.py - checks of resumable jobs
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Checks of resumable jobs.
+"""
+
+import checkpoint
+import gpio
+import parse
+import robot
+
+
+def test_resume_carries_on_exactly(gcode, tmp_path):
+    lines = [f"G01 X{1.3 * k:.3f} Y{0.7 * k:.3f} F600" for k in range(1, 8)]
+    job = gcode(lines)
+    directory = str(tmp_path / "cache")
+    bot = robot.build_robot(gpio_=gpio.SimGPIO(record=False))
+    bot.Z = -1
+    saved = checkpoint.Checkpoint(job, directory, interval=1)
+    for number, command in enumerate(parse.stream(job)):
+        saved.index.note(number, command.offset)
+        if number == 4:
+            # Interrupted during command 4: commands 0-3 are done
+            saved.save(number, pose, position)
+            break
+        bot.reorient(command.absolute_angle)
+        bot.pose.advance(command.distance)
+        pose = checkpoint.pose(bot)
+        position = command.target
+    done = bot.pose.state()
+
+    state = checkpoint.Checkpoint(job, directory).load()
+    assert state["command"] == 4
+    resumed = robot.build_robot(gpio_=gpio.SimGPIO(record=False))
+    checkpoint.restore(state, resumed)
+    assert resumed.pose.state() == done
+    assert resumed.Z == -1
+
+    # The interrupted command is the first one run again
+    commands = list(parse.stream(job, start=state["offset"],
+                                 position=tuple(state["position"])))
+    assert len(commands) == 3
+    assert commands[0].target[:2] == (6.5, 3.5)
+    # Starting from where command 3 left the pen
+    assert commands[0].dX == 6.5 - 5.2
+
+
+def test_index_is_appended_as_commands_run(tmp_path):
+    path = str(tmp_path / "job.idx")
+    index = checkpoint.CommandIndex(path)
+    for number, offset in enumerate((0, 7, 15)):
+        index.note(number, offset)
+    index.note(1, 999)  # already known
+    index.flush()
+    index.note(3, 30)
+    index.flush()
+    assert list(checkpoint.CommandIndex(path).offsets) == [0, 7, 15, 30]
+
+    # A torn write (not a whole offset) starts the index over
+    with open(path, "ab") as f:
+        f.write(b"\x01\x02")
+    assert len(checkpoint.CommandIndex(path)) == 0
+
+
+def test_nothing_to_resume(job, tmp_path):
+    directory = str(tmp_path / "cache")
+    saved = checkpoint.Checkpoint(job, directory, interval=10)
+    assert saved.load() is None
+    assert saved.due(0)
+    saved.index.note(0, 0)
+    saved.save(0, {}, (0, 0, 0))
+    assert not saved.due(9) and saved.due(10)
+    # Past the end of the index: can't seek there
+    saved.save(5, {}, (0, 0, 0))
+    assert saved.load() is None
+    saved.save(0, {}, (0, 0, 0))
+    assert saved.load()["offset"] == 0
+    saved.clear()
+    assert saved.load() is None
+
+    # An edited file doesn't resume from the old checkpoint
+    saved.save(0, {}, (0, 0, 0))
+    with open(job, "a") as f:
+        f.write("G01 X1\n")
+    assert checkpoint.Checkpoint(job, directory).load() is None
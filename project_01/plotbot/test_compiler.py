@@ -0,0 +1,145 @@
+"""
+--------------------------------------------------------------------------
+test_compiler.py - checks of step plans
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Checks of compiling programs to step plans & running them.
+"""
+
+import pytest
+
+import compiler
+import gpio
+import program
+import robot
+import scheduler
+
+
+def new_plan(pose=None):
+    return compiler.Plan(0, 0, robot.Pose() if pose is None else pose)
+
+
+def test_first_event_waits_for_the_first_step():
+    plan = new_plan()
+    plan.drive(10, 10)
+    assert plan.delays[0] == next(scheduler.profile(10))
+    assert all(plan.delays)
+
+
+def test_dwell_goes_before_the_next_step():
+    plan = new_plan()
+    plan.wait(1000)
+    plan.drive(1, 1)
+    assert list(plan.delays) == [1000 + next(scheduler.profile(1))]
+
+
+def test_slow_feedrate_is_split_into_idle_events():
+    # F10 at 1 mm a step is 6 s a step, longer than one event can wait
+    plan = new_plan()
+    plan.move(3, feedrate=10)
+    assert max(plan.delays) <= compiler.MAX_DELAY
+    # Idle events keep the pins as they were: only the 3 steps change them
+    left, right = plan.start_phases
+    masks = [plan.combined[left][right]] + list(plan.masks)
+    assert len(plan.masks) > 3
+    assert sum(a != b for a, b in zip(masks, masks[1:])) == 3
+    assert sum(plan.delays) == pytest.approx(3 / (10 / 60) * 1e9, rel=0.01)
+
+
+def test_run_restores_the_exact_pose(tmp_path):
+    bot = robot.build_robot(gpio_=gpio.SimGPIO(record=False))
+    plan = compiler.Plan(bot.left_stepper.lead_pin, bot.right_stepper.lead_pin, bot.pose)
+    # Moves that leave the position off the target by a fraction of a step
+    # & the heading aimed away from the orientation
+    for angle, distance in ((10, 3.3), (47.5, 2.71), (200, 0.4)):
+        plan.reorient(angle, tolerance=1.0)
+        plan.move(distance)
+    path = str(tmp_path / "job.plan")
+    plan.write(path)
+
+    compiler.run(path, bot, timed=False)
+    assert bot.pose.state() == plan.pose.state()
+    assert (bot.left_stepper.lead_pin, bot.right_stepper.lead_pin) == \
+        (plan.left_phase, plan.right_phase)
+
+    # Not from where it was compiled
+    bot = robot.build_robot(gpio_=gpio.SimGPIO(record=False))
+    bot.pose.advance(0.4)
+    with pytest.raises(ValueError):
+        compiler.run(path, bot, timed=False)
+
+
+def test_compile_leaves_gpio_alone(monkeypatch, gcode):
+    monkeypatch.setattr(robot, "_robot", None)
+    monkeypatch.setattr(gpio, "_backend", None)
+    plan = compiler.compile_program(program.load(gcode(["G01 X5 Y5 F600"])))
+    assert plan.masks
+    assert not robot.is_set_up()
+    assert gpio._backend is None
+
+
+def test_plan_matches_live_run(sim, job, tmp_path):
+    prog = program.load(job)
+    bot = robot.get_robot()
+    bot.scheduler = None
+    steppers = (bot.left_stepper, bot.right_stepper)
+    # Energize the steppers' current phases, so both runs start from the same
+    # pin levels
+    for stepper in steppers:
+        stepper.write_mask(stepper.masks[stepper.lead_pin])
+    phases = [stepper.lead_pin for stepper in steppers]
+    start = bot.pose.copy()
+
+    plan = compiler.Plan(*phases, start, bot.left_stepper.states, bot.left_stepper.width)
+    for command in prog:
+        plan.add(command)
+    path = str(tmp_path / "job.plan")
+    plan.write(path)
+
+    sim.clear_log()
+    for command in prog:
+        command.execute()
+    live = (sim.log_pins.tobytes(), sim.log_values.tobytes())
+    live_pose = bot.pose.copy()
+
+    # Back to the start & run the plan instead
+    for stepper, phase in zip(steppers, phases):
+        stepper.lead_pin = phase
+        stepper.write_mask(stepper.masks[phase])
+    bot.pose = start
+    sim.clear_log()
+    compiler.run(path, bot, timed=False)
+    planned = (sim.log_pins.tobytes(), sim.log_values.tobytes())
+
+    assert sim.writes > 0
+    assert planned == live
+    assert [stepper.lead_pin for stepper in steppers] == [plan.left_phase, plan.right_phase]
+    assert bot.pose.state() == live_pose.state()
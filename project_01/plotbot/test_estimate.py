@@ -0,0 +1,113 @@
+"""
+--------------------------------------------------------------------------
+test_estimate.py - checks of the job duration estimates
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Checks of the job duration estimates.
+"""
+
+import json
+import math
+
+import pytest
+
+import estimate
+import parse
+import program
+import robot
+
+
+@pytest.fixture
+def model():
+    return estimate.Model(step_length=robot.STEP_LENGTH, wheel_base=robot.WHEEL_BASE)
+
+
+def test_model_defaults_to_the_config(tmp_path, monkeypatch):
+    path = tmp_path / "robot_config.json"
+    path.write_text(json.dumps({"step_length": 0.05, "wheel_base": 120}))
+    monkeypatch.setenv("PLOTBOT_CONFIG", str(path))
+    model = estimate.Model()
+    assert (model.step_length, model.wheel_base) == (0.05, 120)
+    assert estimate.Model(wheel_base=90).wheel_base == 90
+    # A full turn in place drives each wheel round the wheel base's circle
+    assert model.turn_steps_per_degree * 360 == pytest.approx(math.pi * 120 / 0.05)
+
+
+def test_profile_time(model):
+    v, a = model.step_rate, model.acceleration
+    # Triangle profile below v*v/a steps, trapezoid above, meeting at it
+    assert model.profile_time(v * v / a / 4) == pytest.approx(v / a)
+    assert model.profile_time(v * v / a) == pytest.approx(2 * v / a)
+    assert model.profile_time(v * v / a * (1 - 1e-9)) == pytest.approx(2 * v / a)
+    assert model.profile_time(10 * v * v / a) == pytest.approx(11 * v / a)
+    assert model.total_time([5, 5, 7]) == pytest.approx(
+        2 * model.profile_time(5) + model.profile_time(7))
+
+
+def test_single_move(gcode, model):
+    prog = program.load(gcode(["G90", "G01 X100 Y0"]))
+    report = estimate.estimate(prog, model)
+    assert report.drive_steps == round(100 / model.step_length)
+    assert (report.turn_steps, report.turns, report.pen_moves) == (0, 0, 0)
+    assert report.seconds == pytest.approx(model.profile_time(report.drive_steps))
+
+
+def test_counts_match_a_run(gcode, model):
+    lines = ["G90"]
+    for corner in range(5):
+        x, y = 40.0 * corner, 10.0 * (corner % 2)
+        lines += ["G00 Z2.000", f"G00 X{x} Y{y}", "G01 Z-1.000",
+                  f"G01 X{x + 10.3} Y{y}", f"G01 X{x + 10.3} Y{y + 7.7}",
+                  f"G01 X{x} Y{y + 7.7}", f"G01 X{x} Y{y}"]
+    lines += ["G04 P0.5", "G00 Z2.000"]
+    prog = program.load(gcode(lines))
+    report = estimate.estimate(prog, model)
+
+    # What the robot would do: turn to each move's heading, then drive it
+    pose = robot.Pose()
+    drive_steps = turns = 0
+    turned = 0.0
+    for command in prog:
+        if isinstance(command, parse.Move) and command.distance:
+            before = pose.orientation
+            if pose.turn(command.absolute_angle):
+                turns += 1
+                turned += abs(math.remainder(pose.orientation - before, 360))
+            drive_steps += abs(pose.advance(command.distance))
+    # The estimate carries fractions of steps along the path rather than in X
+    # & Y, so it can be a step out where the path turns
+    assert abs(report.drive_steps - drive_steps) <= turns
+    assert report.turns == turns
+    assert report.turned == pytest.approx(turned, abs=1)
+    # The first Z move raises a pen that's at Z0, not on the paper
+    assert (report.pen_moves, report.pen_lifts, report.dwell) == (11, 5, 0.5)
+    assert report.seconds > 11 * model.pen_time + 0.5
+    assert "5 pen lifts" in str(report)
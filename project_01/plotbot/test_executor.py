@@ -0,0 +1,130 @@
+"""
+--------------------------------------------------------------------------
+test_executor.py - checks of the step executor process
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Checks of the step executor process & its shared-memory ring.
+"""
+
+from array import array
+import os
+
+import compiler
+import executor
+import gpio
+import program
+import robot
+
+
+class RecordingStepper:
+    """Stands in for a Stepper, appending every mask written to a file (which
+    the executor process shares with us)"""
+    width = 4
+
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+
+    def write_mask(self, mask):
+        os.write(self.fd, bytes((mask,)))
+
+
+class RecordingRobot:
+    def __init__(self, directory):
+        self.left_stepper = RecordingStepper(str(directory / "left"))
+        self.right_stepper = RecordingStepper(str(directory / "right"))
+
+
+def test_ring_wraps_around():
+    ring = executor.Ring(8)
+    try:
+        assert ring.push(array("I", [1] * 6), bytes(range(6))) == 6
+        assert ring.push(array("I", [2] * 6), bytes(range(6, 12))) == 2  # full
+        ring.header[executor.TAIL] = 5  # as if the executor took 5
+        assert ring.free() == 5
+        assert ring.push(array("I", range(10, 16)), bytes(range(20, 26))) == 5
+        assert bytes(ring.masks) == bytes((20, 21, 22, 23, 24, 5, 6, 7))
+        assert list(ring.delays) == [10, 11, 12, 13, 14, 1, 2, 2]
+        assert ring.free() == 0
+    finally:
+        ring.close()
+
+
+def test_executes_every_event_in_order(tmp_path, job):
+    plan = compiler.Plan(0, 0, robot.Pose())
+    for command in program.load(job):
+        plan.add(command)
+    plan.finish()
+    masks = bytes(plan.masks)
+    assert len(masks) > 64
+
+    bot = RecordingRobot(tmp_path)
+    # A ring much smaller than the plan, so the planner waits & the executor
+    # wraps around many times
+    with executor.Executor(bot, timed=False, capacity=64) as step_executor:
+        step_executor.feed(plan)
+    assert not plan.masks
+    assert step_executor.stats["overruns"] == 1
+
+    low = (1 << RecordingStepper.width) - 1
+    assert (tmp_path / "left").read_bytes() == bytes(mask & low for mask in masks)
+    assert (tmp_path / "right").read_bytes() == bytes(mask >> 4 for mask in masks)
+
+
+def test_drives_the_pins_like_a_run(tmp_path, gcode):
+    path = gcode(["G90", "G01 X10 Y3 F600", "G01 X-2 Y7", "G04 P0.001", "G00 X0 Y0"])
+    # Bank registers in a file are shared with the executor process, so we
+    # can see the levels it leaves the pins at
+    banks = gpio.BankGPIO(str(tmp_path / "mem"))
+    sim = gpio.SimGPIO(record=False)
+    try:
+        bots = [robot.build_robot(gpio_=backend) for backend in (banks, sim)]
+        plans = []
+        for bot in bots:
+            bot.scheduler = None
+            plan = compiler.Plan(bot.left_stepper.lead_pin, bot.right_stepper.lead_pin,
+                                 bot.pose)
+            for command in program.load(path):
+                plan.add(command)
+            plan.finish()
+            plans.append(plan)
+        plans[1].write(str(tmp_path / "job.plan"))
+
+        with executor.Executor(bots[0], timed=False) as step_executor:
+            step_executor.feed(plans[0])
+        plans[0].apply(bots[0])
+        compiler.run(str(tmp_path / "job.plan"), bots[1], timed=False)
+
+        pins = bots[0].left_stepper.pins + bots[0].right_stepper.pins
+        assert [banks.level(pin) for pin in pins] == [sim.level(pin) for pin in pins]
+        assert any(banks.level(pin) for pin in pins)
+        assert bots[0].pose.state() == bots[1].pose.state()
+    finally:
+        banks.cleanup()
@@ -0,0 +1,82 @@
+"""
+--------------------------------------------------------------------------
+test_gcodegen.py - checks of the benchmark gcode
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Checks of the benchmarks' synthetic gcode (../bench).
+"""
+
+import os
+import sys
+
+import pytest
+
+import parse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bench"))
+
+import gcodegen
+import run
+
+
+@pytest.mark.parametrize("shape", gcodegen.SHAPES)
+def test_shapes_parse(gcode, shape):
+    lines = gcodegen.generate(shape, 400)
+    commands = parse.parse(gcode(lines))
+    assert any(isinstance(command, parse.Move) for command in commands)
+    if shape == "arcs":
+        assert any(line.startswith(("G02", "G03")) for line in lines)
+    if shape == "comments":
+        assert all("(line " in line for line in lines[10:-4])
+
+
+@pytest.mark.parametrize("shape", gcodegen.SHAPES)
+def test_shapes_are_reproducible(shape):
+    assert gcodegen.generate(shape, 300) == gcodegen.generate(shape, 300)
+    assert gcodegen.generate(shape, 300) != gcodegen.generate(shape, 300, seed=7)
+
+
+def test_write_matches_generate(tmp_path):
+    path = str(tmp_path / "dense.nc")
+    gcodegen.write(path, "dense", 250, seed=5)
+    with open(path) as f:
+        assert f.read().splitlines() == gcodegen.generate("dense", 250, seed=5)
+
+
+def test_compare_flags_slowdowns():
+    old = {"parse": {"arcs": {"bytes": 10, "parse.parse": 1.0, "program.load": 1.0}},
+           "steps": {"steps_per_second": 1000}}
+    new = {"parse": {"arcs": {"bytes": 99, "parse.parse": 1.05, "program.load": 1.5},
+                     "dense": {"parse.parse": 9.0}},
+           "steps": {"steps_per_second": 800}}
+    assert run.compare(old, new, 0.10) == ["arcs program.load: 1.0000 s -> 1.5000 s",
+                                            "step loop: 1000 -> 800 steps/s"]
+    assert run.compare(old, new, 0.60) == []
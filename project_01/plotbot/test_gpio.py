@@ -0,0 +1,144 @@
+"""
+--------------------------------------------------------------------------
+test_gpio.py - checks of the GPIO backends
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Checks of the GPIO backends.
+"""
+
+import importlib.util
+
+import pytest
+
+import gpio
+import robot
+
+
+@pytest.fixture
+def unpicked(monkeypatch):
+    """No backend picked yet (restored afterwards)"""
+    monkeypatch.setattr(gpio, "_backend", None)
+    monkeypatch.delenv("PLOTBOT_GPIO", raising=False)
+
+
+@pytest.mark.skipif(importlib.util.find_spec("Adafruit_BBIO") is not None,
+                    reason="Adafruit_BBIO is installed")
+def test_no_silent_fallback_to_sim(unpicked):
+    with pytest.raises(ImportError, match="PLOTBOT_GPIO=sim"):
+        gpio.backend()
+    assert gpio._backend is None
+
+
+def test_sim_when_asked(unpicked, monkeypatch):
+    monkeypatch.setenv("PLOTBOT_GPIO", "sim")
+    monkeypatch.setenv("PLOTBOT_GPIO_LOG", "0")
+    backend = gpio.backend()
+    assert isinstance(backend, gpio.SimGPIO)
+    assert not backend.record
+    assert gpio.backend() is backend
+
+
+def test_unknown_backend(unpicked, monkeypatch):
+    monkeypatch.setenv("PLOTBOT_GPIO", "bogus")
+    with pytest.raises(ValueError):
+        gpio.backend()
+
+
+def test_sim_logs_writes():
+    sim = gpio.SimGPIO()
+    sim.setup("P1_30", sim.OUT)
+    sim.setup("P1_32", sim.OUT, initial=gpio.HIGH)
+    for value in (1, 0, 1):
+        sim.output("P1_30", value)
+    sim.output("P1_32", 0)
+    assert sim.writes_to("P1_30") == [1, 0, 1]
+    assert (sim.level("P1_30"), sim.level("P1_32")) == (1, 0)
+    assert sim.writes == 4
+    with pytest.raises(RuntimeError):
+        sim.output("P2_2", 1)
+
+    counting = gpio.SimGPIO(record=False)
+    counting.setup("P1_30", counting.OUT)
+    counting.output("P1_30", 1)
+    assert counting.writes == 1 and len(counting.log_pins) == 0
+
+
+def test_sim_inputs():
+    sim = gpio.SimGPIO()
+    sim.setup("P2_2", sim.IN, pull_up_down=sim.PUD_UP)
+    assert sim.input("P2_2") == gpio.HIGH
+    edges = []
+    sim.add_event_detect("P2_2", sim.FALLING, edges.append)
+    sim.set_input("P2_2", gpio.LOW)
+    sim.set_input("P2_2", gpio.HIGH)
+    sim.set_input("P2_2", gpio.LOW)
+    assert edges == ["P2_2", "P2_2"]
+
+    sim.script_input("P2_2", [(0, gpio.HIGH), (3600, gpio.LOW)])
+    assert sim.input("P2_2") == gpio.HIGH
+
+
+@pytest.fixture
+def banks(tmp_path):
+    """BankGPIO on a file standing in for the bank registers"""
+    backend = gpio.BankGPIO(str(tmp_path / "mem"))
+    yield backend
+    backend.cleanup()
+
+
+def test_bank_writes_group_by_bank(banks):
+    writes = banks.bank_writes((("P1_29", 1), ("P1_30", 0), ("P1_36", 0), ("P1_33", 1)))
+    assert writes == ((1, 0, 1 << 11), (3, 1 << 21 | 1 << 15, 1 << 14))
+    assert banks.bank_writes(()) == ()
+    with pytest.raises(ValueError):
+        banks.bank_writes((("P9_99", 1),))
+
+
+def test_bank_outputs(banks):
+    for pin in ("P1_29", "P1_33", "P1_36"):
+        banks.setup(pin, banks.OUT, initial=gpio.HIGH)
+    banks.write_banks(banks.bank_writes((("P1_33", 0), ("P1_36", 0))))
+    assert [banks.level(pin) for pin in ("P1_29", "P1_33", "P1_36")] == [1, 0, 0]
+    banks.output("P1_36", gpio.HIGH)
+    assert banks.input("P1_36") == gpio.HIGH
+    # Output enable is active low
+    banks.setup("P1_36", banks.IN)
+    with open(banks.path, "rb") as f:
+        f.seek(3 * gpio.BANK_SIZE + gpio.OE)
+        enable, = gpio.REGISTER.unpack(f.read(gpio.REGISTER.size))
+    assert enable == 1 << 14
+
+
+def test_stepper_on_banks(banks):
+    stepper = robot.Stepper(["P1_29", "P1_30", "P1_31", "P1_32"], robot.stepper_states, banks)
+    for direction in (1,) * 10 + (-1,) * 13:
+        stepper.step(direction)
+        assert [banks.level(pin) for pin in stepper.pins] == stepper.states[stepper.lead_pin]
@@ -0,0 +1,111 @@
+"""
+--------------------------------------------------------------------------
+test_incremental.py - checks of incremental parsing
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Checks of incremental re-parsing.
+"""
+
+import os
+import pickle
+
+import pytest
+
+import incremental
+import program
+from conftest import columns
+
+
+def edit_middle(path, line="G01 X1.000 Y2.000"):
+    """Replace a pen-down move in the middle of the file with line"""
+    with open(path) as f:
+        lines = f.read().split("\n")
+    middle = len(lines) // 2
+    while not lines[middle].startswith("G01 X"):
+        middle += 1
+    lines[middle] = line
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+
+
+def test_matches_serial(job, tmp_path):
+    chunks = str(tmp_path / "incremental")
+    serial = columns(program.load(job))
+    assert columns(incremental.load(job, chunks)) == serial
+    assert columns(incremental.load(job, chunks)) == serial
+
+
+def test_edit_only_reparses_its_chunk(job, tmp_path):
+    chunks = str(tmp_path / "incremental")
+    incremental.load(job, chunks)
+    edit_middle(job)
+    edited = columns(program.load(job))
+
+    parser = incremental.IncrementalParser(job, chunks)
+    assert columns(parser.parse()) == edited
+    assert parser.stats["chunks"] > 1
+    assert parser.stats["reparsed"] == 1
+
+
+def test_chunks_cover_the_file(job):
+    with open(job, "rb") as f:
+        buffer = f.read()
+    chunks = incremental.split(buffer)
+    assert len(chunks) > 1
+    assert chunks[0][0] == 0 and chunks[-1][1] == len(buffer)
+    assert all(end == start for (_, end), (start, _) in zip(chunks, chunks[1:]))
+
+
+@pytest.mark.parametrize("state", [
+    b"garbage",
+    # A pickle of a class that no longer exists (AttributeError on load)
+    b"cprogram\nGone\n.",
+    # Saved by an older version
+    pickle.dumps((0, {}, {})),
+])
+def test_unusable_state_is_rebuilt(job, tmp_path, state):
+    chunks = str(tmp_path / "incremental")
+    path = incremental.IncrementalParser(job, chunks).path
+    os.makedirs(chunks)
+    with open(path, "wb") as f:
+        f.write(state)
+    parser = incremental.IncrementalParser(job, chunks)
+    assert columns(parser.parse()) == columns(program.load(job))
+    assert parser.stats["reparsed"] == parser.stats["chunks"]
+
+
+def test_chunks_dont_depend_on_the_block_size(job, monkeypatch):
+    with open(job, "rb") as f:
+        buffer = f.read()
+    chunks = incremental.split(buffer)
+    for block in (1, 100, 4096):
+        monkeypatch.setattr(incremental, "BLOCK", block)
+        assert incremental.split(buffer) == chunks
@@ -0,0 +1,123 @@
+"""
+--------------------------------------------------------------------------
+test_metrics.py - checks of the pipeline's metrics
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Checks of the pipeline's metrics.
+"""
+
+import json
+import logging
+import sys
+import threading
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def fast_switching():
+    """Switch threads as often as possible, so unlocked updates collide"""
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def test_concurrent_writes(fast_switching):
+    registry = metrics.Metrics()
+    writers = 4
+    per_writer = 5000
+    errors = []
+    done = threading.Event()
+
+    def write(writer):
+        for i in range(per_writer):
+            # New names as we go, so the dicts keep growing under snapshot()
+            registry.time(f"timer.{writer}.{i % 500}", i)
+            registry.count(f"counter.{i % 700}")
+            registry.count("total")
+            registry.gauge(f"gauge.{writer}.{i % 300}", i)
+
+    def read():
+        while not done.is_set():
+            try:
+                registry.snapshot()
+            except Exception as error:
+                errors.append(error)
+                return
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    threads = [threading.Thread(target=write, args=(writer,)) for writer in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    done.set()
+    reader.join()
+
+    assert errors == []
+    snapshot = registry.snapshot()
+    assert snapshot["counters"]["total"] == writers * per_writer
+    assert sum(timer["count"] for timer in snapshot["timers"].values()) == writers * per_writer
+    assert sum(snapshot["counters"][f"counter.{i}"] for i in range(700)) == writers * per_writer
+
+
+def test_periodic_dump_survives_errors(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(metrics, "registry", metrics.Metrics())
+    metrics.registry.count("steps", 3)
+    directory = tmp_path / "later"
+    path = str(directory / "metrics.json")
+    dumped = threading.Event()
+    dump = metrics.registry.dump
+
+    def dump_and_note(path):
+        dump(path)
+        dumped.set()
+    monkeypatch.setattr(metrics.registry, "dump", dump_and_note)
+
+    with caplog.at_level(logging.ERROR):
+        stop = metrics.start_periodic_dump(path, interval=0.01)
+        try:
+            # Fails until the directory exists, then carries on
+            for _ in range(500):
+                if caplog.records:
+                    break
+                threading.Event().wait(0.01)
+            directory.mkdir()
+            assert dumped.wait(5)
+        finally:
+            stop.set()
+    assert "Could not dump metrics" in caplog.records[0].getMessage()
+    with open(path) as f:
+        assert json.load(f)["counters"] == {"steps": 3}
@@ -0,0 +1,153 @@
+"""
+--------------------------------------------------------------------------
+test_parse.py - lexer & parser tests
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Tests for the gcode lexers & parser (parse.py)
+"""
+
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import parse
+
+
+@pytest.mark.parametrize("feedrate", ["0", "-100"])
+def test_non_positive_feedrate_is_rejected(gcode, feedrate):
+    path = gcode(["G90", f"G01 X10 Y0 F{feedrate}"])
+    with pytest.raises(parse.ParseError):
+        parse.parse(path)
+
+
+def test_feedrate_is_modal(gcode):
+    path = gcode(["G90", "G01 X10 Y0 F600", "G01 X10 Y10", "G00 X0 Y0 F1200"])
+    moves = [command for command in parse.parse(path) if isinstance(command, parse.Move)]
+    assert [move.feedrate for move in moves] == [600.0, 600.0, 1200.0]
+
+
+def tokens(path, mapped=True):
+    if mapped:
+        with parse.MappedLexer(path) as lexer:
+            lexer.read()
+            return [(token.type, token.value) for token in lexer.tokens]
+    with open(path) as f:
+        lexer = parse.Lexer(parse.Peekable(f.read()))
+    lexer.read()
+    return [(token.type, token.value) for token in lexer.tokens]
+
+
+def test_mapped_lexer_matches_lexer(job):
+    assert tokens(job) == tokens(job, mapped=False)
+
+
+def test_mapped_lexer_skips_comments(gcode):
+    path = gcode(["G01 X1.5 (move (sort of)", "  Y-2 ( last", "G04 P0.1"])
+    assert tokens(path) == [("G", "01"), ("X", "1.5"), ("Y", "-2")]
+    with parse.MappedLexer(path) as lexer:
+        lexer.read()
+        assert [token.number for token in lexer.tokens[1:]] == [1.5, -2.0]
+
+
+def test_mapped_lexer_ranges(gcode):
+    path = gcode(["G00 X1", "G01 Y2"])
+    with parse.MappedLexer(path) as lexer:
+        second = lexer.buffer.find(b"G01")
+        assert [(t.type, t.value) for t in lexer.iter_tokens(second)] == [("G", "01"), ("Y", "2")]
+        assert [(t.type, t.value) for t in lexer.iter_tokens(0, second)] == [("G", "00"), ("X", "1")]
+
+
+def test_mapped_lexer_bad_character(gcode):
+    with pytest.raises(parse.ParseError):
+        tokens(gcode(["G01 X1 #"]))
+
+
+def test_mapped_lexer_empty_file(tmp_path):
+    path = tmp_path / "empty.nc"
+    path.write_bytes(b"")
+    assert tokens(str(path)) == []
+
+
+def describe(commands):
+    return [(type(command).__name__, getattr(command, "target", None)) for command in commands]
+
+
+def test_stream_matches_parse(job):
+    with parse.MappedLexer(job) as lexer:
+        lexer.read()
+        parsed = parse.Parser(lexer.tokens, (0, 0, 0)).parse()
+    assert describe(parse.stream(job, position=(0, 0, 0))) == describe(parsed)
+
+
+def test_stream_error_comes_in_order(gcode):
+    path = gcode(["G01 X1", "G01 X2", "G99"])
+    commands = parse.stream(path, position=(0, 0, 0))
+    assert next(commands).target[0] == 1
+    assert next(commands).target[0] == 2
+    with pytest.raises(parse.ParseError):
+        next(commands)
+
+
+def test_stream_stays_ahead_by_at_most_maxsize(gcode, monkeypatch):
+    parsed = []
+    parse_token = parse.Parser.parse_token
+    monkeypatch.setattr(parse.Parser, "parse_token",
+                        lambda self: parsed.append(1) or parse_token(self))
+    path = gcode([f"G01 X{k}" for k in range(1000)])
+    commands = parse.stream(path, maxsize=8, position=(0, 0, 0))
+    next(commands)
+    # Give the producer time to fill the queue
+    for _ in range(100):
+        if len(parsed) >= 10:
+            break
+        threading.Event().wait(0.01)
+    threading.Event().wait(0.05)
+    assert len(parsed) <= 1 + 8 + 1  # taken, queued & one waiting to go in
+    commands.close()
+
+
+def test_parsing_leaves_gpio_alone(job):
+    # In a fresh interpreter with no backend picked, so touching the pins
+    # would either set them up or fail for want of Adafruit_BBIO
+    code = ("import sys, gpio, parse, program, robot, estimate\n"
+            "commands = parse.parse(sys.argv[1])\n"
+            "estimate.estimate(program.load(sys.argv[1]))\n"
+            "assert robot.current_position() == (0, 0, 0)\n"
+            "assert len(commands) and gpio._backend is None and not robot.is_set_up()\n")
+    environment = {name: value for name, value in os.environ.items()
+                   if not name.startswith("PLOTBOT_GPIO")}
+    result = subprocess.run([sys.executable, "-c", code, job], env=environment,
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
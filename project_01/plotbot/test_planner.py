@@ -0,0 +1,131 @@
+"""
+--------------------------------------------------------------------------
+test_planner.py - checks of the heading planner
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Checks of the look-ahead heading planner.
+"""
+
+import itertools
+import math
+import random
+
+import pytest
+
+import parse
+import planner
+import program
+import robot
+
+
+def moves(prog):
+    """The XY moves of prog"""
+    return [command for command in prog
+            if isinstance(command, parse.Move) and command.distance]
+
+
+def replay(prog):
+    """Where a robot following prog ends up after each move, & the steps it
+    turns in all"""
+    pose = robot.Pose()
+    ends = []
+    turned = 0
+    for move in moves(prog):
+        turned += abs(pose.turn(move.absolute_angle, move.turn_tolerance))
+        pose.advance(move.distance)
+        ends.append((pose.X, pose.Y))
+    return ends, turned
+
+
+def test_zigzag_drives_back_instead_of_turning(gcode):
+    prog = program.load(gcode(["G90", "G01 X10 Y0", "G01 X0 Y0", "G01 X10 Y0",
+                               "G01 X0 Y0", "G01 X0 Y5"]))
+    planned, report = planner.plan(prog)
+    assert (report.turns_before, report.turns_after) == (4, 1)
+    assert report.turned_after == pytest.approx(90)
+    assert report.reversed_moves == 2
+    assert [move.distance for move in moves(planned)] == [10, -10, 10, -10, 5]
+
+    ends, turned = replay(planned)
+    before, turned_before = replay(prog)
+    # Same places, with much less turning
+    assert len(ends) == len(before)
+    for (x0, y0), (x1, y1) in zip(before, ends):
+        assert math.hypot(x1 - x0, y1 - y0) <= robot.STEP_LENGTH
+    assert turned < turned_before / 4
+
+
+def test_no_reverse(gcode):
+    prog = program.load(gcode(["G90", "G01 X10 Y0", "G01 X0 Y0"]))
+    planned, report = planner.plan(prog, reverse=False)
+    assert report.reversed_moves == 0 and report.saved == 0
+    assert all(move.distance > 0 for move in moves(planned))
+
+
+def test_least_turning(gcode):
+    rng = random.Random(24)
+    lines = [f"G01 X{rng.uniform(-50, 50):.3f} Y{rng.uniform(-50, 50):.3f}"
+             for _ in range(9)]
+    prog = program.load(gcode(lines))
+    _, report = planner.plan(prog)
+
+    # Every way of driving the moves forwards or backwards
+    headings = [heading for heading, distance in zip(prog.heading, prog.distance) if distance]
+    least = min(
+        sum(map(planner.turn, [0.0] + facings[:-1], facings))
+        for facings in (
+            [heading + 180.0 * backwards for heading, backwards in zip(headings, choice)]
+            for choice in itertools.product((0, 1), repeat=len(headings))))
+    assert report.turned_after == pytest.approx(least)
+    assert report.turned_after <= report.turned_before
+
+
+def test_tolerance_skips_small_turns(gcode):
+    # A wobbly line, each segment a couple of degrees off the last
+    lines = ["G90"]
+    x = y = 0.0
+    for k in range(20):
+        angle = math.radians(2.0 if k % 2 else -2.0)
+        x += 5 * math.cos(angle)
+        y += 5 * math.sin(angle)
+        lines.append(f"G01 X{x:.4f} Y{y:.4f}")
+    prog = program.load(gcode(lines))
+    planned, report = planner.plan(prog, tolerance=5.0)
+    assert report.turns_before == 20 and report.turns_after == 0
+    assert planned.turn_tolerance == 5.0
+
+    ends, turned = replay(planned)
+    before, _ = replay(prog)
+    assert turned == 0
+    # Off the line by no more than the skipped turns allow, & never further
+    # from where it should be as the errors don't pile up
+    for (x0, y0), (x1, y1) in zip(before, ends):
+        assert math.hypot(x1 - x0, y1 - y0) <= 5 * math.sin(math.radians(5)) + robot.STEP_LENGTH
@@ -0,0 +1,102 @@
+"""
+--------------------------------------------------------------------------
+test_program.py - checks of columnar programs
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Checks of parsing gcode into columnar programs.
+"""
+
+import pytest
+
+import cache
+import incremental
+import parse
+import planner
+import program
+import simplify
+from conftest import columns
+
+
+def test_parallel_parse_matches_serial(job):
+    serial = columns(program.load(job))
+    assert columns(program.load(job, workers=3)) == serial
+
+
+def test_chunks_start_at_commands():
+    buffer = b"G90\nG01 X1\n  Y2\nG01 X3 (comment)\n\nM02\nG01 X4\n"
+    for count in range(1, 8):
+        chunks = program.split_chunks(buffer, count)
+        assert chunks[0][0] == 0 and chunks[-1][1] == len(buffer)
+        assert all(end == start for (_, end), (start, _) in zip(chunks, chunks[1:]))
+        for start, _ in chunks[1:]:
+            assert buffer[start:start + 1] in (b"G", b"M")
+
+
+FEEDRATES = ["G90", "G00 X1 Y1", "G01 X2 Y2 F600", "G00 Z2", "G01 X3 Y0",
+             "G04 P0.1", "G01 X4 Y4 F1200", "G02 X6 Y4 I1 J0", "G00 X0 Y0 F3000"]
+
+
+def feedrates(prog):
+    return [command.feedrate for command in prog if isinstance(command, parse.Move)]
+
+
+def test_feedrate_is_kept(gcode, tmp_path):
+    job = gcode(FEEDRATES)
+    # As a plain parse has them
+    expected = [command.feedrate for command in parse.parse(job)
+                if isinstance(command, (parse.Move, parse.ControlledArcMove))]
+    assert expected == [None, 600, 600, 600, 1200, 1200, 3000]
+    # The arc is linearized into chords, each at the arc's feedrate
+    prog = program.load(job)
+    chords = len(feedrates(prog)) - len(expected) + 1
+    assert chords > 1
+    expected[5:6] = [1200] * chords
+    assert feedrates(prog) == expected
+    assert feedrates(cache.ProgramCache(str(tmp_path / "cache")).load(job)) == expected
+    assert feedrates(incremental.load(job, str(tmp_path / "incremental"))) == expected
+
+
+def test_passes_keep_the_feedrate(gcode):
+    job = gcode(["G01 X1 Y0 F300", "G01 X2 Y0", "G01 X3 Y0 F900", "G01 X4 Y0",
+                 "G00 Z2", "G00 X10 Y10", "G01 Z-1 F100", "G01 X11 Y10 F200", "G00 Z2"])
+    prog = program.load(job)
+    simplified, _ = simplify.simplify(prog)
+    # Collinear, but the change of feedrate is kept
+    assert [(m.distance, m.feedrate) for m in simplified if m.distance and m.dZ == 0][:2] == \
+        [(2, 300), (2, 900)]
+    planned, _ = planner.plan(prog, 0.0)
+    assert feedrates(planned) == feedrates(prog)
+
+
+def test_feedrate_must_be_positive(gcode):
+    for feedrate in ("0", "-100"):
+        with pytest.raises(parse.ParseError):
+            program.load(gcode([f"G01 X1 F{feedrate}"]))
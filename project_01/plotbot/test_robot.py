@@ -0,0 +1,144 @@
+"""
+--------------------------------------------------------------------------
+test_robot.py - checks of the robot's kinematics
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Checks of the robot's kinematics.
+"""
+
+import math
+
+import pytest
+
+import robot
+
+
+@pytest.mark.parametrize("sides, side", [(4, 10.3), (3, 7.77), (7, 12.345), (360, 0.4)])
+def test_pose_closes_shapes(sides, side):
+    # Sides that aren't whole steps, down to sides shorter than a step
+    radius = side / (2 * math.sin(math.pi / sides))
+    corners = [(radius * math.cos(2 * math.pi * k / sides),
+                radius * math.sin(2 * math.pi * k / sides)) for k in range(sides + 1)]
+    pose = robot.Pose(*corners[0])
+    for _ in range(20):
+        for (x0, y0), (x1, y1) in zip(corners, corners[1:]):
+            pose.turn(math.degrees(math.atan2(y1 - y0, x1 - x0)))
+            pose.advance(math.hypot(x1 - x0, y1 - y0))
+            # Always within a step of the corner, so a lap ends within a
+            # step of where it started & errors never pile up
+            assert math.hypot(pose.X - x1, pose.Y - y1) < robot.STEP_LENGTH
+
+
+def test_partial_steps_carry_over():
+    pose = robot.Pose()
+    # Ten moves of 0.3 steps make 3 whole steps, not 0 (or 10)
+    steps = sum(pose.advance(0.3 * robot.STEP_LENGTH) for _ in range(10))
+    assert steps == 3
+
+
+def test_state_round_trips():
+    pose = robot.Pose(1.25, -3.5)
+    pose.turn(33.3, tolerance=0.5)
+    pose.advance(2.71)
+    pose.aim(120)
+    copy = robot.Pose.from_state(pose.state())
+    assert copy.state() == pose.state()
+    assert copy.advance(5) == pose.advance(5)
+
+
+def test_stepper_writes_only_changes(sim):
+    stepper = robot.Stepper(["P1_29", "P1_31", "P1_33", "P1_35"], robot.stepper_states)
+    sim.clear_log()
+    expected = 0
+    previous = [0] * 4
+    for direction in (1,) * 12 + (-1,) * 20:
+        stepper.step(direction)
+        state = stepper.states[stepper.lead_pin]
+        expected += sum(a != b for a, b in zip(previous, state))
+        previous = state
+        assert [sim.level(pin) for pin in stepper.pins] == state
+    assert sim.writes == expected
+    # Writing the pins as they are writes nothing
+    stepper.write_pins(previous)
+    assert sim.writes == expected
+    with pytest.raises(ValueError):
+        stepper.write_pins([1, 0])
+
+
+@pytest.fixture
+def bot(sim):
+    bot = robot.build_robot()
+    bot.scheduler = None
+    return bot
+
+
+def record_steps(bot):
+    """Have bot's steppers note their steps (wheel, direction) in the returned list"""
+    steps = []
+    for wheel, stepper in (("left", bot.left_stepper), ("right", bot.right_stepper)):
+        step = stepper.step
+        stepper.step = lambda direction=1, wheel=wheel, step=step: (
+            steps.append((wheel, direction)), step(direction))
+    return steps
+
+
+@pytest.mark.parametrize("angle, direction", [(90, 1), (-45, -1), (180, -1), (0.7, 1)])
+def test_reorient_turns_both_wheels_together(bot, angle, direction):
+    steps = record_steps(bot)
+    bot.reorient(angle)
+    # Counterclockwise is the left wheel back & the right one forward, a step
+    # of each per tick
+    assert steps == [("left", -direction), ("right", direction)] * robot.turn_steps(angle)
+    assert math.remainder(bot.orientation - angle, 360) == pytest.approx(
+        0, abs=robot.turn_angle(1))
+
+
+def test_reorient_within_tolerance_stays_put(bot):
+    steps = record_steps(bot)
+    bot.reorient(3, tolerance=5)
+    assert steps == [] and bot.orientation == 0
+
+
+def test_drive_spreads_the_slower_wheel(bot):
+    steps = record_steps(bot)
+    bot._drive(10, -4)
+    assert [wheel for wheel, _ in steps].count("right") == 4
+    assert {direction for wheel, direction in steps if wheel == "right"} == {-1}
+    # Every tick steps the left wheel; the right one's steps are evenly spread
+    ticks = []
+    for wheel, _ in steps:
+        if wheel == "left":
+            ticks.append(0)
+        else:
+            ticks[-1] += 1
+    assert len(ticks) == 10 and max(ticks) == 1
+    gaps = [i for i, tick in enumerate(ticks) if tick]
+    assert max(b - a for a, b in zip(gaps, gaps[1:])) <= 3
@@ -0,0 +1,76 @@
+"""
+--------------------------------------------------------------------------
+test_scheduler.py - step timing tests
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Tests for the step timing profile & Scheduler (scheduler.py)
+"""
+
+import math
+import time
+
+import pytest
+
+import estimate
+import scheduler
+
+FIRST_STEP_NS = int(math.sqrt(2 / scheduler.ACCELERATION) * 1e9)
+
+
+@pytest.mark.parametrize("steps", [1, 2, 3, 10, 79, 80, 81, 1000])
+def test_profile(steps):
+    times = list(scheduler.profile(steps))
+    assert len(times) == steps
+    # Never straight away: the wheel has to get going first
+    assert times[0] >= min(FIRST_STEP_NS, times[-1])
+    assert all(b > a for a, b in zip(times, times[1:]))
+    # Never faster than the top rate (give or take rounding to whole ns)
+    assert min(b - a for a, b in zip([0] + times, times)) >= 1e9 / scheduler.MAX_RATE - 1
+    # Takes as long as the estimator thinks
+    assert times[-1] / 1e9 == pytest.approx(estimate.Model().profile_time(steps))
+
+
+def test_profile_first_step_after_the_ramp_up():
+    assert next(scheduler.profile(100)) == FIRST_STEP_NS
+
+
+def test_profile_rejects_non_positive_rates():
+    for rate in (0, -1):
+        with pytest.raises(ValueError):
+            list(scheduler.profile(10, rate))
+
+
+def test_run_doesnt_step_at_the_start():
+    steps = []
+    start = time.monotonic_ns()
+    scheduler.Scheduler().run(3, lambda: steps.append(time.monotonic_ns()))
+    assert len(steps) == 3
+    assert steps[0] - start >= FIRST_STEP_NS
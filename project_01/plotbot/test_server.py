@@ -0,0 +1,124 @@
+"""
+--------------------------------------------------------------------------
+test_server.py - checks of the plot job server
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Checks of the plot job server.
+"""
+
+import errno
+import os
+import socket
+import stat
+import threading
+import time
+
+import pytest
+
+import robot
+import server
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    # (in a directory that doesn't exist yet)
+    return str(tmp_path / "run" / "plotbot.sock")
+
+
+def test_socket_is_private(socket_path):
+    plot_server = server.Server(socket_path)
+    try:
+        assert stat.S_IMODE(os.stat(os.path.dirname(socket_path)).st_mode) == 0o700
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+    finally:
+        plot_server.server_close()
+
+
+def test_stale_socket_is_replaced(socket_path):
+    os.mkdir(os.path.dirname(socket_path), 0o700)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+        stale.bind(socket_path)  # (left behind; nothing listening)
+    plot_server = server.Server(socket_path)
+    try:
+        # But not one a server is answering on
+        with pytest.raises(OSError) as error:
+            server.Server(socket_path)
+        assert error.value.errno == errno.EADDRINUSE
+    finally:
+        plot_server.server_close()
+
+
+def test_finished_jobs_are_pruned(monkeypatch):
+    monkeypatch.setattr(server, "KEEP_FINISHED", 3)
+    queue = server.JobQueue()
+    waiting = queue.submit("waiting.nc")
+    for _ in range(10):
+        job = queue.submit("job.nc", priority=1)
+        assert queue.next_to_plan() is job
+        queue.planned(job, [])
+        assert queue.next_to_run() is job
+        queue.finished(job)
+    cancelled = queue.submit("cancelled.nc")
+    queue.cancel(cancelled.id)
+
+    assert list(queue.jobs) == [waiting.id, 10, 11, cancelled.id]
+
+
+def test_cancel_while_planning_drops_the_program():
+    queue = server.JobQueue()
+    job = queue.submit("job.nc")
+    assert queue.next_to_plan() is job
+    queue.cancel(job.id)
+    queue.planned(job, ["a program"])
+    assert job.state == server.CANCELLED
+    assert job.program is None
+
+
+def test_runs_submitted_jobs(socket_path, gcode, monkeypatch):
+    monkeypatch.setattr(robot.get_robot(), "scheduler", None)
+    plot_server = server.Server(socket_path)
+    runner = threading.Thread(target=plot_server.run)
+    runner.start()
+    try:
+        reply = server.request({"op": "submit", "path": gcode(["G01 X5 Y5", "G01 X0 Y0"])},
+                               socket_path)
+        assert reply["ok"]
+        for _ in range(500):
+            status = server.request({"op": "status", "job": reply["job"]}, socket_path)["job"]
+            if status["state"] == server.DONE:
+                break
+            time.sleep(0.01)
+        assert (status["state"], status["completed"]) == (server.DONE, 2)
+        assert not server.request({"op": "cancel", "job": reply["job"]}, socket_path)["ok"]
+    finally:
+        server.request({"op": "shutdown"}, socket_path)
+        runner.join(10)
+    assert not os.path.exists(socket_path)
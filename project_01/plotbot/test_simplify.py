@@ -0,0 +1,84 @@
+"""
+--------------------------------------------------------------------------
+test_simplify.py - checks of path simplification
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Checks of path simplification.
+"""
+
+import math
+
+import program
+import simplify
+
+
+def points(prog):
+    """(X, Y, Z) after each move that goes somewhere"""
+    return [(prog.X[i], prog.Y[i], prog.Z[i]) for i in range(len(prog))
+            if prog.distance[i] or prog.dZ[i]]
+
+
+def test_collinear_moves_are_merged(gcode):
+    prog = program.load(gcode(["G01 Z-1", "G01 X1 Y1", "G01 X2 Y2", "G01 X3 Y3",
+                               "G01 X3 Y3", "G01 X3 Y0", "G01 X0 Y0"]))
+    simplified, report = simplify.simplify(prog)
+    assert points(simplified) == [(0, 0, -1), (3, 3, -1), (3, 0, -1), (0, 0, -1)]
+    assert report.deviation == 0
+    assert (report.turns_before, report.turns_after) == (3, 3)
+
+
+def test_doubling_back_is_kept(gcode):
+    prog = program.load(gcode(["G01 Z-1", "G01 X5", "G01 X2", "G01 X4"]))
+    simplified, _ = simplify.simplify(prog)
+    assert [x for x, _, _ in points(simplified)] == [0, 5, 2, 4]
+
+
+def test_tolerance(gcode):
+    # A gentle arc of 20 chords, sagging 0.25 mm from its ends' chord
+    radius = 200.0
+    lines = ["G01 Z-1"] + [f"G01 X{radius * math.sin(k / 200):.4f} "
+                           f"Y{radius - radius * math.cos(k / 200):.4f}" for k in range(1, 21)]
+    prog = program.load(gcode(lines))
+    exact, _ = simplify.simplify(prog, 0.0)
+    assert len(points(exact)) == 21
+    simplified, report = simplify.simplify(prog, 0.3)
+    assert len(points(simplified)) == 2
+    assert 0.2 < report.deviation <= 0.3
+    assert points(simplified)[-1] == points(prog)[-1]
+
+
+def test_pen_moves(gcode):
+    # Repeated lifts collapse to the last; lines at different Zs aren't merged
+    prog = program.load(gcode(["G00 Z1", "G00 Z2", "G00 Z3", "G00 X5", "G01 Z-1",
+                               "G01 X10", "G01 Z-2", "G01 X15"]))
+    simplified, _ = simplify.simplify(prog)
+    assert points(simplified) == [(0, 0, 3), (5, 0, 3), (5, 0, -1), (10, 0, -1),
+                                  (10, 0, -2), (15, 0, -2)]
@@ -0,0 +1,113 @@
+"""
+--------------------------------------------------------------------------
+test_steptrace.py - checks of the step timing traces
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Checks of the step timing trace recorder & analyzer.
+"""
+
+import pytest
+
+import robot
+import steptrace
+
+
+@pytest.fixture
+def bot(sim):
+    bot = robot.build_robot()
+    bot.scheduler = None
+    return bot
+
+
+def test_traces_every_step(bot, tmp_path):
+    tracer = steptrace.Tracer(capacity=1000)
+    original = robot.Stepper.write_mask
+    tracer.install()
+    try:
+        tracer.mark(1)
+        bot.move(2.0)
+        tracer.mark(2)
+        bot.reorient(90)
+    finally:
+        tracer.uninstall()
+    assert robot.Stepper.write_mask is original
+    path = str(tmp_path / "trace")
+    tracer.dump(path)
+
+    records, dropped = steptrace.load(path)
+    assert dropped == 0
+    assert len(records) == tracer.count
+    assert [value for _, value, source in records if source == steptrace.MARKER] == [1, 2]
+    steps = [(value, source) for _, value, source in records if source != steptrace.MARKER]
+    # A step per wheel per tick, each writing its state's mask
+    masks = {bot.left_stepper.masks[i] for i in range(len(bot.left_stepper.states))}
+    assert {source for _, source in steps} == {0, 1}
+    assert {value for value, _ in steps} <= masks
+    times = [t for t, _, _ in records]
+    assert times == sorted(times)
+
+
+def test_full_ring_keeps_the_newest(tmp_path):
+    tracer = steptrace.Tracer(capacity=4)
+    for value in range(10):
+        tracer.record(value, 0)
+    path = str(tmp_path / "trace")
+    tracer.dump(path)
+    records, dropped = steptrace.load(path)
+    assert dropped == 6
+    assert [value for _, value, _ in records] == [6, 7, 8, 9]
+
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / "trace"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        steptrace.load(str(path))
+
+
+def test_analyze_finds_the_stalls():
+    us = 1000
+    marker = steptrace.MARKER
+    records = [(0, 1, marker),
+               (0 * us, 1, 0), (10 * us, 2, 0), (20 * us, 4, 0),
+               (25 * us, 2, marker),
+               (520 * us, 8, 0), (530 * us, 1, 0)]
+    report = steptrace.analyze(records, top=2)
+    assert report["commands"] == 2
+    stats = report["steppers"][0]
+    assert stats["steps"] == 5
+    assert stats["min_us"] == 10
+    assert stats["max_us"] == 500
+    assert stats["mean_us"] == pytest.approx(530 / 4)
+    worst, next_worst = report["stalls"]
+    assert worst == {"gap_us": 500, "stepper": 0, "command": 2, "at_command_boundary": True}
+    assert next_worst["gap_us"] == 10 and not next_worst["at_command_boundary"]
+    assert "500.0 us  stepper 0  command 2 (command boundary)" in steptrace.format_report(report)
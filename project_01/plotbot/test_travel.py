@@ -0,0 +1,95 @@
+"""
+--------------------------------------------------------------------------
+test_travel.py - pen-up travel optimizer tests
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Tests for the pen-up travel optimizer (travel.py)
+"""
+
+import program
+import travel
+
+PEN_UP = "G00 Z2.000"
+PEN_DOWN = "G01 Z-1.000 F400"
+
+
+def stroke(x, lift=True):
+    """A 5 mm pen-down line from (x, 0)"""
+    lines = [f"G00 X{x} Y0", PEN_DOWN, f"G01 X{x + 5} Y0"]
+    return lines + [PEN_UP] if lift else lines
+
+
+def travels_with_pen_down(prog, pen_z=0.0):
+    """The G00 rows that move in XY with the pen down"""
+    return [i for i in range(len(prog))
+            if prog.op[i] == travel.RAPID and prog.distance[i] and prog.Z[i] < pen_z]
+
+
+def test_pen_stays_up_on_travel(gcode):
+    # The last stroke ends the file with the pen down, & would be drawn
+    # second if it could be moved
+    path = gcode([PEN_UP] + stroke(0) + stroke(100) + stroke(10) + stroke(50, lift=False))
+    prog = program.load(path)
+    optimized, report = travel.optimize(prog)
+
+    assert optimized is not prog  # strokes were reordered
+    assert travels_with_pen_down(optimized) == []
+    assert report.travel_after < report.travel_before
+    # The pen-down stroke is still the last thing drawn
+    assert optimized.Z[len(optimized) - 1] < 0
+    assert (optimized.X[len(optimized) - 1], optimized.Y[len(optimized) - 1]) in \
+        ((55.0, 0.0), (50.0, 0.0))
+
+
+def test_nearest_from_far_outside_the_grid(monkeypatch):
+    entries = [((10000.0 + i, 10000.0 + j), (i, j)) for i in range(30) for j in range(30)]
+    index = travel.GridIndex(entries)
+    rings = []
+    ring = travel.GridIndex.ring
+    monkeypatch.setattr(travel.GridIndex, "ring",
+                        staticmethod(lambda cx, cy, r: rings.append(r) or ring(cx, cy, r)))
+
+    found = index.nearest((0.0, 0.0), lambda key: True, k=1)
+
+    assert found[0][1] == (0, 0)
+    assert max(rings) <= index.cells_per_side
+
+
+def test_strokes_keep_their_feedrate(gcode):
+    lines = [PEN_UP]
+    for x, feedrate in ((0, 100), (100, 200), (10, 300)):
+        lines += [f"G00 X{x} Y0", PEN_DOWN, f"G01 X{x + 5} Y0 F{feedrate}", PEN_UP]
+    optimized, _ = travel.optimize(program.load(gcode(lines)))
+
+    drawn = [(optimized.X[i] - optimized.dX[i], optimized.F[i]) for i in range(len(optimized))
+             if optimized.distance[i] and optimized.Z[i] < 0]
+    assert [x for x, _ in drawn] != [0, 100, 10]  # reordered
+    assert sorted(drawn) == [(0, 100), (10, 300), (100, 200)]
@@ -0,0 +1,434 @@
+"""
+--------------------------------------------------------------------------
+travel.py - pen-up travel optimizer
+--------------------------------------------------------------------------
+License:   
+Copyright 2024 - Andrew Bare
+
+Redistribution and use in source and binary forms, with or without 
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice, this 
+list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice, 
+this list of conditions and the following disclaimer in the documentation 
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its contributors 
+may be used to endorse or promote products derived from this software without 
+specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE 
+DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE 
+FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL 
+DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR 
+SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER 
+CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, 
+OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE 
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+--------------------------------------------------------------------------
+
+Pen-up travel optimizer. Splits a ColumnarProgram into strokes (runs of moves
+with the pen down, delimited by Z moves), then reorders them - & reverses
+them where that's allowed - to cut down the pen-up travel between strokes and
+the turning it costs our differential-drive robot.
+
+Strokes are ordered greedily (nearest neighbour, using a grid index over the
+stroke endpoints) and the order is then improved with 2-opt. Travel & turning
+are weighed together in steps, like the robot makes them: turning in place a
+degree costs as much as driving the arc each wheel makes (see
+estimate.Model). The time saved is the difference between estimate.py's
+estimates of the job before & after.
+
+Any non-move command between strokes (dwells, M codes...) stays where it is;
+only strokes between two such commands are reordered among themselves.
+"""
+
+import math
+
+import estimate
+import program
+
+RAPID = program.OPCODE["G00"]
+
+
+def turn(a, b):
+    """Smallest rotation [deg] from heading a to heading b. None is 'any'."""
+    if a is None or b is None:
+        return 0.0
+    return abs((b - a + 180.0) % 360.0 - 180.0)
+
+
+def distance(a, b):
+    return math.hypot(b[0] - a[0], b[1] - a[1])
+
+
+def heading(start, end):
+    if start == end:
+        return None
+    return math.degrees(math.atan2(end[1] - start[1], end[0] - start[0]))
+
+
+class Stroke:
+    """A run of pen-down moves. rows are (op, X, Y, Z, P, F) rows in absolute
+    coordinates; start is where the pen goes down, at feedrate down_f."""
+    def __init__(self, start, down_op, down_z, down_f):
+        self.start = start
+        self.down_op = down_op
+        self.down_z = down_z
+        self.down_f = down_f
+        self.up_op = None
+        self.up_z = None
+        self.up_f = None
+        self.rows = []
+        self.reversible = True
+
+    def points(self):
+        return [self.start] + [(X, Y) for _, X, Y, _, _, _ in self.rows]
+
+    def finish(self):
+        """Work out the endpoints & end headings once all rows are in."""
+        points = self.points()
+        self.end = points[-1]
+        self.first_heading = self.last_heading = None
+        for a, b in zip(points, points[1:]):
+            if a != b:
+                self.first_heading = heading(a, b) if self.first_heading is None else self.first_heading
+                self.last_heading = heading(a, b)
+
+    def entry(self, reverse):
+        """(point, heading) where drawing starts"""
+        if reverse:
+            return self.end, _flip(self.last_heading)
+        return self.start, self.first_heading
+
+    def exit(self, reverse):
+        """(point, heading) where drawing ends"""
+        if reverse:
+            return self.start, _flip(self.first_heading)
+        return self.end, self.last_heading
+
+    def drawn_rows(self, reverse):
+        if not reverse:
+            return self.rows
+        # Segment k goes points[k] -> points[k + 1] with rows[k]'s opcode; in
+        # reverse it goes points[k + 1] -> points[k]
+        points = self.points()
+        rows = []
+        for k in range(len(self.rows) - 1, -1, -1):
+            op, _, _, Z, P, F = self.rows[k]
+            rows.append((op, points[k][0], points[k][1], Z, P, F))
+        return rows
+
+
+def _flip(angle):
+    return None if angle is None else (angle + 180.0) % 360.0 - 180.0
+
+
+def junction(exit, entry, turn_weight):
+    """Cost of travelling (pen up) from one stroke's exit to the next entry."""
+    (end, end_heading), (start, start_heading) = exit, entry
+    travel = distance(end, start)
+    if travel:
+        travel_heading = heading(end, start)
+        turning = turn(end_heading, travel_heading) + turn(travel_heading, start_heading)
+    else:
+        turning = turn(end_heading, start_heading)
+    return travel + turn_weight * turning
+
+
+def split(prog, pen_z=0.0):
+    """Split prog into (prefix rows, items, suffix rows). Items are Strokes or
+    fixed (non-move) rows that act as barriers for reordering."""
+    prefix = []
+    items = []
+    stroke = None
+    seen_travel = False
+    x, y, z = 0.0, 0.0, 0.0
+    last_stroke_item = -1
+    trailing = []  # rows since the last stroke
+
+    for i in range(len(prog)):
+        op = prog.op[i]
+        row = (op, prog.X[i], prog.Y[i], prog.Z[i], prog.P[i], prog.F[i])
+        is_move = op in program.MOVES
+        if stroke is not None:
+            if is_move and row[3] >= pen_z:
+                # Pen up. Any XY motion on this row is travel.
+                stroke.up_op = op
+                stroke.up_z = row[3]
+                stroke.up_f = row[5]
+                stroke.finish()
+                items.append(stroke)
+                last_stroke_item = len(items) - 1
+                stroke = None
+                trailing = []
+            elif is_move:
+                if row[3] != z:
+                    stroke.reversible = False
+                if (row[1], row[2]) != (x, y) or row[3] != z:
+                    stroke.rows.append(row)
+            else:
+                stroke.rows.append(row)
+                stroke.reversible = False
+        elif is_move and row[3] < pen_z:
+            # Pen down; the plunge happens where we are, any XY motion on the
+            # same row is drawn
+            stroke = Stroke((x, y), op, row[3], row[5])
+            if (row[1], row[2]) != (x, y):
+                stroke.rows.append(row)
+            seen_travel = True
+        elif is_move and (row[1], row[2]) != (x, y):
+            # Pen-up travel is regenerated between strokes, but kept after the
+            # last one (e.g. returning home)
+            seen_travel = True
+            trailing.append(row)
+        elif is_move:
+            # Pen-up Z moves before anything happened are setup
+            if not seen_travel:
+                prefix.append(row)
+            else:
+                trailing.append(row)
+        elif not seen_travel:
+            prefix.append(row)
+        else:
+            items.append(row)
+            trailing.append(row)
+        x, y, z = row[1], row[2], row[3]
+
+    if stroke is not None:
+        stroke.finish()
+        items.append(stroke)
+        last_stroke_item = len(items) - 1
+        trailing = []
+
+    # Everything after the last stroke goes back at the end untouched
+    items = items[:last_stroke_item + 1]
+    return prefix, items, trailing
+
+
+class GridIndex:
+    """Uniform grid over stroke entry points for nearest-neighbour lookups."""
+    def __init__(self, entries):
+        # entries: (point, key)
+        xs = [point[0] for point, _ in entries]
+        ys = [point[1] for point, _ in entries]
+        self.x0, self.y0 = min(xs), min(ys)
+        width = max(max(xs) - self.x0, max(ys) - self.y0, 1e-9)
+        self.cells_per_side = max(1, int(math.sqrt(len(entries))))
+        self.size = width / self.cells_per_side * (1 + 1e-9)
+        self.cells = {}
+        for point, key in entries:
+            self.cells.setdefault(self.cell(point), []).append((point, key))
+
+    def cell(self, point):
+        return (int((point[0] - self.x0) / self.size),
+                int((point[1] - self.y0) / self.size))
+
+    def nearest(self, point, alive, k=8):
+        """Up to ~k live entries closest to point, searching outward ring by
+        ring. alive(key) filters out entries that have been used."""
+        # Start from the nearest cell of the grid: a point far outside it would
+        # otherwise scan ring after empty ring on the way in
+        last = self.cells_per_side - 1
+        cx, cy = (min(max(c, 0), last) for c in self.cell(point))
+        found = []
+        ring = 0
+        limit = self.cells_per_side
+        while ring <= limit:
+            for cell in self.ring(cx, cy, ring):
+                entries = self.cells.get(cell)
+                if not entries:
+                    continue
+                live = [entry for entry in entries if alive(entry[1])]
+                if len(live) != len(entries):
+                    self.cells[cell] = live
+                found.extend(live)
+            if found and limit > ring + 1:
+                # One extra ring past the first hit catches closer points that
+                # sit just over a cell boundary
+                limit = ring + 1
+            ring += 1
+        found.sort(key=lambda entry: distance(point, entry[0]))
+        return found[:k]
+
+    @staticmethod
+    def ring(cx, cy, r):
+        if r == 0:
+            yield (cx, cy)
+            return
+        for dx in range(-r, r + 1):
+            yield (cx + dx, cy - r)
+            yield (cx + dx, cy + r)
+        for dy in range(-r + 1, r):
+            yield (cx - r, cy + dy)
+            yield (cx + r, cy + dy)
+
+
+def order(strokes, start, turn_weight, two_opt_limit=500, max_passes=4):
+    """Choose an order & directions for strokes, starting from start =
+    (point, heading). Returns a list of (stroke, reverse)."""
+    if len(strokes) < 2:
+        return [(stroke, False) for stroke in strokes]
+
+    entries = []
+    for index, stroke in enumerate(strokes):
+        entries.append((stroke.start, (index, False)))
+        if stroke.reversible:
+            entries.append((stroke.end, (index, True)))
+    index = GridIndex(entries)
+
+    used = [False] * len(strokes)
+    alive = lambda key: not used[key[0]]
+    tour = []
+    position = start
+    for _ in range(len(strokes)):
+        candidates = index.nearest(position[0], alive)
+        if not candidates:
+            # Shouldn't happen, but never lose a stroke
+            candidates = [(strokes[i].start, (i, False))
+                          for i in range(len(strokes)) if not used[i]]
+        best = min(candidates, key=lambda entry: junction(
+            position, strokes[entry[1][0]].entry(entry[1][1]), turn_weight))
+        i, reverse = best[1]
+        used[i] = True
+        tour.append((strokes[i], reverse))
+        position = strokes[i].exit(reverse)
+
+    if len(tour) <= two_opt_limit:
+        _two_opt(tour, start, turn_weight, max_passes)
+    return tour
+
+
+def _two_opt(tour, start, turn_weight, max_passes):
+    """Reverse sub-sequences of the tour while that lowers the cost. Reversing
+    tour[i..j] flips every stroke in it, which leaves the junctions inside the
+    run with the same cost, so only the two boundary junctions change."""
+    def exit_of(k):
+        return start if k < 0 else tour[k][0].exit(tour[k][1])
+
+    for _ in range(max_passes):
+        improved = False
+        for i in range(len(tour) - 1):
+            if not tour[i][0].reversible:
+                continue
+            for j in range(i + 1, len(tour)):
+                if not tour[j][0].reversible:
+                    break
+                before_i = exit_of(i - 1)
+                a, ra = tour[i]
+                b, rb = tour[j]
+                old = junction(before_i, a.entry(ra), turn_weight)
+                new = junction(before_i, b.entry(not rb), turn_weight)
+                if j + 1 < len(tour):
+                    c, rc = tour[j + 1]
+                    old += junction(b.exit(rb), c.entry(rc), turn_weight)
+                    new += junction(a.exit(not ra), c.entry(rc), turn_weight)
+                if new < old - 1e-9:
+                    tour[i:j + 1] = [(stroke, not reverse) for stroke, reverse in reversed(tour[i:j + 1])]
+                    improved = True
+        if not improved:
+            break
+
+
+def measure(prog, pen_z=0.0):
+    """(pen-up travel [mm], total turning [deg]) of a resolved program"""
+    travel = 0.0
+    turning = 0.0
+    z = 0.0
+    last_heading = 0.0
+    for i in range(len(prog)):
+        if prog.distance[i]:
+            if z >= pen_z:
+                travel += prog.distance[i]
+            turning += turn(last_heading, prog.heading[i])
+            last_heading = prog.heading[i]
+        z = prog.Z[i]
+    return travel, turning
+
+
+class TravelReport:
+    def __init__(self, before, after, time_before, time_after):
+        self.travel_before, self.turning_before = before
+        self.travel_after, self.turning_after = after
+        self.time_before = time_before  # [s] estimated for the whole job
+        self.time_after = time_after
+
+    @property
+    def time_saved(self):
+        return self.time_before - self.time_after
+
+    def __str__(self):
+        return (f"Pen-up travel {self.travel_before:.1f} -> {self.travel_after:.1f} mm, "
+                f"turning {self.turning_before:.0f} -> {self.turning_after:.0f} deg, "
+                f"saves ~{self.time_saved:.1f} s")
+
+
+def optimize(prog, pen_z=0.0, model=None):
+    """Reorder the strokes of a ColumnarProgram. Returns (new program,
+    TravelReport). If the reordering doesn't help (by the estimate.Model's
+    reckoning), the original is returned."""
+    if model is None:
+        model = estimate.Model()
+    # [mm] of travel that costs the steps of a degree of turning
+    turn_weight = model.turn_steps_per_degree * model.step_length
+    prefix, items, suffix = split(prog, pen_z)
+
+    builder = program.ProgramBuilder()
+    for row in prefix:
+        builder.add(*row)
+    x, y = (prefix[-1][1], prefix[-1][2]) if prefix else (0.0, 0.0)
+    position = ((x, y), 0.0)
+
+    group = []
+    def flush():
+        nonlocal position
+        # A stroke that ends the file with the pen down has no pen up to
+        # write after it, so it has to stay last
+        last = group.pop() if group and group[-1].up_z is None else None
+        tour = order(group, position, turn_weight)
+        if last is not None:
+            exit = tour[-1][0].exit(tour[-1][1]) if tour else position
+            reverse = last.reversible and junction(exit, last.entry(True), turn_weight) \
+                < junction(exit, last.entry(False), turn_weight)
+            tour.append((last, reverse))
+        for stroke, reverse in tour:
+            point, _ = stroke.entry(reverse)
+            builder.add(RAPID, point[0], point[1], F=stroke.down_f)
+            builder.add(stroke.down_op, Z=stroke.down_z, F=stroke.down_f)
+            for row in stroke.drawn_rows(reverse):
+                builder.add(*row)
+            if stroke.up_z is not None:
+                builder.add(stroke.up_op, Z=stroke.up_z, F=stroke.up_f)
+            position = stroke.exit(reverse)
+        group.clear()
+
+    for item in items:
+        if isinstance(item, Stroke):
+            group.append(item)
+        else:
+            flush()
+            builder.add(*item)
+    flush()
+    for row in suffix:
+        builder.add(*row)
+
+    optimized = builder.resolve()
+    before = measure(prog, pen_z)
+    time_before = estimate.estimate(prog, model).seconds
+    time_after = estimate.estimate(optimized, model).seconds
+    if time_after >= time_before:
+        return prog, TravelReport(before, before, time_before, time_before)
+    return optimized, TravelReport(before, measure(optimized, pen_z), time_before, time_after)
+
+
+if __name__ == "__main__":
+    import sys
+
+    prog = program.load(sys.argv[1] if len(sys.argv) > 1 else "square.nc")
+    optimized, report = optimize(prog)
+    print(f"{len(prog)} -> {len(optimized)} commands")
+    print(report)
@@ -47,19 +47,30 @@ configuration, press_low=False.
 
 Software API:
 
-  Button(pin, press_low)
+  Button(pin, press_low, sleep_time, gpio, edge_triggered, bouncetime)
     - Provide pin that the button monitors
+    - gpio is the GPIO module/backend to use (Adafruit_BBIO.GPIO by default);
+      pass e.g. plotbot's gpio.SimGPIO() to run without hardware
+    - edge_triggered (default) uses GPIO edge detection: waiting sleeps until
+      the pin changes instead of polling it every sleep_time, so a press is
+      seen straight away & waiting takes no CPU. If edge detection can't be
+      set up, the button falls back to polling. bouncetime [ms] is passed to
+      the edge detection to debounce.
     
     wait_for_press()
-      - Wait for the button to be pressed 
+      - Wait for the button to be pressed (& released)
       - Function consumes time
+
+    await wait_for_press_async()
+      - The same, for asyncio: other tasks run while waiting
         
     is_pressed()
       - Return a boolean value (i.e. True/False) on if button is pressed
       - Function consumes no time
     
     get_last_press_duration()
-      - Return the duration the button was last pressed
+      - Return the duration the button was last pressed [s] (from
+        time.monotonic(), so clock changes don't affect it)
 
     cleanup()
       - Clean up HW
@@ -73,6 +84,8 @@ Software API:
         - Excuted every "sleep_time" while the button is pressed
       - set_unpressed_callback(function)
         - Excuted every "sleep_time" while the button is unpressed
+        (when edge triggered, waiting only wakes every "sleep_time" if one of
+        these two is set)
       - set_on_press_callback(function)
         - Executed once when the button is pressed
       - set_on_release_callback(function)
@@ -85,16 +98,21 @@ Software API:
 
 
 """
+import asyncio
+import threading
 import time
 
-import Adafruit_BBIO.GPIO as GPIO
+try:
+    import Adafruit_BBIO.GPIO as GPIO
+except ImportError:
+    GPIO = None  # Not on the PocketBeagle; Button needs a gpio backend passed in
 
 # ------------------------------------------------------------------------
 # Constants
 # ------------------------------------------------------------------------
 
-HIGH          = GPIO.HIGH
-LOW           = GPIO.LOW
+HIGH          = 1
+LOW           = 0
 
 # ------------------------------------------------------------------------
 # Global variables
@@ -109,6 +127,7 @@ LOW           = GPIO.LOW
 class Button():
     """ Button Class """
     pin                           = None
+    gpio                          = None
     
     unpressed_value               = None
     pressed_value                 = None
@@ -116,6 +135,9 @@ class Button():
     sleep_time                    = None
     press_duration                = None
 
+    edge_triggered                = None
+    bouncetime                    = None
+
     pressed_callback              = None
     pressed_callback_value        = None
     unpressed_callback            = None
@@ -126,12 +148,19 @@ class Button():
     on_release_callback_value     = None
     
     
-    def __init__(self, pin=None, press_low=True, sleep_time=0.1):
+    def __init__(self, pin=None, press_low=True, sleep_time=0.1, gpio=None,
+                 edge_triggered=True, bouncetime=0):
         """ Initialize variables and set up the button """
         if (pin == None):
             raise ValueError("Pin not provided for Button()")
         else:
             self.pin = pin
+
+        if gpio is None:
+            gpio = GPIO
+        if gpio is None:
+            raise RuntimeError("Adafruit_BBIO.GPIO not available; provide gpio for Button()")
+        self.gpio = gpio
         
         # For pull up resistor configuration:    press_low = True
         # For pull down resistor configuration:  press_low = False
@@ -146,6 +175,9 @@ class Button():
         self.sleep_time      = sleep_time
         self.press_duration  = 0.0        
 
+        self.edge_triggered  = edge_triggered
+        self.bouncetime      = bouncetime
+
         # Initialize the hardware components        
         self._setup()
     
@@ -157,7 +189,51 @@ class Button():
         # Initialize Button
         # HW#4 TODO: (one line of code)
         #   Remove "pass" and use the Adafruit_BBIO.GPIO library to set up the button
-        GPIO.setup("P2_2", GPIO.IN)
+        self.gpio.setup(self.pin, self.gpio.IN)
+
+        if self.edge_triggered:
+            # State kept up to date by the edge callback: whether the button
+            # is pressed, how many presses & releases there have been & when
+            # the last ones were (time.monotonic())
+            self._condition    = threading.Condition()
+            self._pressed      = self.is_pressed()
+            self._presses      = 0
+            self._releases     = 0
+            self._press_time   = time.monotonic() if self._pressed else None
+            self._release_time = None
+            self._waiters      = set()    # (event loop, future) of async waits
+            try:
+                self.gpio.add_event_detect(self.pin, self.gpio.BOTH, callback=self._edge,
+                                           bouncetime=self.bouncetime)
+            except (AttributeError, RuntimeError):
+                # No edge detection on this pin / backend
+                self.edge_triggered = False
+
+    # End def
+
+
+    def _edge(self, pin):
+        """ Edge detection callback (runs on the GPIO library's thread) """
+        now     = time.monotonic()
+        pressed = self.is_pressed()
+        
+        with self._condition:
+            if pressed == self._pressed:
+                return                    # bounce, or an edge we already saw
+            
+            self._pressed = pressed
+            if pressed:
+                self._presses    += 1
+                self._press_time  = now
+            else:
+                self._releases     += 1
+                self._release_time  = now
+            
+            self._condition.notify_all()
+            waiters = list(self._waiters)
+        
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
 
     # End def
 
@@ -171,7 +247,7 @@ class Button():
         # HW#4 TODO: (one line of code)
         #   Remove "pass" and return the comparison of input value of the GPIO pin of 
         #   the buton (i.e. self.pin) to the "pressed value" of the class 
-        return self.pin == GPIO.HIGH
+        return self.gpio.input(self.pin) == self.pressed_value
 
     # End def
 
@@ -188,6 +264,10 @@ class Button():
            Arguments:  None
            Returns:    None
         """
+        if self.edge_triggered:
+            self._wait_for_press_edges()
+            return
+        
         button_press_time = None
         
         # Wait for button press
@@ -199,7 +279,7 @@ class Button():
         #   of the class (i.e. we are executing the while loop while the 
         #   button is not being pressed)
         #
-        while self.pin == GPIO.LOW:
+        while self.gpio.input(self.pin) == self.unpressed_value:
         
             if self.unpressed_callback is not None:
                 self.unpressed_callback_value = self.unpressed_callback()
@@ -207,7 +287,7 @@ class Button():
             time.sleep(self.sleep_time)
             
         # Record time
-        button_press_time = time.time()
+        button_press_time = time.monotonic()
         
         # Executed the on press callback function
         if self.on_press_callback is not None:
@@ -222,7 +302,7 @@ class Button():
         #   of the class (i.e. we are executing the while loop while the 
         #   button is being pressed)
         #
-        while self.pin == GPIO.HIGH:
+        while self.gpio.input(self.pin) == self.pressed_value:
         
             if self.pressed_callback is not None:
                 self.pressed_callback_value = self.pressed_callback()
@@ -230,7 +310,7 @@ class Button():
             time.sleep(self.sleep_time)
         
         # Record the press duration
-        self.press_duration = time.time() - button_press_time
+        self.press_duration = time.monotonic() - button_press_time
 
         # Executed the on release callback function
         if self.on_release_callback is not None:
@@ -238,6 +318,147 @@ class Button():
         
     # End def
 
+
+    def _wait_for_press_edges(self):
+        """ wait_for_press(), sleeping until edges instead of polling """
+        with self._condition:
+            presses = self._presses
+        
+        # Wait for button press, then for its release
+        for pressed in (False, True):
+            while True:
+                with self._condition:
+                    if not self._waiting(pressed, presses):
+                        break
+                
+                timeout = self._run_waiting_callback(pressed)
+                
+                with self._condition:
+                    self._condition.wait_for(lambda: not self._waiting(pressed, presses),
+                                             timeout)
+            
+            if not pressed:
+                self._run_on_press_callback()
+        
+        self._finish_press()
+        
+    # End def
+
+
+    async def wait_for_press_async(self):
+        """ wait_for_press() for asyncio: waits for the button to be 
+           pressed and released, letting other tasks run meanwhile.
+        
+           Arguments:  None
+           Returns:    None
+        """
+        if not self.edge_triggered:
+            await self._wait_for_press_polling_async()
+            return
+        
+        loop = asyncio.get_running_loop()
+        
+        with self._condition:
+            presses = self._presses
+        
+        # Wait for button press, then for its release.  The future is
+        # registered before the state is checked, so no edge is missed.
+        for pressed in (False, True):
+            while True:
+                future = loop.create_future()
+                
+                with self._condition:
+                    if not self._waiting(pressed, presses):
+                        break
+                    self._waiters.add((loop, future))
+                
+                try:
+                    timeout = self._run_waiting_callback(pressed)
+                    await asyncio.wait([future], timeout=timeout)
+                finally:
+                    with self._condition:
+                        self._waiters.discard((loop, future))
+            
+            if not pressed:
+                self._run_on_press_callback()
+        
+        self._finish_press()
+        
+    # End def
+
+
+    async def _wait_for_press_polling_async(self):
+        """ wait_for_press_async() for buttons without edge detection """
+        while self.gpio.input(self.pin) == self.unpressed_value:
+            self._run_waiting_callback(False)
+            await asyncio.sleep(self.sleep_time)
+        
+        button_press_time = time.monotonic()
+        self._run_on_press_callback()
+        
+        while self.gpio.input(self.pin) == self.pressed_value:
+            self._run_waiting_callback(True)
+            await asyncio.sleep(self.sleep_time)
+        
+        self.press_duration = time.monotonic() - button_press_time
+        
+        if self.on_release_callback is not None:
+            self.on_release_callback_value = self.on_release_callback()
+        
+    # End def
+
+
+    def _waiting(self, pressed, presses):
+        """ Still waiting for a press (pressed=False) that wasn't one of the
+           first presses presses, or for the release (pressed=True)?  Call 
+           with self._condition held.
+        """
+        if pressed:
+            return self._pressed
+        
+        # A press & release between two checks still counts
+        return not self._pressed and self._presses == presses
+
+    # End def
+
+
+    def _run_waiting_callback(self, pressed):
+        """ Run the pressed / unpressed callback.  Returns how long to wait
+           before running it again (None if there's no callback to run).
+        """
+        if pressed:
+            if self.pressed_callback is None:
+                return None
+            self.pressed_callback_value = self.pressed_callback()
+        else:
+            if self.unpressed_callback is None:
+                return None
+            self.unpressed_callback_value = self.unpressed_callback()
+        
+        return self.sleep_time
+
+    # End def
+
+
+    def _run_on_press_callback(self):
+        if self.on_press_callback is not None:
+            self.on_press_callback_value = self.on_press_callback()
+    
+    # End def
+
+
+    def _finish_press(self):
+        """ Record the press duration (from the edge times) & run the on
+           release callback 
+        """
+        with self._condition:
+            self.press_duration = self._release_time - self._press_time
+        
+        if self.on_release_callback is not None:
+            self.on_release_callback_value = self.on_release_callback()
+    
+    # End def
+
     
     def get_last_press_duration(self):
         """ Return the last press duration """
@@ -248,8 +469,8 @@ class Button():
     
     def cleanup(self):
         """ Clean up the button hardware. """
-        # Nothing to do for GPIO
-        pass
+        if self.edge_triggered:
+            self.gpio.remove_event_detect(self.pin)
     
     # End def
     
@@ -309,13 +530,20 @@ class Button():
 # End class
 
 
+def _wake(future):
+    """ Finish an async wait (on its event loop) """
+    if not future.done():
+        future.set_result(None)
+
+# End def
+
+
 
 # ------------------------------------------------------------------------
 # Main script
 # ------------------------------------------------------------------------
 
 if __name__ == '__main__':
-
     print("Button Test")
 
     # Create instantiation of the button
@@ -0,0 +1,145 @@
+"""
+--------------------------------------------------------------------------
+Button Driver Tests
+--------------------------------------------------------------------------
+
+  Tests of the Button driver on scripted GPIO, so no hardware is needed.
+Run with pytest from this directory.  The presses are made from the button's
+own callbacks (or another thread), so nothing depends on how fast this 
+machine is.
+"""
+import asyncio
+import threading
+
+import pytest
+
+from button import Button, HIGH, LOW
+
+
+class ScriptedGPIO():
+    """ Just enough of Adafruit_BBIO.GPIO to run a Button without hardware.
+        set_input() changes a pin's level & runs its edge callback, like a
+        press would.  edge_detection=False makes add_event_detect() fail, so
+        the Button polls.
+    """
+    IN                            = "in"
+    BOTH                          = "both"
+    
+    def __init__(self, edge_detection=True):
+        self.edge_detection = edge_detection
+        self.levels         = {}
+        self.callbacks      = {}
+    
+    def setup(self, pin, direction):
+        self.levels.setdefault(pin, HIGH)
+    
+    def input(self, pin):
+        return self.levels[pin]
+    
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=0):
+        if not self.edge_detection:
+            raise RuntimeError("No edge detection")
+        self.callbacks[pin] = callback
+    
+    def remove_event_detect(self, pin):
+        self.callbacks.pop(pin, None)
+    
+    def set_input(self, pin, value):
+        changed          = self.levels.get(pin) != value
+        self.levels[pin] = value
+        callback         = self.callbacks.get(pin)
+        if changed and callback is not None:
+            callback(pin)
+
+# End class
+
+
+def make_button(script, edge_detection=True):
+    """ A pull up button on P2_2 whose unpressed / pressed callbacks log
+        their calls & make the edges in script: {(pressed, call number):
+        levels to set}.  Returns the GPIO, the button & the event log.
+    """
+    gpio   = ScriptedGPIO(edge_detection)
+    button = Button("P2_2", sleep_time=0.01, gpio=gpio)
+    events = []
+    
+    def waiting(pressed):
+        name = "pressed" if pressed else "unpressed"
+        events.append(name)
+        for value in script.get((pressed, events.count(name)), ()):
+            gpio.set_input("P2_2", value)
+        return name
+    
+    button.set_unpressed_callback(lambda: waiting(False))
+    button.set_pressed_callback(lambda: waiting(True))
+    button.set_on_press_callback(lambda: events.append("on press") or 3)
+    button.set_on_release_callback(lambda: events.append("on release") or 4)
+    return gpio, button, events
+
+# End def
+
+
+# Pressed on the 2nd check, released on the 1st check while pressed
+PRESS    = {(False, 2): [LOW], (True, 1): [HIGH]}
+IN_ORDER = ["unpressed", "unpressed", "on press", "pressed", "on release"]
+
+
+@pytest.mark.parametrize("edge_detection", [True, False])
+def test_callbacks_in_order(edge_detection):
+    gpio, button, events = make_button(PRESS, edge_detection)
+    assert button.edge_triggered == edge_detection
+    button.wait_for_press()
+    assert events == IN_ORDER
+    assert button.get_unpressed_callback_value() == "unpressed"
+    assert button.get_pressed_callback_value() == "pressed"
+    assert button.get_on_press_callback_value() == 3
+    assert button.get_on_release_callback_value() == 4
+    assert not button.is_pressed()
+
+
+def test_each_wait_is_one_press():
+    gpio, button, events = make_button({(False, 2): [LOW], (True, 1): [HIGH],
+                                        (False, 3): [LOW], (True, 2): [HIGH]})
+    button.wait_for_press()
+    assert events == IN_ORDER
+    button.wait_for_press()
+    assert events == IN_ORDER + ["unpressed", "on press", "pressed", "on release"]
+
+
+def test_short_tap_is_seen():
+    # A press & release between two checks still counts
+    gpio, button, events = make_button({(False, 1): [LOW, HIGH]})
+    button.wait_for_press()
+    assert events == ["unpressed", "on press", "on release"]
+
+
+def test_woken_by_another_thread():
+    # Without callbacks the wait sleeps until an edge
+    gpio, button, events = make_button({})
+    button.set_unpressed_callback(None)
+    button.set_pressed_callback(None)
+    
+    def press():
+        gpio.set_input("P2_2", LOW)
+        threading.Timer(0.05, gpio.set_input, ("P2_2", HIGH)).start()
+    
+    threading.Timer(0.05, press).start()
+    button.wait_for_press()
+    assert events == ["on press", "on release"]
+    assert 0.04 <= button.get_last_press_duration() < 1
+
+
+def test_async_wait_lets_other_tasks_run():
+    gpio, button, events = make_button({(False, 3): [LOW], (True, 1): [HIGH]})
+    
+    async def count_while_waiting():
+        counts  = 0
+        waiting = asyncio.ensure_future(button.wait_for_press_async())
+        while not waiting.done():
+            counts += 1
+            await asyncio.sleep(0)
+        return counts
+    
+    counts = asyncio.run(count_while_waiting())
+    assert events == ["unpressed"] + IN_ORDER
+    assert counts > 0